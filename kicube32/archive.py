@@ -0,0 +1,172 @@
+# This file is licensed using the "MIT License" below:
+#
+# ##################################################################################################
+#
+# MIT License
+#
+# Copyright 2019-2020 Home Brew Robotics Club
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies
+# or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# ##################################################################################################
+# <======================================= 100 characters =======================================> #
+
+
+"""archive: Read kicube32 inputs directly out of zip and tar archives.
+
+An archive member is named by the archive file name, '!/', and the member name within
+the archive (e.g. 'bundle.zip!/f767zi.ioc' or 'rev3.tar.gz!/board/f767zi.csv'.)  Members are
+read into memory, so nothing is extracted to disk.  Since members have no file system
+modification time, the archive entry time stamp is used instead.
+"""
+
+from typing import Dict, IO, List, Optional, Tuple, Union
+
+import os
+import tarfile
+import threading
+import time
+import zipfile
+
+ARCHIVE_SEPARATOR: str = "!/"
+ARCHIVE_SUFFIXES: Tuple[str, ...] = (
+    ".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+
+# archive_file_name_is():
+def archive_file_name_is(file_name: str) -> bool:
+    """Return True if a file name has a zip or tar archive suffix."""
+    return file_name.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+# archive_split():
+def archive_split(file_name: str) -> Tuple[str, str]:
+    """Split 'ARCHIVE!/MEMBER' into ('ARCHIVE', 'MEMBER').
+
+    ('', '') is returned if *file_name* does not name an archive member.
+    """
+    separator_index: int = file_name.find(ARCHIVE_SEPARATOR)
+    if separator_index > 0 and archive_file_name_is(file_name[:separator_index]):
+        return (file_name[:separator_index],
+                file_name[separator_index + len(ARCHIVE_SEPARATOR):])
+    return "", ""
+
+
+# ArchiveReader:
+class ArchiveReader:
+    """Reads members from zip and tar archives, keeping each archive open for reuse."""
+
+    # ArchiveReader.__init__():
+    def __init__(self) -> None:
+        """Initialize an ArchiveReader with no archives open."""
+        # archive_reader: ArchiveReader = self
+        self.archives_table: Dict[str, Union[zipfile.ZipFile, tarfile.TarFile]] = {}
+        # Neither *tarfile* nor *zipfile* objects are safe to share between threads:
+        self.lock: threading.Lock = threading.Lock()
+
+    # ArchiveReader.archive_open():
+    def archive_open(self, archive_file_name: str) -> Union[zipfile.ZipFile, tarfile.TarFile]:
+        """Return the open archive for an archive file name; the lock must be held."""
+        archive_reader: ArchiveReader = self
+        archives_table: Dict[str, Union[zipfile.ZipFile, tarfile.TarFile]]
+        archives_table = archive_reader.archives_table
+        archive: Optional[Union[zipfile.ZipFile, tarfile.TarFile]]
+        archive = archives_table.get(archive_file_name)
+        if archive is None:
+            if archive_file_name.lower().endswith(".zip"):
+                archive = zipfile.ZipFile(archive_file_name)
+            else:
+                archive = tarfile.open(archive_file_name)
+            archives_table[archive_file_name] = archive
+        return archive
+
+    # ArchiveReader.close():
+    def close(self) -> None:
+        """Close all of the open archives."""
+        archive_reader: ArchiveReader = self
+        with archive_reader.lock:
+            archive: Union[zipfile.ZipFile, tarfile.TarFile]
+            for archive in archive_reader.archives_table.values():
+                archive.close()
+            archive_reader.archives_table.clear()
+
+    # ArchiveReader.member_names():
+    def member_names(self, archive_file_name: str, suffix: str = "") -> List[str]:
+        """Return the 'ARCHIVE!/MEMBER' names of the archive members ending in a suffix."""
+        archive_reader: ArchiveReader = self
+        with archive_reader.lock:
+            archive: Union[zipfile.ZipFile, tarfile.TarFile]
+            archive = archive_reader.archive_open(archive_file_name)
+            names: List[str]
+            if isinstance(archive, zipfile.ZipFile):
+                names = [info.filename for info in archive.infolist() if not info.is_dir()]
+            else:
+                names = [info.name for info in archive.getmembers() if info.isfile()]
+        return sorted([archive_file_name + ARCHIVE_SEPARATOR + name
+                       for name in names if name.endswith(suffix)])
+
+    # ArchiveReader.member_read():
+    def member_read(self, file_name: str) -> Tuple[bytes, float]:
+        """Return the contents and time stamp of an 'ARCHIVE!/MEMBER'.
+
+        *FileNotFoundError* is raised if the member does not exist.
+        """
+        archive_reader: ArchiveReader = self
+        archive_file_name: str
+        member_name: str
+        archive_file_name, member_name = archive_split(file_name)
+        assert archive_file_name != "", f"'{file_name}' is not an archive member"
+        with archive_reader.lock:
+            archive: Union[zipfile.ZipFile, tarfile.TarFile]
+            archive = archive_reader.archive_open(archive_file_name)
+            contents: bytes
+            timestamp: float
+            try:
+                if isinstance(archive, zipfile.ZipFile):
+                    zip_info: zipfile.ZipInfo = archive.getinfo(member_name)
+                    contents = archive.read(zip_info)
+                    timestamp = time.mktime(zip_info.date_time + (0, 0, -1))
+                else:
+                    tar_info: tarfile.TarInfo = archive.getmember(member_name)
+                    member_file: Optional[IO[bytes]] = archive.extractfile(tar_info)
+                    if member_file is None:
+                        raise KeyError(member_name)
+                    contents = member_file.read()
+                    timestamp = float(tar_info.mtime)
+            except KeyError:
+                raise FileNotFoundError(f"No member '{member_name}' in '{archive_file_name}'")
+        return contents, timestamp
+
+
+# text_read():
+def text_read(file_name: str,
+              archive_reader: Optional[ArchiveReader] = None) -> Tuple[str, float]:
+    """Return the text and time stamp of a file or an 'ARCHIVE!/MEMBER'.
+
+    An *archive_reader* can be provided to keep archives open between reads.
+    """
+    if archive_split(file_name)[0] == "":
+        with open(file_name, "r") as text_file:
+            return text_file.read(), os.path.getmtime(file_name)
+    reader: ArchiveReader = archive_reader if archive_reader is not None else ArchiveReader()
+    contents: bytes
+    timestamp: float
+    contents, timestamp = reader.member_read(file_name)
+    if archive_reader is None:
+        reader.close()
+    return contents.decode("utf-8"), timestamp
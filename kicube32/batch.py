@@ -0,0 +1,486 @@
+# This file is licensed using the "MIT License" below:
+#
+# ##################################################################################################
+#
+# MIT License
+#
+# Copyright 2019-2020 Home Brew Robotics Club
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies
+# or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# ##################################################################################################
+# <======================================= 100 characters =======================================> #
+
+
+"""batch: Generate kipart files for many STM32CubeMX projects with overlapped file I/O.
+
+Usage: kicube32 batch [--jobs N] [--output-directory DIR] [--footprint FOOTPRINT ...]
+                      [--pins-db PINS.db] [--dcm FILE.dcm] [--quiet] [--json] [--strict]
+                      [--metrics FILE.prom|FILE.json [--metrics-interval SECONDS]]
+                      [--snapshots] PROJECT.ioc|DIR|ARCHIVE ...
+
+Each project is a `BASE.ioc` file with a matching `BASE.csv` file in the same directory.
+The `BASE.kipart.csv` output is written next to the `.ioc` file (or into DIR.)  Projects can
+also be read from zip/tar archives, either as 'ARCHIVE!/BASE.ioc' or by naming the archive,
+which selects every `.ioc` member.  The output for an archive member is named
+`ARCHIVE_BASE.kipart.csv` and written next to the archive (or into DIR.)
+
+Project trees frequently live on high latency network file systems, so the reads are issued
+ahead from a thread pool with at most N reads in flight and at most N projects read ahead of
+the one being parsed.  The projects are parsed in order on a separate thread as their inputs
+arrive, so the reads and writes continue while a project is parsed.  Each output write is
+started without waiting for it to finish.  A project that can not be read or parsed is
+reported as an error and the remaining projects are still generated.
+
+With `--snapshots`, a `BASE.kicube` snapshot of the classified and bound pins (see
+`kicube32.kicube_snapshot`) is kept next to each `BASE.kipart.csv` file.  A snapshot that
+matches the current inputs is reused instead of classifying the project again, and is only
+rewritten when it does not match.
+
+With `--metrics`, the run metrics are written every `--metrics-interval` seconds while the
+projects are processed, and once more at the end.
+"""
+
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Text, Tuple, TypeVar
+
+import argparse
+import asyncio
+import concurrent.futures
+import hashlib
+import os
+from pathlib import Path
+
+from kicube32.archive import ArchiveReader, archive_file_name_is, archive_split, text_read
+from kicube32.doc_library import DocLibrary, component_lines
+from kicube32.kicube32 import Diagnostics, FootprintBinding, IOC, KiCube
+from kicube32.kicube_snapshot import snapshot_bytes, snapshot_load
+from kicube32.metrics import Metrics
+
+Result = TypeVar("Result")
+
+# The (`.ioc` contents, `.csv` contents, `.kicube` snapshot) of a project, where each text is
+# (text, time stamp) and the snapshot is empty if there is none:
+ProjectContents = Tuple[Tuple[str, float], Tuple[str, float], bytes]
+
+
+# BatchIO:
+class BatchIO:
+    """Runs blocking file reads and writes in a thread pool with a limit on requests in flight."""
+
+    # BatchIO.__init__():
+    def __init__(self, in_flight_limit: int) -> None:
+        """Initialize a BatchIO with at most *in_flight_limit* concurrent requests."""
+        # batch_io: BatchIO = self
+        self.executor: concurrent.futures.ThreadPoolExecutor = (
+            concurrent.futures.ThreadPoolExecutor(max_workers=in_flight_limit))
+        self.semaphore: asyncio.Semaphore = asyncio.Semaphore(in_flight_limit)
+        # Projects are parsed one at a time, in order, off of the event loop:
+        self.parse_executor: concurrent.futures.ThreadPoolExecutor = (
+            concurrent.futures.ThreadPoolExecutor(max_workers=1))
+        self.archive_reader: ArchiveReader = ArchiveReader()
+        self.bytes_read: int = 0
+        self.bytes_written: int = 0
+
+    # BatchIO.close():
+    def close(self) -> None:
+        """Wait for all requests to finish and shut down the thread pool."""
+        batch_io: BatchIO = self
+        batch_io.executor.shutdown(wait=True)
+        batch_io.parse_executor.shutdown(wait=True)
+        batch_io.archive_reader.close()
+
+    # BatchIO.run():
+    async def run(self, function: Callable[..., Result], *arguments: Any) -> Result:
+        """Run a blocking function in the thread pool once a request slot is available."""
+        batch_io: BatchIO = self
+        async with batch_io.semaphore:
+            loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+            return await loop.run_in_executor(batch_io.executor, function, *arguments)
+
+    # BatchIO.text_read():
+    async def text_read(self, file_name: str) -> Tuple[str, float]:
+        """Return the contents and time stamp of a text file or archive member."""
+        batch_io: BatchIO = self
+        text: str
+        timestamp: float
+        text, timestamp = await batch_io.run(text_read, file_name, batch_io.archive_reader)
+        batch_io.bytes_read += len(text.encode())
+        return text, timestamp
+
+    # BatchIO.file_read():
+    async def file_read(self, file_name: str) -> bytes:
+        """Return the contents of a file, or no bytes if it can not be read."""
+        batch_io: BatchIO = self
+        contents: bytes
+        try:
+            contents = await batch_io.run(Path(file_name).read_bytes)
+        except OSError:
+            return b""
+        batch_io.bytes_read += len(contents)
+        return contents
+
+    # BatchIO.bytes_write():
+    async def bytes_write(self, file_name: str, contents: bytes) -> None:
+        """Write bytes to a file."""
+        batch_io: BatchIO = self
+        await batch_io.run(Path(file_name).write_bytes, contents)
+        batch_io.bytes_written += len(contents)
+
+    # BatchIO.parse():
+    async def parse(self, function: Callable[..., Result], *arguments: Any) -> Result:
+        """Run a CPU bound function on the parse thread so the event loop keeps doing I/O."""
+        batch_io: BatchIO = self
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        return await loop.run_in_executor(batch_io.parse_executor, function, *arguments)
+
+    # BatchIO.text_write():
+    async def text_write(self, file_name: str, text: str) -> None:
+        """Write text to a file as UTF-8."""
+        batch_io: BatchIO = self
+        await batch_io.bytes_write(file_name, text.encode())
+
+
+# project_names():
+def project_names(ioc_file_name: str, output_directory: str) -> Tuple[str, str]:
+    """Return the project name and the output file name prefix for a project `.ioc` file."""
+    base_name: str = os.path.basename(ioc_file_name)[:-4]
+    archive_file_name: str = archive_split(ioc_file_name)[0]
+    if archive_file_name == "":
+        return base_name, os.path.join(output_directory or os.path.dirname(ioc_file_name),
+                                       base_name)
+    archive_base_name: str = os.path.basename(archive_file_name).split('.')[0]
+    return (f"{archive_base_name}/{base_name}",
+            os.path.join(output_directory or os.path.dirname(archive_file_name),
+                         f"{archive_base_name}_{base_name}"))
+
+
+# project_read():
+async def project_read(batch_io: BatchIO, ioc_file_name: str,
+                       snapshot_file_name: str = "") -> ProjectContents:
+    """Read the `.ioc`, `.csv` and (optional) `.kicube` snapshot files of a project concurrently."""
+    csv_file_name: str = ioc_file_name[:-4] + ".csv"
+    ioc_read: Awaitable[Tuple[str, float]] = batch_io.text_read(ioc_file_name)
+    csv_read: Awaitable[Tuple[str, float]] = batch_io.text_read(csv_file_name)
+    snapshot_read: Awaitable[bytes] = (batch_io.file_read(snapshot_file_name)
+                                       if snapshot_file_name else asyncio.sleep(0, b""))
+    ioc_contents: Tuple[str, float]
+    csv_contents: Tuple[str, float]
+    snapshot_data: bytes
+    ioc_contents, csv_contents, snapshot_data = await asyncio.gather(ioc_read, csv_read,
+                                                                     snapshot_read)
+    return ioc_contents, csv_contents, snapshot_data
+
+
+# project_generate():
+def project_generate(ioc_file_name: str, contents: ProjectContents, footprints: List[str],
+                     project_diagnostics: Diagnostics, metrics: Metrics, snapshots: bool
+                     ) -> Optional[Tuple[KiCube, List[Tuple[str, FootprintBinding, str]],
+                                         Optional[bytes]]]:
+    """Parse one project and format its outputs.
+
+    The (kicube, outputs, snapshot) of the project are returned, where each output is
+    (file name suffix, footprint binding, kipart `.csv` text) and snapshot is the new `.kicube`
+    snapshot contents (or None if *snapshots* is False or the old snapshot is still current.)
+    None is returned if the project can not be parsed or its `.csv` file is stale; the problem
+    is reported to *project_diagnostics*.  This runs on the parse thread, so it does no I/O.
+    """
+    ioc_contents: Tuple[str, float]
+    csv_contents: Tuple[str, float]
+    snapshot_data: bytes
+    ioc_contents, csv_contents, snapshot_data = contents
+    csv_file_name: str = ioc_file_name[:-4] + ".csv"
+    ioc_hash: bytes = hashlib.sha256(ioc_contents[0].encode()).digest()
+    csv_hash: bytes = hashlib.sha256(csv_contents[0].encode()).digest()
+    try:
+        with metrics.stage("ioc-parse"):
+            ioc: IOC = IOC(ioc_file_name, ioc_text=ioc_contents[0], timestamp=ioc_contents[1])
+
+        # Reuse the classified pins of a snapshot that matches the current inputs:
+        previous: Optional[Tuple[KiCube, List[FootprintBinding]]] = None
+        if snapshots:
+            if snapshot_data:
+                with metrics.stage("snapshot-load"):
+                    previous = snapshot_load(snapshot_data, ioc_hash, csv_hash, csv_contents[1])
+            metrics.count("kicube32_cache_hits_total" if previous is not None
+                          else "kicube32_cache_misses_total", cache="snapshot")
+        if previous is not None:
+            kicube: KiCube = previous[0]
+            project_diagnostics.merge(kicube.diagnostics)
+            kicube.diagnostics = project_diagnostics
+        else:
+            with metrics.stage("classify"):
+                kicube = KiCube(ioc_file_name, csv_file_name, ioc.mcu_name,
+                                ioc.board_name, ioc.package,
+                                diagnostics=project_diagnostics,
+                                csv_text=csv_contents[0], timestamp=csv_contents[1])
+            metrics.kicube_record(kicube)
+    except (AssertionError, IndexError, KeyError, ValueError) as error:
+        project_diagnostics.error("unparsable-project",
+                                  f"Can not parse '{ioc_file_name}': {error!r}")
+        return None
+
+    # Archive entry time stamps only have 1 or 2 second resolution:
+    archived: bool = archive_split(ioc_file_name)[0] != ""
+    ioc_changed: bool = (ioc.timestamp > kicube.timestamp if archived else
+                         ioc.timestamp >= kicube.timestamp)
+    if ioc_changed:
+        project_diagnostics.error("stale-csv", f"File '{ioc_file_name}' has changed! "
+                                  f"Please update file '{csv_file_name}'!!!")
+        return None
+
+    # Footprints that are already bound in the *previous* snapshot are not bound again:
+    previous_bindings: Dict[str, FootprintBinding] = {}
+    if previous is not None:
+        previous_bindings = {footprint_binding.footprint: footprint_binding
+                             for footprint_binding in previous[1]}
+    snapshot_stale: bool = previous is None
+    outputs: List[Tuple[str, FootprintBinding, str]] = []
+    footprint_index: int
+    footprint: str
+    for footprint_index, footprint in enumerate(footprints):
+        footprint_binding: Optional[FootprintBinding]
+        footprint_binding = previous_bindings.get((footprint or kicube.footprint).upper())
+        if footprint_binding is None:
+            snapshot_stale = True
+            with metrics.stage("binding-generate"):
+                footprint_binding = kicube.binding_generate(footprint)
+        if footprint_binding is None:
+            project_diagnostics.error("unsupported-footprint",
+                                      f"Footprint '{footprint}' is not supported")
+            continue
+        suffix: str = (".kipart.csv" if footprint_index == 0 else
+                       f".{footprint.lower()}.kipart.csv")
+        outputs.append((suffix, footprint_binding, "".join(footprint_binding.kipart_lines())))
+    snapshot: Optional[bytes] = None
+    if snapshots and snapshot_stale:
+        snapshot = snapshot_bytes(kicube, [output[1] for output in outputs], ioc_hash, csv_hash)
+    return kicube, outputs, snapshot
+
+
+# projects_generate():
+async def projects_generate(ioc_file_names: List[str], in_flight_limit: int,
+                            output_directory: str, footprints: List[str],
+                            diagnostics: Diagnostics, pin_database: Any,
+                            doc_library: Optional[DocLibrary] = None,
+                            metrics: Optional[Metrics] = None, snapshots: bool = False,
+                            tracing: Text = "") -> int:
+    """Generate the kipart files for a list of projects.
+
+    The arguments are:
+    * *ioc_file_names* (List[str]): The project `.ioc` files.
+    * *in_flight_limit* (int): The maximum number of concurrent file reads and writes.
+    * *output_directory* (str): The output directory.  Empty means next to the `.ioc` file.
+    * *footprints* (List[str]): The footprints to generate.  The first one is written to
+      `BASE.kipart.csv` and the others to `BASE.FOOTPRINT.kipart.csv`.
+    * *diagnostics* (Diagnostics): Collects the problems of all of the projects.
+    * *pin_database* (Optional[PinDatabase]): If not None, records each binding.  The pin
+      database is committed once by the caller.
+    * *doc_library* (Optional[DocLibrary]): If not None, the `.dcm` entry of each binding is
+      updated.  The caller writes it out once.
+    * *metrics* (Optional[Metrics]): Collects the run metrics.  It is written out periodically
+      and the caller writes it out once at the end.
+    * *snapshots* (bool): If True, the `BASE.kicube` snapshot of each project is reused if
+      it matches the project inputs, and written otherwise.
+    The number of projects that failed is returned.
+    """
+    batch_io: BatchIO = BatchIO(in_flight_limit)
+    if metrics is None:
+        metrics = Metrics()
+
+    # Read ahead, but hold at most *in_flight_limit* projects in memory.  A project slot is
+    # released once the project has been parsed (the semaphore wakes the reads in order):
+    projects_semaphore: asyncio.BoundedSemaphore = asyncio.BoundedSemaphore(in_flight_limit)
+
+    async def project_read_bounded(ioc_file_name: str) -> ProjectContents:
+        await projects_semaphore.acquire()
+        snapshot_file_name: str = (project_names(ioc_file_name, output_directory)[1] + ".kicube"
+                                   if snapshots else "")
+        return await project_read(batch_io, ioc_file_name, snapshot_file_name)
+
+    reads: List["asyncio.Task[ProjectContents]"] = [
+        asyncio.ensure_future(project_read_bounded(ioc_file_name))
+        for ioc_file_name in ioc_file_names]
+
+    try:
+        # Parse the projects in order as their reads complete and start the writes:
+        writes: List["asyncio.Task[None]"] = []
+        failures: int = 0
+        index: int
+        ioc_file_name: str
+        for index, ioc_file_name in enumerate(ioc_file_names):
+            project: str
+            output_prefix: str
+            project, output_prefix = project_names(ioc_file_name, output_directory)
+            project_diagnostics: Diagnostics = Diagnostics(project)
+            try:
+                contents: ProjectContents
+                try:
+                    contents = await reads[index]
+                except (OSError, UnicodeDecodeError) as error:
+                    project_diagnostics.error("unreadable-project", str(error))
+                else:
+                    if tracing:
+                        print(f"{tracing}Parsing '{ioc_file_name}'")
+                    generated: Optional[Tuple[KiCube, List[Tuple[str, FootprintBinding, str]],
+                                              Optional[bytes]]]
+                    generated = await batch_io.parse(project_generate, ioc_file_name, contents,
+                                                     footprints, project_diagnostics, metrics,
+                                                     snapshots)
+                    if generated is not None:
+                        kicube: KiCube
+                        outputs: List[Tuple[str, FootprintBinding, str]]
+                        snapshot: Optional[bytes]
+                        kicube, outputs, snapshot = generated
+                        suffix: str
+                        footprint_binding: FootprintBinding
+                        kipart_text: str
+                        for suffix, footprint_binding, kipart_text in outputs:
+                            writes.append(asyncio.ensure_future(batch_io.text_write(
+                                output_prefix + suffix, kipart_text)))
+                            if pin_database is not None:
+                                pin_database.kicube_upsert(project, kicube, footprint_binding)
+                            if doc_library is not None:
+                                doc_library.update(footprint_binding.symbol_name, component_lines(
+                                    footprint_binding.symbol_name, footprint_binding.data_sheet_url,
+                                    footprint_binding.description))
+                        if snapshot is not None:
+                            writes.append(asyncio.ensure_future(batch_io.bytes_write(
+                                output_prefix + ".kicube", snapshot)))
+            finally:
+                projects_semaphore.release()
+            project_failed: bool = project_diagnostics.severity_count("error") > 0
+            if project_failed:
+                failures += 1
+            diagnostics.merge(project_diagnostics)
+            metrics.count("kicube32_projects_total", result="failed" if project_failed else "ok")
+            metrics.periodic_write()
+
+        # Wait for the remaining writes:
+        write_result: Any
+        for write_result in await asyncio.gather(*writes, return_exceptions=True):
+            if isinstance(write_result, Exception):
+                diagnostics.error("unwritable-output", str(write_result))
+                failures += 1
+    finally:
+        # Reads still outstanding after an abort are not needed:
+        read: "asyncio.Task[ProjectContents]"
+        for read in reads:
+            read.cancel()
+        batch_io.close()
+    metrics.count("kicube32_read_bytes_total", batch_io.bytes_read)
+    metrics.count("kicube32_written_bytes_total", batch_io.bytes_written)
+    if tracing:
+        print(f"{tracing}{batch_io.bytes_read} bytes read, "
+              f"{batch_io.bytes_written} bytes written")
+    return failures
+
+
+# ioc_file_names_find():
+def ioc_file_names_find(paths: List[str]) -> List[str]:
+    """Return the `.ioc` files named by a list of `.ioc` files, directories and archives."""
+    ioc_file_names: List[str] = []
+    archive_reader: ArchiveReader = ArchiveReader()
+    path: str
+    for path in paths:
+        if os.path.isdir(path):
+            ioc_file_names.extend(sorted([str(ioc_path)
+                                          for ioc_path in Path(path).glob("**/*.ioc")]))
+        elif archive_file_name_is(path):
+            ioc_file_names.extend(archive_reader.member_names(path, ".ioc"))
+        else:
+            ioc_file_names.append(path)
+    archive_reader.close()
+    return ioc_file_names
+
+
+# batch_main():
+def batch_main(arguments: List[str]) -> int:
+    """Generate kipart files for many projects."""
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="kicube32 batch", description="Generate kipart .csv files for many projects.")
+    parser.add_argument("paths", metavar="PROJECT.ioc|DIR|ARCHIVE", nargs="+",
+                        help="Project .ioc files, or directories or zip/tar archives "
+                        "to search for .ioc files")
+    parser.add_argument("--jobs", type=int, default=16,
+                        help="Maximum number of file reads and writes in flight (default: 16)")
+    parser.add_argument("--output-directory", default="", metavar="DIR",
+                        help="Directory for the kipart .csv files (default: next to .ioc)")
+    parser.add_argument("--footprint", action="append", default=[],
+                        help="Additional footprint to generate (NUCLEO144, NUCLEO64, or package)")
+    parser.add_argument("--pins-db", metavar="PINS.db", default="",
+                        help="Record the classified pins in a cross-project pin database")
+    parser.add_argument("--dcm", default="", metavar="FILE.dcm",
+                        help="Add or update the .dcm documentation entry of each project")
+    parser.add_argument("--quiet", action="store_true", help="Do not print warnings or errors")
+    parser.add_argument("--json", action="store_true", help="Print warnings and errors as JSON")
+    parser.add_argument("--strict", action="store_true",
+                        help="Fail if there are any warnings or errors")
+    parser.add_argument("--metrics", default="", metavar="FILE.prom|FILE.json",
+                        help="Write run metrics in Prometheus text (or .json) format")
+    parser.add_argument("--metrics-interval", type=float, default=60.0, metavar="SECONDS",
+                        help="Seconds between metrics writes during the run (default: 60)")
+    parser.add_argument("--snapshots", action="store_true",
+                        help="Write a BASE.kicube snapshot of the classified pins per project")
+    parser.add_argument("--verbose", action="store_true", help="Show each project as it is parsed")
+    parsed_arguments: argparse.Namespace = parser.parse_args(arguments)
+    tracing: Text = " " if parsed_arguments.verbose else ""
+
+    ioc_file_names: List[str] = ioc_file_names_find(parsed_arguments.paths)
+    bad_file_names: List[str] = [ioc_file_name for ioc_file_name in ioc_file_names
+                                 if not ioc_file_name.endswith(".ioc")]
+    if len(bad_file_names) > 0:
+        print(f"File names {bad_file_names} do not end in '.ioc'.")
+        return 1
+
+    pin_database: Any = None
+    if parsed_arguments.pins_db:
+        from kicube32.pin_database import PinDatabase
+        try:
+            pin_database = PinDatabase(parsed_arguments.pins_db)
+        except ValueError as error:
+            print(error)
+            return 1
+
+    doc_library: Optional[DocLibrary] = (DocLibrary(parsed_arguments.dcm)
+                                         if parsed_arguments.dcm else None)
+
+    metrics: Metrics = Metrics(parsed_arguments.metrics, parsed_arguments.metrics_interval)
+    diagnostics: Diagnostics = Diagnostics()
+    try:
+        failures: int = asyncio.run(projects_generate(
+            ioc_file_names, max(1, parsed_arguments.jobs), parsed_arguments.output_directory,
+            [""] + parsed_arguments.footprint, diagnostics, pin_database, doc_library,
+            metrics=metrics, snapshots=parsed_arguments.snapshots, tracing=tracing))
+
+        # Commit all of the projects in one transaction and rewrite the `.dcm` file once:
+        if pin_database is not None:
+            with metrics.stage("pins-db"):
+                pin_database.close()
+        if doc_library is not None:
+            with metrics.stage("dcm-update"):
+                doc_library.write()
+            metrics.file_written(parsed_arguments.dcm)
+    finally:
+        # Export the metrics even when the run fails:
+        metrics.write()
+
+    diagnostics.summary_print(parsed_arguments.json, parsed_arguments.quiet)
+    result: int = 0
+    if failures > 0 or (parsed_arguments.strict and diagnostics.severity_count() > 0):
+        result = 1
+    return result
@@ -0,0 +1,506 @@
+# This file is licensed using the "MIT License" below:
+#
+# ##################################################################################################
+#
+# MIT License
+#
+# Copyright 2019-2020 Home Brew Robotics Club
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies
+# or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# ##################################################################################################
+# <======================================= 100 characters =======================================> #
+
+
+"""cubemx_index: A compact, memory mapped index of the STM32CubeMX MCU pin database.
+
+Usage: kicube32 cubemx-import CUBEMX_MCU_DIR [--cache INDEX.bin]
+       kicube32 cubemx-query CUBEMX_MCU_DIR MCU [--pin P] [--signal S] [--cache INDEX.bin]
+       kicube32 BASE.ioc BASE.csv KIPART.csv --cubemx-db CUBEMX_MCU_DIR
+
+CUBEMX_MCU_DIR is the `db/mcu` directory of an STM32CubeMX installation (or a vendored copy)
+containing one XML file per MCU family member that lists every package pin and the signals
+that can be routed to it.  Those files are large and slow to parse, so they are compiled once
+into a binary index file that is memory mapped for lookups.  The index stores a fingerprint of
+the XML file names, sizes and modification times and is only rebuilt when they change.
+
+The index file layout is (all integers are little endian 32-bit unsigned):
+* Header: magic, version, MCU count, pin count, signal reference count, and the byte offsets
+  of the MCU, pin, signal reference and string sections, followed by the 32 byte fingerprint.
+* MCU records sorted by name: name, package, first pin, and pin count.
+* Pin records in position order: position, name, type, first signal reference, signal count.
+* Signal references: one string offset per signal.
+* Strings: NUL terminated UTF-8 strings; every string offset above is relative to here.
+"""
+
+from typing import Any, Dict, List, Optional, Text, Tuple
+
+import argparse
+import concurrent.futures
+import hashlib
+import mmap
+import os
+import re
+import struct
+import xml.etree.ElementTree as ElementTree
+
+from kicube32.kicube32 import ChipPin, Diagnostics, KiCube, position_key_compute
+
+INDEX_MAGIC: bytes = b"KC32CMX\0"
+INDEX_VERSION: int = 1
+HEADER: struct.Struct = struct.Struct("<8s8I32s")
+MCU_RECORD: struct.Struct = struct.Struct("<4I")
+PIN_RECORD: struct.Struct = struct.Struct("<5I")
+SIGNAL_REFERENCE: struct.Struct = struct.Struct("<I")
+
+# A parsed MCU is (names, package, pins) where each pin is (position, name, type, signals):
+CubeMXPin = Tuple[str, str, str, List[str]]
+CubeMXMcu = Tuple[List[str], str, List[CubeMXPin]]
+
+
+# mcu_names_expand():
+def mcu_names_expand(pattern: str) -> List[str]:
+    """Expand an MCU name pattern like 'STM32F767Z(G-I)Tx' into all of the MCU names."""
+    match: Optional[re.Match] = re.search(r"\(([^)]*)\)", pattern)
+    if match is None:
+        return [pattern]
+    names: List[str] = []
+    alternative: str
+    for alternative in match.group(1).split('-'):
+        names.extend(mcu_names_expand(pattern[:match.start()] + alternative +
+                                      pattern[match.end():]))
+    return names
+
+
+# mcu_xml_parse():
+def mcu_xml_parse(xml_file_name: str) -> Optional[CubeMXMcu]:
+    """Parse one STM32CubeMX MCU XML file, returning None if it does not describe an MCU."""
+    try:
+        root: ElementTree.Element = ElementTree.parse(xml_file_name).getroot()
+    except ElementTree.ParseError:
+        return None
+    if not root.tag.endswith("Mcu") or "RefName" not in root.attrib:
+        return None
+    pins: List[CubeMXPin] = []
+    element: ElementTree.Element
+    for element in root:
+        if element.tag.endswith("}Pin") or element.tag == "Pin":
+            signals: List[str] = [signal.attrib.get("Name", "") for signal in element
+                                  if signal.tag.endswith("Signal")]
+            pins.append((element.attrib.get("Position", ""), element.attrib.get("Name", ""),
+                         element.attrib.get("Type", ""), signals))
+    pins.sort(key=lambda pin: position_key_compute(pin[0]))
+    return mcu_names_expand(root.attrib["RefName"]), root.attrib.get("Package", ""), pins
+
+
+# source_fingerprint():
+def source_fingerprint(mcu_directory: str) -> Tuple[bytes, List[str]]:
+    """Return a fingerprint of the XML files in an MCU directory and the XML file names.
+
+    Only the file names, sizes and modification times are used, so no file is read.
+    """
+    hasher: "hashlib._Hash" = hashlib.sha256()
+    xml_file_names: List[str] = []
+    entry: os.DirEntry
+    for entry in sorted(os.scandir(mcu_directory), key=lambda entry: entry.name):
+        if entry.name.endswith(".xml") and entry.is_file():
+            stat: os.stat_result = entry.stat()
+            hasher.update(f"{entry.name}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+            xml_file_names.append(entry.path)
+    return hasher.digest(), xml_file_names
+
+
+# index_build():
+def index_build(mcu_directory: str, index_file_name: str, jobs: int = 0,
+                tracing: Text = "") -> None:
+    """Parse the STM32CubeMX MCU XML files and write a binary index file."""
+    fingerprint: bytes
+    xml_file_names: List[str]
+    fingerprint, xml_file_names = source_fingerprint(mcu_directory)
+    jobs = jobs if jobs > 0 else (os.cpu_count() or 1)
+    mcus: List[Optional[CubeMXMcu]]
+    if jobs <= 1 or len(xml_file_names) <= 1:
+        mcus = [mcu_xml_parse(xml_file_name) for xml_file_name in xml_file_names]
+    else:
+        # XML parsing is CPU bound, so use processes rather than threads:
+        executor: concurrent.futures.ProcessPoolExecutor
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            mcus = list(executor.map(mcu_xml_parse, xml_file_names, chunksize=16))
+
+    # Intern all of the strings:
+    strings: bytearray = bytearray()
+    string_offsets: Dict[str, int] = {}
+
+    def intern(text: str) -> int:
+        offset: Optional[int] = string_offsets.get(text)
+        if offset is None:
+            offset = len(strings)
+            string_offsets[text] = offset
+            strings.extend(text.encode() + b'\0')
+        return offset
+
+    # Build the record sections.  MCU name patterns share one pin range:
+    mcu_records: List[Tuple[str, int, int, int]] = []
+    pin_records: bytearray = bytearray()
+    signal_references: bytearray = bytearray()
+    pins_count: int = 0
+    signal_references_count: int = 0
+    mcu: Optional[CubeMXMcu]
+    for mcu in mcus:
+        if mcu is None:
+            continue
+        names, package, pins = mcu
+        first_pin: int = pins_count
+        position: str
+        name: str
+        pin_type: str
+        signals: List[str]
+        for position, name, pin_type, signals in pins:
+            pin_records.extend(PIN_RECORD.pack(intern(position), intern(name), intern(pin_type),
+                                               signal_references_count, len(signals)))
+            signal: str
+            for signal in signals:
+                signal_references.extend(SIGNAL_REFERENCE.pack(intern(signal)))
+            signal_references_count += len(signals)
+            pins_count += 1
+        mcu_name: str
+        for mcu_name in names:
+            mcu_records.append((mcu_name, intern(package), first_pin, len(pins)))
+    mcu_records.sort()
+    mcu_section: bytearray = bytearray()
+    package_offset: int
+    pin_count: int
+    for mcu_name, package_offset, first_pin, pin_count in mcu_records:
+        mcu_section.extend(MCU_RECORD.pack(intern(mcu_name), package_offset,
+                                           first_pin, pin_count))
+
+    # Write the index to a temporary file and rename it into place:
+    mcus_offset: int = HEADER.size
+    pins_offset: int = mcus_offset + len(mcu_section)
+    signals_offset: int = pins_offset + len(pin_records)
+    strings_offset: int = signals_offset + len(signal_references)
+    header: bytes = HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(mcu_records), pins_count,
+                                signal_references_count, mcus_offset, pins_offset,
+                                signals_offset, strings_offset, fingerprint)
+    directory: str = os.path.dirname(os.path.abspath(index_file_name))
+    os.makedirs(directory, exist_ok=True)
+    temporary_file_name: str = f"{index_file_name}.{os.getpid()}.tmp"
+    with open(temporary_file_name, "wb") as index_file:
+        index_file.write(header + mcu_section + pin_records + signal_references + strings)
+    os.replace(temporary_file_name, index_file_name)
+    if tracing:
+        print(f"{tracing}Indexed {len(mcu_records)} MCUs with {pins_count} pins "
+              f"into '{index_file_name}'")
+
+
+# CubeMXIndex:
+class CubeMXIndex:
+    """Represents a memory mapped STM32CubeMX MCU pin index."""
+
+    # CubeMXIndex.__init__():
+    def __init__(self, index_file_name: str) -> None:
+        """Memory map an index file written by *index_build*().
+
+        A ValueError is raised if the file is empty, truncated, or not a version
+        *INDEX_VERSION* index.
+        """
+        with open(index_file_name, "rb") as index_file:
+            index_map: mmap.mmap = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        fields: Tuple = ()
+        if len(index_map) >= HEADER.size:
+            fields = HEADER.unpack_from(index_map, 0)
+        if not (len(fields) > 0 and fields[0] == INDEX_MAGIC and fields[1] == INDEX_VERSION and
+                HEADER.size <= fields[5] <= fields[6] <= fields[7] <= fields[8] <= len(index_map)
+                and fields[6] - fields[5] == fields[2] * MCU_RECORD.size
+                and fields[7] - fields[6] == fields[3] * PIN_RECORD.size
+                and fields[8] - fields[7] == fields[4] * SIGNAL_REFERENCE.size):
+            index_map.close()
+            raise ValueError(f"'{index_file_name}' is not a version {INDEX_VERSION} CubeMX index")
+
+        # cubemx_index: CubeMXIndex = self
+        self.index_map: mmap.mmap = index_map
+        self.mcus_count: int = fields[2]
+        self.mcus_offset: int = fields[5]
+        self.pins_offset: int = fields[6]
+        self.signals_offset: int = fields[7]
+        self.strings_offset: int = fields[8]
+        self.fingerprint: bytes = fields[9]
+        # Decoded pins are cached per MCU, since a run usually only looks at one MCU:
+        self.mcu_pins_cache: Dict[int, List[CubeMXPin]] = {}
+
+    # CubeMXIndex.close():
+    def close(self) -> None:
+        """Unmap a CubeMXIndex."""
+        cubemx_index: CubeMXIndex = self
+        cubemx_index.index_map.close()
+
+    # CubeMXIndex.string():
+    def string(self, offset: int) -> str:
+        """Return the string at an offset in the string section."""
+        cubemx_index: CubeMXIndex = self
+        index_map: mmap.mmap = cubemx_index.index_map
+        start: int = cubemx_index.strings_offset + offset
+        return index_map[start:index_map.find(b'\0', start)].decode()
+
+    # CubeMXIndex.mcu_find():
+    def mcu_find(self, mcu_name: str) -> int:
+        """Return the MCU record number of an MCU name or -1.
+
+        Names without the trailing 'x' (e.g. 'STM32F767ZIT' from `KiCube.mcu_name`) also match.
+        """
+        cubemx_index: CubeMXIndex = self
+        name: str
+        for name in (mcu_name, mcu_name + "x"):
+            # Binary search the sorted MCU records:
+            low: int = 0
+            high: int = cubemx_index.mcus_count - 1
+            while low <= high:
+                middle: int = (low + high) // 2
+                middle_name: str = cubemx_index.string(MCU_RECORD.unpack_from(
+                    cubemx_index.index_map,
+                    cubemx_index.mcus_offset + middle * MCU_RECORD.size)[0])
+                if middle_name == name:
+                    return middle
+                elif middle_name < name:
+                    low = middle + 1
+                else:
+                    high = middle - 1
+        return -1
+
+    # CubeMXIndex.mcu_names():
+    def mcu_names(self) -> List[str]:
+        """Return all of the MCU names in the index."""
+        cubemx_index: CubeMXIndex = self
+        return [cubemx_index.string(MCU_RECORD.unpack_from(
+            cubemx_index.index_map, cubemx_index.mcus_offset + index * MCU_RECORD.size)[0])
+            for index in range(cubemx_index.mcus_count)]
+
+    # CubeMXIndex.package():
+    def package(self, mcu_name: str) -> str:
+        """Return the package of an MCU or an empty string for an unknown MCU."""
+        cubemx_index: CubeMXIndex = self
+        mcu_index: int = cubemx_index.mcu_find(mcu_name)
+        if mcu_index < 0:
+            return ""
+        return cubemx_index.string(MCU_RECORD.unpack_from(
+            cubemx_index.index_map, cubemx_index.mcus_offset + mcu_index * MCU_RECORD.size)[1])
+
+    # CubeMXIndex.pins():
+    def pins(self, mcu_name: str) -> List[CubeMXPin]:
+        """Return the (position, name, type, signals) of each pin of an MCU in position order.
+
+        An empty list is returned for an unknown MCU.
+        """
+        cubemx_index: CubeMXIndex = self
+        mcu_index: int = cubemx_index.mcu_find(mcu_name)
+        if mcu_index < 0:
+            return []
+        index_map: mmap.mmap = cubemx_index.index_map
+        _, _, first_pin, pins_count = MCU_RECORD.unpack_from(
+            index_map, cubemx_index.mcus_offset + mcu_index * MCU_RECORD.size)
+        pins: Optional[List[CubeMXPin]] = cubemx_index.mcu_pins_cache.get(first_pin)
+        if pins is None:
+            pins = []
+            string = cubemx_index.string
+            pin_index: int
+            for pin_index in range(first_pin, first_pin + pins_count):
+                position_offset, name_offset, type_offset, first_signal, signals_count = \
+                    PIN_RECORD.unpack_from(index_map,
+                                           cubemx_index.pins_offset + pin_index * PIN_RECORD.size)
+                signals: List[str] = [string(SIGNAL_REFERENCE.unpack_from(
+                    index_map, cubemx_index.signals_offset + signal_index * 4)[0])
+                    for signal_index in range(first_signal, first_signal + signals_count)]
+                pins.append((string(position_offset), string(name_offset),
+                             string(type_offset), signals))
+            cubemx_index.mcu_pins_cache[first_pin] = pins
+        return pins
+
+    # CubeMXIndex.signal_pins():
+    def signal_pins(self, mcu_name: str) -> Dict[str, List[str]]:
+        """Return a table mapping each signal of an MCU to the trimmed names of its pins."""
+        cubemx_index: CubeMXIndex = self
+        signal_pins: Dict[str, List[str]] = {}
+        position: str
+        name: str
+        pin_type: str
+        signals: List[str]
+        for position, name, pin_type, signals in cubemx_index.pins(mcu_name):
+            trimmed_name: str = re.split(r"[/-]", name)[0]
+            signal: str
+            for signal in signals:
+                signal_pins.setdefault(signal, []).append(trimmed_name)
+        return signal_pins
+
+
+# index_file_name_default():
+def index_file_name_default(mcu_directory: str) -> str:
+    """Return the default index file name (in `~/.cache/kicube32/`) for an MCU directory."""
+    directory_hash: str = hashlib.sha256(os.path.abspath(mcu_directory).encode()).hexdigest()[:16]
+    return os.path.join(os.path.expanduser("~"), ".cache", "kicube32",
+                        f"cubemx-{directory_hash}.bin")
+
+
+# cubemx_index_open():
+def cubemx_index_open(mcu_directory: str, index_file_name: str = "",
+                      tracing: Text = "", metrics: Any = None) -> CubeMXIndex:
+    """Return the CubeMXIndex for an MCU directory, (re)building the index file if needed.
+
+    The default *index_file_name* is in `~/.cache/kicube32/`, named after *mcu_directory*.
+    If *metrics* (a *Metrics*) is given, the index file reuse is counted as a cache hit or miss.
+    An index file that can not be read (e.g. from an older kicube32 or truncated) is rebuilt.
+    An OSError is raised if *mcu_directory* does not exist or the index can not be written.
+    """
+    if not os.path.isdir(mcu_directory):
+        raise FileNotFoundError(f"CubeMX MCU directory '{mcu_directory}' does not exist")
+    if index_file_name == "":
+        index_file_name = index_file_name_default(mcu_directory)
+    fingerprint: bytes = source_fingerprint(mcu_directory)[0]
+    if os.path.isfile(index_file_name):
+        try:
+            cubemx_index: CubeMXIndex = CubeMXIndex(index_file_name)
+        except (OSError, ValueError) as error:
+            if tracing:
+                print(f"{tracing}{error}; rebuilding '{index_file_name}'")
+        else:
+            if cubemx_index.fingerprint == fingerprint:
+                if metrics is not None:
+                    metrics.count("kicube32_cache_hits_total", cache="cubemx-index")
+                return cubemx_index
+            cubemx_index.close()
+            if tracing:
+                print(f"{tracing}'{mcu_directory}' has changed; rebuilding '{index_file_name}'")
+    if metrics is not None:
+        metrics.count("kicube32_cache_misses_total", cache="cubemx-index")
+    index_build(mcu_directory, index_file_name, tracing=tracing)
+    return CubeMXIndex(index_file_name)
+
+
+# cubemx_import_main():
+def cubemx_import_main(arguments: List[str]) -> int:
+    """Build (or refresh) the index of an STM32CubeMX MCU directory."""
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="kicube32 cubemx-import", description="Index an STM32CubeMX MCU pin database.")
+    parser.add_argument("mcu_directory", metavar="CUBEMX_MCU_DIR",
+                        help="STM32CubeMX 'db/mcu' directory")
+    parser.add_argument("--cache", default="", metavar="INDEX.bin",
+                        help="Index file (default: in ~/.cache/kicube32)")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if up to date")
+    parsed_arguments: argparse.Namespace = parser.parse_args(arguments)
+    if not os.path.isdir(parsed_arguments.mcu_directory):
+        print(f"'{parsed_arguments.mcu_directory}' is not a directory")
+        return 1
+    mcu_directory: str = parsed_arguments.mcu_directory
+    index_file_name: str = parsed_arguments.cache or index_file_name_default(mcu_directory)
+    try:
+        if parsed_arguments.force:
+            index_build(mcu_directory, index_file_name, tracing=" ")
+        cubemx_index: CubeMXIndex = cubemx_index_open(mcu_directory, index_file_name,
+                                                      tracing=" ")
+    except OSError as error:
+        print(error)
+        return 1
+    print(f"{cubemx_index.mcus_count} MCUs indexed")
+    cubemx_index.close()
+    return 0
+
+
+# cubemx_query_main():
+def cubemx_query_main(arguments: List[str]) -> int:
+    """Show the pins (and their signals) of an MCU from the STM32CubeMX index."""
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="kicube32 cubemx-query", description="Show the pins of an STM32 MCU.")
+    parser.add_argument("mcu_directory", metavar="CUBEMX_MCU_DIR",
+                        help="STM32CubeMX 'db/mcu' directory")
+    parser.add_argument("mcu_name", metavar="MCU", help="MCU name (e.g. 'STM32F767ZITx')")
+    parser.add_argument("--pin", default="", help="Only show this pin (e.g. 'PA5')")
+    parser.add_argument("--signal", default="", help="Only show pins with this signal")
+    parser.add_argument("--cache", default="", metavar="INDEX.bin",
+                        help="Index file (default: in ~/.cache/kicube32)")
+    parsed_arguments: argparse.Namespace = parser.parse_args(arguments)
+    try:
+        cubemx_index: CubeMXIndex = cubemx_index_open(parsed_arguments.mcu_directory,
+                                                      parsed_arguments.cache)
+    except OSError as error:
+        print(error)
+        return 1
+    pins: List[CubeMXPin] = cubemx_index.pins(parsed_arguments.mcu_name)
+    if len(pins) == 0:
+        print(f"MCU '{parsed_arguments.mcu_name}' is not in the index")
+    position: str
+    name: str
+    pin_type: str
+    signals: List[str]
+    for position, name, pin_type, signals in pins:
+        if parsed_arguments.pin and re.split(r"[/-]", name)[0] != parsed_arguments.pin:
+            continue
+        if parsed_arguments.signal and parsed_arguments.signal not in signals:
+            continue
+        print(f"{position:>5} {name:16} {pin_type:8} {' '.join(signals)}")
+    cubemx_index.close()
+    return 0 if len(pins) > 0 else 1
+
+
+# kicube_validate():
+def kicube_validate(kicube: KiCube, cubemx_index: CubeMXIndex) -> int:
+    """Check the pins of a KiCube against the STM32CubeMX pin database.
+
+    Each pin position must exist with the same trimmed name and kind, and each assigned
+    signal (other than the 'GPIO_...' modes) must be routable to the pin.  Problems are
+    reported to the *KiCube* diagnostics and their count is returned.
+    """
+    diagnostics: Diagnostics = kicube.diagnostics
+    mcu_name: str = kicube.mcu_name
+    pins: List[CubeMXPin] = cubemx_index.pins(mcu_name)
+    if len(pins) == 0:
+        diagnostics.warning("cubemx-unknown-mcu", f"MCU '{mcu_name}' is not in the CubeMX index")
+        return 1
+    problems: int = 0
+    package: str = cubemx_index.package(mcu_name)
+    if kicube.package and package != kicube.package:
+        diagnostics.warning("cubemx-package-mismatch",
+                            f"Package '{kicube.package}' is '{package}' in CubeMX")
+        problems += 1
+
+    pins_table: Dict[str, CubeMXPin] = {pin[0]: pin for pin in pins}
+    chip_pin: ChipPin
+    for chip_pin in kicube.chip_pins:
+        position: str = chip_pin.position
+        cubemx_pin: Optional[CubeMXPin] = pins_table.get(position)
+        if cubemx_pin is None:
+            diagnostics.warning("cubemx-unknown-position",
+                                f"Pin '{chip_pin.vendor_name}' is not in CubeMX", position)
+            problems += 1
+            continue
+        _, name, pin_type, signals = cubemx_pin
+        if re.split(r"[/-]", name)[0] != chip_pin.trimmed_name:
+            diagnostics.warning("cubemx-name-mismatch",
+                                f"Pin '{chip_pin.vendor_name}' is '{name}' in CubeMX", position)
+            problems += 1
+        kind: str = chip_pin.kind
+        if kind != pin_type and not (kind in ("Input", "Output") and pin_type == "I/O"):
+            diagnostics.warning("cubemx-kind-mismatch",
+                                f"Pin '{chip_pin.vendor_name}' kind '{kind}' is "
+                                f"'{pin_type}' in CubeMX", position)
+            problems += 1
+        signal: str = chip_pin.signal
+        if signal != "" and not signal.startswith("GPIO_") and signal not in signals:
+            diagnostics.warning("cubemx-unknown-signal",
+                                f"Signal '{signal}' can not be routed to "
+                                f"'{chip_pin.trimmed_name}'", position)
+            problems += 1
+    return problems
@@ -0,0 +1,199 @@
+# This file is licensed using the "MIT License" below:
+#
+# ##################################################################################################
+#
+# MIT License
+#
+# Copyright 2019-2020 Home Brew Robotics Club
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies
+# or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# ##################################################################################################
+# <======================================= 100 characters =======================================> #
+
+
+"""doc_library: Read and update the component entries of a KiCad `.dcm` documentation library.
+
+Usage: kicube32 BASE.ioc BASE.csv KIPART.csv --dcm FILE.dcm
+       kicube32 batch --dcm FILE.dcm PROJECT.ioc|DIR|ARCHIVE ...
+
+A `.dcm` file is a header line followed by one block per component:
+
+    #
+    $CMP SYMBOL_NAME
+    D LONG_DESCRIPTION
+    K SHORT_DESCRIPTION (key words)
+    F DATA_SHEET_URL
+    $ENDCMP
+
+and is terminated by `#End Doc Library`.  *DocLibrary* only indexes the offsets of the
+`$CMP` ... `$ENDCMP` blocks, so updating a component replaces just that block and leaves the
+rest of the file untouched.
+"""
+
+from typing import Any, Dict, IO, List, Optional, Tuple
+
+import os
+
+DOC_LIBRARY_HEADER: str = "EESchema-DOCLIB  Version 2.0"
+DOC_LIBRARY_TRAILER: str = "#\n#End Doc Library\n"
+
+
+# component_lines():
+def component_lines(name: str, data_sheet_url: str, description: str) -> List[str]:
+    """Return the `.dcm` lines for a component.
+
+    The arguments are:
+    * *name* (str): The schematic symbol name.
+    * *data_sheet_url* (str): The data sheet URL.
+    * *description* (str): The kipart description of the form 'LONG;SHORT'.
+    The lines start with the '#' separator line and end with the '$ENDCMP' line.
+    """
+    descriptions: List[str] = description.split(';')
+    long_description: str = descriptions[0].strip()
+    short_description: str = descriptions[1].strip() if len(descriptions) > 1 else "~"
+    return ["#", f"$CMP {name}", f"D {long_description}", f"K {short_description}",
+            f"F {data_sheet_url}", "$ENDCMP"]
+
+
+# components_index():
+def components_index(text: str) -> Dict[str, Tuple[int, int]]:
+    """Return a table mapping each component name of a `.dcm` text to its block offsets.
+
+    A block starts with its '$CMP NAME' line and ends after its '$ENDCMP' line.
+    """
+    components_table: Dict[str, Tuple[int, int]] = {}
+    newline: int = -1 if text.startswith("$CMP ") else text.find("\n$CMP ")
+    start: int = newline + 1 if newline >= 0 or text.startswith("$CMP ") else -1
+    while start >= 0:
+        name_end: int = text.find("\n", start)
+        end: int = text.find("\n$ENDCMP", name_end)
+        if name_end < 0 or end < 0:
+            break
+        line_end: int = text.find("\n", end + 1)
+        end = len(text) if line_end < 0 else line_end + 1
+        components_table[text[start + 5:name_end].strip()] = (start, end)
+        newline = text.find("\n$CMP ", end - 1)
+        start = newline + 1 if newline >= 0 else -1
+    return components_table
+
+
+# DocLibrary:
+class DocLibrary:
+    """Represents a KiCad `.dcm` file with an index of its component blocks."""
+
+    # DocLibrary.__init__():
+    def __init__(self, file_name: str, text: Optional[str] = None) -> None:
+        """Initialize a DocLibrary.
+
+        The arguments are:
+        * *file_name* (str): The `.dcm` file.  It need not exist yet.
+        * *text* (Optional[str]): The `.dcm` file contents.  If provided, *file_name* is not
+          read.
+        """
+        if text is None:
+            text = ""
+            if os.path.isfile(file_name):
+                dcm_file: IO[Any]
+                with open(file_name, "r") as dcm_file:
+                    text = dcm_file.read()
+
+        # doc_library: DocLibrary = self
+        self.components_table: Dict[str, Tuple[int, int]] = components_index(text)
+        self.file_name: str = file_name
+        self.text: str = text
+        self.updates_table: Dict[str, str] = {}
+
+    # DocLibrary.lookup():
+    def lookup(self, name: str) -> str:
+        """Return the text of a component block (empty if the component is not present)."""
+        doc_library: DocLibrary = self
+        if name in doc_library.updates_table:
+            return doc_library.updates_table[name]
+        start_end: Optional[Tuple[int, int]] = doc_library.components_table.get(name)
+        return "" if start_end is None else doc_library.text[start_end[0]:start_end[1]]
+
+    # DocLibrary.update():
+    def update(self, name: str, lines: List[str]) -> bool:
+        """Insert or replace the block of a component, returning True if it changed.
+
+        *lines* are the *component_lines*() of the component.  The leading '#' separator is
+        only used when the component is new.
+        """
+        doc_library: DocLibrary = self
+        block_lines: List[str] = lines[1:] if lines[0] == "#" else lines
+        block: str = '\n'.join(block_lines) + '\n'
+        if doc_library.lookup(name) == block:
+            return False
+        doc_library.updates_table[name] = block
+        return True
+
+    # DocLibrary.write():
+    def write(self) -> bool:
+        """Write the DocLibrary out if it was updated, returning True if it was written.
+
+        Only the updated blocks are replaced and new components are appended.  The file is
+        replaced atomically, so concurrent readers see either the old or the new file.
+        """
+        doc_library: DocLibrary = self
+        updates_table: Dict[str, str] = doc_library.updates_table
+        if len(updates_table) == 0:
+            return False
+        text: str = doc_library.text
+        components_table: Dict[str, Tuple[int, int]] = doc_library.components_table
+
+        # Splice the replaced blocks into the unchanged text between them:
+        pieces: List[str] = []
+        offset: int = 0
+        name: str
+        start: int
+        end: int
+        for name, (start, end) in sorted(components_table.items(), key=lambda item: item[1]):
+            if name in updates_table:
+                pieces.append(text[offset:start])
+                pieces.append(updates_table[name])
+                offset = end
+
+        # Append the new components in front of the trailer:
+        trailer_index: int = text.rfind("#End Doc Library")
+        if trailer_index < 0:
+            trailer_index = len(text)
+        if trailer_index > 0 and text[trailer_index - 2:trailer_index] == "#\n":
+            trailer_index -= 2
+        if offset == 0 and not text.startswith(DOC_LIBRARY_HEADER):
+            pieces.append(DOC_LIBRARY_HEADER + "\n")
+        pieces.append(text[offset:max(offset, trailer_index)])
+        for name in sorted(updates_table.keys()):
+            if name not in components_table:
+                pieces.append("#\n" + updates_table[name])
+        pieces.append(DOC_LIBRARY_TRAILER)
+
+        # Write to a temporary file and move it into place:
+        file_name: str = doc_library.file_name
+        temporary_file_name: str = f"{file_name}.{os.getpid()}.tmp"
+        dcm_file: IO[Any]
+        new_text: str = "".join(pieces)
+        with open(temporary_file_name, "w") as dcm_file:
+            dcm_file.write(new_text)
+        os.replace(temporary_file_name, file_name)
+
+        # The new text is now the base for any further updates:
+        doc_library.components_table = components_index(new_text)
+        doc_library.text = new_text
+        doc_library.updates_table = {}
+        return True
@@ -0,0 +1,254 @@
+# This file is licensed using the "MIT License" below:
+#
+# ##################################################################################################
+#
+# MIT License
+#
+# Copyright 2019-2020 Home Brew Robotics Club
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies
+# or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# ##################################################################################################
+# <======================================= 100 characters =======================================> #
+
+
+"""git_sweep: Regenerate kipart output across the git history of a project in one process.
+
+Usage: kicube32 git-sweep [--diff] [--footprint FOOTPRINT] [--output-directory DIR]
+                          REPOSITORY BASE.ioc BASE.csv REVISION_RANGE
+
+BASE.ioc and BASE.csv are paths relative to the top of the local REPOSITORY and
+REVISION_RANGE is anything `git rev-list` accepts (e.g. 'v1.0..HEAD'.)  The file contents are
+streamed through long lived `git cat-file` processes rather than checking out each revision.
+Revisions whose `.ioc` and `.csv` blobs are the same as those of the previous revision are
+skipped.  For each remaining revision either `SHORT_HASH.kipart.csv` is written into DIR or,
+with `--diff`, the pin differences from the previously processed revision are printed.  Blob
+pairs that reappear (e.g. after a revert) reuse the pins classified the first time.
+"""
+
+from typing import Dict, IO, List, Optional, Text, Tuple
+
+import argparse
+import os
+import subprocess
+
+from kicube32.kicube32 import Diagnostics, FootprintBinding, IOC, KiCube
+
+
+# GitCatFile:
+class GitCatFile:
+    """Represents a long lived `git cat-file --batch` (or `--batch-check`) process."""
+
+    # GitCatFile.__init__():
+    def __init__(self, repository: str, contents: bool = True) -> None:
+        """Start a `git cat-file` process.
+
+        The arguments are:
+        * *repository* (str): The local repository directory.
+        * *contents* (bool): If *True*, object contents are returned (`--batch`), otherwise
+          only the object information is returned (`--batch-check`.)
+        """
+        mode: str = "--batch" if contents else "--batch-check"
+        process: subprocess.Popen = subprocess.Popen(
+            ["git", "-C", repository, "cat-file", mode],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        # git_cat_file: GitCatFile = self
+        self.process: subprocess.Popen = process
+        self.contents: bool = contents
+
+    # GitCatFile.close():
+    def close(self) -> None:
+        """Stop the `git cat-file` process."""
+        git_cat_file: GitCatFile = self
+        process: subprocess.Popen = git_cat_file.process
+        if process.stdin is not None:
+            process.stdin.close()
+        process.wait()
+        if process.stdout is not None:
+            process.stdout.close()
+
+    # GitCatFile.request():
+    def request(self, object_name: str) -> Tuple[str, int, Optional[bytes]]:
+        """Return the (object hash, size, contents) of an object such as 'HEAD:f767zi.ioc'.
+
+        The object hash is empty if the object does not exist.  The contents are only
+        returned by a `--batch` process.
+        """
+        git_cat_file: GitCatFile = self
+        process: subprocess.Popen = git_cat_file.process
+        stdin: Optional[IO[bytes]] = process.stdin
+        stdout: Optional[IO[bytes]] = process.stdout
+        assert stdin is not None and stdout is not None
+        stdin.write(object_name.encode() + b'\n')
+        stdin.flush()
+
+        # The header is either 'HASH TYPE SIZE' or 'NAME missing':
+        header: List[str] = stdout.readline().decode().split()
+        if len(header) != 3:
+            return "", 0, None
+        object_hash: str = header[0]
+        size: int = int(header[2])
+        contents: Optional[bytes] = None
+        if git_cat_file.contents:
+            contents = stdout.read(size)
+            stdout.read(1)  # Skip the terminating new-line.
+        return object_hash, size, contents
+
+
+# revisions_list():
+def revisions_list(repository: str, revision_range: str) -> List[Tuple[str, str]]:
+    """Return the (hash, subject) of each commit in a revision range, oldest first."""
+    output: str = subprocess.run(
+        ["git", "-C", repository, "log", "--reverse", "--format=%H %s", revision_range],
+        check=True, stdout=subprocess.PIPE).stdout.decode()
+    revisions: List[Tuple[str, str]] = []
+    line: str
+    for line in output.splitlines():
+        commit_hash: str
+        subject: str
+        commit_hash, _, subject = line.partition(' ')
+        revisions.append((commit_hash, subject))
+    return revisions
+
+
+# git_sweep():
+def git_sweep(repository: str, ioc_path: str, csv_path: str, revision_range: str,
+              footprint: str, output_directory: str, diff: bool,
+              diagnostics: Diagnostics, tracing: Text = "") -> int:
+    """Generate kipart output (or pin differences) for each distinct revision of a project.
+
+    The number of revisions processed is returned.
+    """
+    revisions: List[Tuple[str, str]] = revisions_list(repository, revision_range)
+    blob_checker: GitCatFile = GitCatFile(repository, contents=False)
+    blob_reader: GitCatFile = GitCatFile(repository)
+    bindings_cache: Dict[Tuple[str, str], Optional[FootprintBinding]] = {}
+    texts_cache: Dict[str, str] = {}
+    previous_blobs: Tuple[str, str] = ("", "")
+    previous_binding: Optional[FootprintBinding] = None
+    processed: int = 0
+    ioc_file_name: str = os.path.basename(ioc_path)
+    commit_hash: str
+    subject: str
+    try:
+        for commit_hash, subject in revisions:
+            short_hash: str = commit_hash[:10]
+            ioc_hash: str = blob_checker.request(f"{commit_hash}:{ioc_path}")[0]
+            csv_hash: str = blob_checker.request(f"{commit_hash}:{csv_path}")[0]
+            if ioc_hash == "" or csv_hash == "":
+                if tracing:
+                    print(f"{tracing}{short_hash}: inputs missing; skipped")
+                continue
+            blobs: Tuple[str, str] = (ioc_hash, csv_hash)
+            if blobs == previous_blobs:
+                if tracing:
+                    print(f"{tracing}{short_hash}: inputs unchanged; skipped")
+                continue
+            previous_blobs = blobs
+
+            # Classify each distinct blob pair only once:
+            footprint_binding: Optional[FootprintBinding]
+            if blobs in bindings_cache:
+                footprint_binding = bindings_cache[blobs]
+                if tracing:
+                    print(f"{tracing}{short_hash}: inputs seen before; reused")
+            else:
+                # Fetch each blob only once:
+                blob_hash: str
+                for blob_hash in blobs:
+                    if blob_hash not in texts_cache:
+                        contents: Optional[bytes] = blob_reader.request(blob_hash)[2]
+                        assert contents is not None
+                        texts_cache[blob_hash] = contents.decode("utf-8")
+
+                # Both files come from the same commit, so the time stamp check does not apply:
+                revision_diagnostics: Diagnostics = Diagnostics(short_hash)
+                ioc: IOC = IOC(ioc_file_name, ioc_text=texts_cache[ioc_hash], timestamp=0.0)
+                kicube: KiCube = KiCube(ioc_file_name, os.path.basename(csv_path),
+                                        ioc.mcu_name, ioc.board_name, ioc.package,
+                                        diagnostics=revision_diagnostics,
+                                        csv_text=texts_cache[csv_hash], timestamp=0.0)
+                footprint_binding = kicube.binding_generate(footprint)
+                if footprint_binding is None:
+                    revision_diagnostics.error("unsupported-footprint",
+                                               f"Footprint '{footprint}' is not supported")
+                diagnostics.merge(revision_diagnostics)
+                bindings_cache[blobs] = footprint_binding
+
+            if footprint_binding is None:
+                pass
+            elif diff:
+                print(f"{short_hash} {subject}")
+                differences: List[str] = (
+                    ["  (first revision)"] if previous_binding is None else
+                    ["  " + line for line in footprint_binding.diff(previous_binding)])
+                print("\n".join(differences or ["  (no pin changes)"]))
+                previous_binding = footprint_binding
+            else:
+                kipart_csv_file_name: str = os.path.join(output_directory,
+                                                         f"{short_hash}.kipart.csv")
+                with open(kipart_csv_file_name, "w") as kipart_csv_file:
+                    kipart_csv_file.writelines(footprint_binding.kipart_lines())
+                if tracing:
+                    print(f"{tracing}{short_hash}: wrote '{kipart_csv_file_name}'")
+            processed += 1
+    finally:
+        blob_checker.close()
+        blob_reader.close()
+    return processed
+
+
+# git_sweep_main():
+def git_sweep_main(arguments: List[str]) -> int:
+    """Regenerate kipart output across a git revision range."""
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="kicube32 git-sweep",
+        description="Regenerate kipart output for each revision of a project in a git repository.")
+    parser.add_argument("repository", metavar="REPOSITORY", help="Local git repository")
+    parser.add_argument("ioc_path", metavar="BASE.ioc", help=".ioc path within REPOSITORY")
+    parser.add_argument("csv_path", metavar="BASE.csv", help=".csv path within REPOSITORY")
+    parser.add_argument("revision_range", metavar="REVISION_RANGE",
+                        help="Revisions to sweep (e.g. 'v1.0..HEAD')")
+    parser.add_argument("--diff", action="store_true",
+                        help="Print pin differences instead of writing kipart files")
+    parser.add_argument("--footprint", default="",
+                        help="Footprint to generate (NUCLEO144, NUCLEO64, or package)")
+    parser.add_argument("--output-directory", default=".", metavar="DIR",
+                        help="Directory for the SHORT_HASH.kipart.csv files (default: .)")
+    parser.add_argument("--quiet", action="store_true", help="Do not print warnings or errors")
+    parser.add_argument("--verbose", action="store_true", help="Show skipped revisions")
+    parsed_arguments: argparse.Namespace = parser.parse_args(arguments)
+    tracing: Text = " " if parsed_arguments.verbose else ""
+    if not parsed_arguments.ioc_path.endswith(".ioc"):
+        print(f"'{parsed_arguments.ioc_path}' does not end in '.ioc'.")
+        return 1
+    if not parsed_arguments.csv_path.endswith(".csv"):
+        print(f"'{parsed_arguments.csv_path}' does not end in '.csv'.")
+        return 1
+
+    diagnostics: Diagnostics = Diagnostics()
+    try:
+        git_sweep(parsed_arguments.repository, parsed_arguments.ioc_path,
+                  parsed_arguments.csv_path, parsed_arguments.revision_range,
+                  parsed_arguments.footprint, parsed_arguments.output_directory,
+                  parsed_arguments.diff, diagnostics, tracing=tracing)
+    except subprocess.CalledProcessError as error:
+        print(f"git failed: {error}")
+        return 1
+    diagnostics.summary_print(quiet=parsed_arguments.quiet)
+    return 0 if diagnostics.severity_count("error") == 0 else 1
@@ -0,0 +1,273 @@
+# This file is licensed using the "MIT License" below:
+#
+# ##################################################################################################
+#
+# MIT License
+#
+# Copyright 2019-2020 Home Brew Robotics Club
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies
+# or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# ##################################################################################################
+# <======================================= 100 characters =======================================> #
+
+
+"""incremental: Regenerate only the pins that changed since the previous kicube32 run.
+
+Usage: kicube32 BASE.ioc BASE.csv KIPART.csv --snapshot BASE.kicube --incremental
+
+Usually only a GPIO label or a peripheral assignment changes between runs.  With
+`--incremental`, the new STM32CubeMX `.csv` rows are compared with the pins stored in the
+previous run's snapshot (see *kicube32.kicube_snapshot*).  Only the rows whose kind, signal or
+label changed are classified again; every other *ChipPin* is reused.  In each
+*FootprintBinding*, only the units that lose or gain a changed pin are re-sorted, and only the
+rows of those units are replaced in the existing kipart `.csv` file.  The symbol pins that
+changed are reported.
+
+An incremental update is not possible (and *kicube_update*() returns None) if pins were added,
+removed, reordered or renamed, since that can change the Nucleo connector bindings.  The
+caller then falls back to a full regeneration.
+"""
+
+from typing import Any, Dict, IO, List, Optional, Set, Text, Tuple
+
+import os
+
+from kicube32.kicube32 import (ChipPin, ChipPinIndex, Diagnostics, FootprintBinding, KiCube,
+                               kipart_row)
+
+# Diagnostics codes that are reported while binding rather than while classifying a pin:
+BINDING_CODES: Tuple[str, ...] = ("unbound-nucleo-pin", "unsupported-footprint")
+
+# The symbol pin fields that are compared for the change report:
+PIN_FIELDS: Tuple[str, ...] = ("name", "unit", "kicad_type", "style", "side")
+
+# A symbol pin change is (footprint, position, field_changes), where each field change is
+# (field_name, old_value, new_value):
+PinChange = Tuple[str, str, List[Tuple[str, str, str]]]
+
+
+# KiCubeUpdate:
+class KiCubeUpdate:
+    """Represents an incremental update of a KiCube and its FootprintBinding's."""
+
+    # KiCubeUpdate.__init__():
+    def __init__(self, kicube: KiCube, footprint_bindings: List[FootprintBinding],
+                 old_footprint_bindings: List[FootprintBinding],
+                 changed_units: Dict[str, Set[str]], pin_changes: List[PinChange],
+                 reclassified_chip_pins: List[ChipPin]) -> None:
+        """Initialize a KiCubeUpdate.
+
+        The arguments are:
+        * *kicube* (KiCube): The updated KiCube.
+        * *footprint_bindings* (List[FootprintBinding]): The updated bindings.
+        * *old_footprint_bindings* (List[FootprintBinding]): The bindings of the previous run,
+          in the same order.
+        * *changed_units* (Dict[str, Set[str]]): The units that were re-sorted per footprint.
+        * *pin_changes* (List[PinChange]): The symbol pins that changed.
+        * *reclassified_chip_pins* (List[ChipPin]): The new ChipPin's of the changed `.csv`
+          rows.
+        """
+        # kicube_update: KiCubeUpdate = self
+        self.kicube: KiCube = kicube
+        self.footprint_bindings: List[FootprintBinding] = footprint_bindings
+        self.old_footprint_bindings_table: Dict[str, FootprintBinding] = {
+            footprint_binding.footprint: footprint_binding
+            for footprint_binding in old_footprint_bindings}
+        self.changed_units: Dict[str, Set[str]] = changed_units
+        self.pin_changes: List[PinChange] = pin_changes
+        self.reclassified_chip_pins: List[ChipPin] = reclassified_chip_pins
+
+    # KiCubeUpdate.kipart_patch():
+    def kipart_patch(self, footprint_binding: FootprintBinding,
+                     kipart_csv_file_name: str) -> bool:
+        """Replace the rows of the changed units in an existing kipart `.csv` file.
+
+        False is returned (and nothing is written) if the file does not hold exactly the rows
+        of the previous binding of the footprint (e.g. it was edited by hand), in which case
+        the whole file must be written.  The file is replaced atomically.
+        """
+        kicube_update: KiCubeUpdate = self
+        footprint: str = footprint_binding.footprint
+        old_footprint_binding: Optional[FootprintBinding] = (
+            kicube_update.old_footprint_bindings_table.get(footprint))
+        if old_footprint_binding is None or not os.path.isfile(kipart_csv_file_name):
+            return False
+        kipart_csv_file: IO[Any]
+        with open(kipart_csv_file_name, "r") as kipart_csv_file:
+            lines: List[str] = kipart_csv_file.readlines()
+        if lines != old_footprint_binding.kipart_lines():
+            return False
+
+        # Copy the rows of the unchanged units and format the rows of the changed units:
+        changed_units: Set[str] = kicube_update.changed_units.get(footprint, set())
+        if len(changed_units) == 0:
+            return True
+        old_ranges: Dict[str, Tuple[int, int]] = unit_ranges(old_footprint_binding)
+        new_ranges: Dict[str, Tuple[int, int]] = unit_ranges(footprint_binding)
+        new_lines: List[str] = lines[:2]
+        unit: str
+        for unit in sorted(new_ranges.keys()):
+            start: int
+            end: int
+            if unit in changed_units or unit not in old_ranges:
+                start, end = new_ranges[unit]
+                new_lines.extend([kipart_row(position, chip_pin) for position, chip_pin
+                                  in footprint_binding.bindings[start:end]])
+            else:
+                start, end = old_ranges[unit]
+                new_lines.extend(lines[2 + start:2 + end])
+        new_lines.extend(lines[-2:])
+        temporary_file_name: str = f"{kipart_csv_file_name}.{os.getpid()}.tmp"
+        with open(temporary_file_name, "w") as kipart_csv_file:
+            kipart_csv_file.writelines(new_lines)
+        os.replace(temporary_file_name, kipart_csv_file_name)
+        return True
+
+    # KiCubeUpdate.report_lines():
+    def report_lines(self) -> List[str]:
+        """Return one line per changed symbol pin."""
+        kicube_update: KiCubeUpdate = self
+        lines: List[str] = []
+        footprint: str
+        position: str
+        field_changes: List[Tuple[str, str, str]]
+        for footprint, position, field_changes in kicube_update.pin_changes:
+            changes: str = ", ".join([f"{field_name} '{old_value}' -> '{new_value}'"
+                                      for field_name, old_value, new_value in field_changes])
+            lines.append(f"~ {footprint} {position}: {changes}")
+        return lines
+
+
+# unit_ranges():
+def unit_ranges(footprint_binding: FootprintBinding) -> Dict[str, Tuple[int, int]]:
+    """Return the (start, end) binding index range of each unit of a FootprintBinding."""
+    ranges: Dict[str, Tuple[int, int]] = {}
+    index: int
+    binding: Tuple[str, ChipPin]
+    for index, binding in enumerate(footprint_binding.bindings):
+        unit: str = binding[1].unit
+        ranges[unit] = (ranges[unit][0] if unit in ranges else index, index + 1)
+    return ranges
+
+
+# kicube_update():
+def kicube_update(kicube: KiCube, footprint_bindings: List[FootprintBinding], csv_text: str,
+                  timestamp: float, project: str, tracing: Text = "") -> Optional[KiCubeUpdate]:
+    """Return the incremental update of a previous KiCube to new STM32CubeMX `.csv` contents.
+
+    The arguments are:
+    * *kicube* (KiCube): The KiCube of the previous run (e.g. from *snapshot_load*().)
+    * *footprint_bindings* (List[FootprintBinding]): The bindings of the previous run.
+    * *csv_text* (str): The new STM32CubeMX `.csv` file contents.
+    * *timestamp* (float): The new `.csv` file time stamp.
+    * *project* (str): The project name for the new *Diagnostics*.
+    None is returned if the pin positions or names changed.  Neither *kicube* nor
+    *footprint_bindings* is modified.
+    """
+    old_chip_pins: List[ChipPin] = kicube.chip_pins
+    lines: List[str] = csv_text.splitlines()[1:]
+    if len(lines) != len(old_chip_pins):
+        return None
+
+    # Classify just the rows whose kind, signal or label changed:
+    diagnostics: Diagnostics = Diagnostics(project)
+    chip_pins: List[ChipPin] = []
+    replacements: Dict[int, ChipPin] = {}
+    line: str
+    old_chip_pin: ChipPin
+    for line, old_chip_pin in zip(lines, old_chip_pins):
+        fields: List[str] = line.replace('"', "").split(',')
+        if len(fields) != 5 or fields[0] != old_chip_pin.position:
+            return None
+        name: str
+        kind: str
+        signal: str
+        label: str
+        _, name, kind, signal, label = fields
+        if name != old_chip_pin.vendor_name:
+            return None
+        if label.startswith('_'):
+            label = '~' + label[1:]
+        chip_pin: ChipPin = old_chip_pin
+        if (kind, signal, label) != (old_chip_pin.kind, old_chip_pin.signal, old_chip_pin.label):
+            chip_pin = ChipPin(line, diagnostics=diagnostics)
+            replacements[id(old_chip_pin)] = chip_pin
+            if tracing:
+                print(f"{tracing}Reclassified {chip_pin}")
+        chip_pins.append(chip_pin)
+
+    # Keep the previous diagnostics, except for the classification problems of changed pins:
+    changed_positions: Set[str] = {chip_pin.position for chip_pin in replacements.values()}
+    key: Tuple[str, str, str, str, str]
+    count: int
+    for key, count in kicube.diagnostics.counts_table.items():
+        if key[3] not in changed_positions or key[1] in BINDING_CODES:
+            diagnostics.counts_table[key] = diagnostics.counts_table.get(key, 0) + count
+
+    # Create the updated KiCube, sharing everything but the pins and diagnostics:
+    new_kicube: KiCube = KiCube.__new__(KiCube)
+    new_kicube.__dict__.update(kicube.__dict__)
+    new_kicube.chip_pins = chip_pins
+    new_kicube.chip_pin_index = ChipPinIndex(chip_pins)
+    new_kicube.diagnostics = diagnostics
+    new_kicube.timestamp = timestamp
+
+    # Update each FootprintBinding, re-sorting only the units that lose or gain a pin:
+    chip_pin_ranks: Dict[str, int] = {chip_pin.position: rank
+                                      for rank, chip_pin in enumerate(chip_pins)}
+    new_footprint_bindings: List[FootprintBinding] = []
+    changed_units: Dict[str, Set[str]] = {}
+    pin_changes: List[PinChange] = []
+    footprint_binding: FootprintBinding
+    for footprint_binding in footprint_bindings:
+        footprint: str = footprint_binding.footprint
+        nucleo: bool = footprint in ("NUCLEO144", "NUCLEO64")
+        units_table: Dict[str, List[Tuple[str, ChipPin]]] = {}
+        footprint_changed_units: Set[str] = set()
+        position: str
+        for position, chip_pin in footprint_binding.bindings:
+            new_chip_pin: Optional[ChipPin] = replacements.get(id(chip_pin))
+            if new_chip_pin is not None:
+                footprint_changed_units.add(chip_pin.unit)
+                footprint_changed_units.add(new_chip_pin.unit)
+                field_changes: List[Tuple[str, str, str]] = [
+                    (field_name, getattr(chip_pin, field_name), getattr(new_chip_pin, field_name))
+                    for field_name in PIN_FIELDS
+                    if getattr(chip_pin, field_name) != getattr(new_chip_pin, field_name)]
+                if len(field_changes) > 0:
+                    pin_changes.append((footprint, position, field_changes))
+                chip_pin = new_chip_pin
+            units_table.setdefault(chip_pin.unit, []).append((position, chip_pin))
+
+        # Within a unit, ties are broken by the order in which *KiCube.binding_generate*()
+        # produced the bindings: connector position for Nucleo boards, `.csv` order otherwise:
+        unit: str
+        for unit in footprint_changed_units:
+            if unit in units_table:
+                units_table[unit].sort(key=lambda binding: (
+                    binding[1].unit_sort,
+                    int(binding[0]) if nucleo else chip_pin_ranks[binding[1].position]))
+        new_footprint_binding: FootprintBinding = FootprintBinding.__new__(FootprintBinding)
+        new_footprint_binding.__dict__.update(footprint_binding.__dict__)
+        new_footprint_binding.bindings = [binding for unit in sorted(units_table.keys())
+                                          for binding in units_table[unit]]
+        new_footprint_bindings.append(new_footprint_binding)
+        changed_units[footprint] = footprint_changed_units
+    return KiCubeUpdate(new_kicube, new_footprint_bindings, footprint_bindings, changed_units,
+                        pin_changes, list(replacements.values()))
@@ -0,0 +1,544 @@
+# This file is licensed using the "MIT License" below:
+#
+# ##################################################################################################
+#
+# MIT License
+#
+# Copyright 2019-2020 Home Brew Robotics Club
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies
+# or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# ##################################################################################################
+# <======================================= 100 characters =======================================> #
+
+
+"""ioc_edit: Apply batched label and pin edits to STM32CubeMX projects without the GUI.
+
+Usage: kicube32 ioc-edit [--dry-run] [--kipart] [--cubemx-db CUBEMX_MCU_DIR] [--verbose]
+                         [--quiet] [--json] [--strict] RULES.txt PROJECT.ioc|DIR ...
+
+RULES.txt has one rule per line.  Fields are split like a shell command line, so labels with
+spaces can be quoted, and '#' starts a comment:
+
+    rename OLD_LABEL NEW_LABEL  # Rename a User Label on whichever pin has it
+    label PIN LABEL             # Set the User Label of a pin ("" removes it)
+    move FROM_PIN TO_PIN        # Move the signal, label and settings of a pin to another pin
+
+A label that starts with '~' is stored with the leading '_' that *ChipPin* turns back into an
+inverted KiCad pin (e.g. '~CS' is stored as '_CS'.)
+
+Each `.ioc` file is loaded once as an ordered list of KEY=VALUE lines, every rule is applied
+to it, and it is written back with the original key order (new keys are placed after the
+other keys of the same pin.)  The matching `BASE.csv` pinout file is updated the same way so
+that the project stays consistent.  Both files are replaced atomically, and only if all of the
+rules applied cleanly.  With `--kipart`, `BASE.kipart.csv` is regenerated in the same pass.
+
+A pin can only be moved to a pin that has no settings of its own.  With `--cubemx-db`, the
+signal must also be one of the alternate functions of the new pin (otherwise a warning says
+that it was not checked.)  Shared analog pins ('SharedAnalog_PIN' and its 'SH.' keys) are
+renamed along with the pin, and EXTI lines can only move to a pin with the same number.
+
+The `.csv` file is rewritten in the same pass as the `.ioc` file, so it stays newer than the
+`.ioc` file and kicube32 does not report it as stale.  A `.csv` file that was already stale
+(older than its `.ioc` file) before the edit is left stale, and `--kipart` refuses it.
+"""
+
+from typing import Any, Dict, IO, List, Optional, Tuple
+
+import argparse
+import os
+import re
+import shlex
+
+from kicube32.kicube32 import Diagnostics, FootprintBinding, IOC, KiCube
+
+# The operations of a rules file and their number of arguments:
+RULE_OPERATIONS: Dict[str, int] = {"label": 2, "move": 2, "rename": 2}
+
+# A rule is (line number, operation, first argument, second argument):
+IOCRule = Tuple[int, str, str, str]
+
+
+# label_normalize():
+def label_normalize(label: str) -> str:
+    """Return a User Label with a leading KiCad '~' converted to the STM32CubeMX '_'."""
+    return '_' + label[1:] if label.startswith('~') else label
+
+
+# pin_trim():
+def pin_trim(name: str) -> str:
+    r"""Return the port pin of a pin name (e.g. 'PH0' for 'PH0-OSC_IN').
+
+    Port pin names can carry alternate names after '/', '-' or an (escaped) space, such as
+    'PB3\ (JTDO/TRACESWO)' in `.ioc` keys.  Other names are trimmed at the first '/' or '-'.
+    """
+    match: Optional[re.Match] = re.match(r"P[A-Z]\d+", name)
+    return match.group(0) if match is not None else re.split(r"[/-]", name)[0]
+
+
+# rules_read():
+def rules_read(rules_file_name: str, diagnostics: Diagnostics) -> List[IOCRule]:
+    """Return the rules of a rules file, reporting malformed rules as errors."""
+    rules: List[IOCRule] = []
+    rules_file: IO[Any]
+    with open(rules_file_name, "r") as rules_file:
+        line_number: int
+        line: str
+        for line_number, line in enumerate(rules_file, 1):
+            fields: List[str]
+            try:
+                fields = shlex.split(line, comments=True)
+            except ValueError as error:
+                diagnostics.error("bad-rule", f"{rules_file_name}:{line_number}: {error}")
+                continue
+            if len(fields) == 0:
+                continue
+            operation: str = fields[0]
+            if RULE_OPERATIONS.get(operation, -1) != len(fields) - 1:
+                diagnostics.error("bad-rule", f"{rules_file_name}:{line_number}: "
+                                  f"'{line.strip()}' is not a 'rename', 'label' or 'move' rule")
+                continue
+            rules.append((line_number, operation, fields[1], fields[2]))
+    return rules
+
+
+# IOCEditor:
+class IOCEditor:
+    """Represents the KEY=VALUE lines of an `.ioc` file and its pinout `.csv` file for editing."""
+
+    # IOCEditor.__init__():
+    def __init__(self, ioc_file_name: str, ioc_text: str, csv_text: str,
+                 diagnostics: Diagnostics,
+                 pin_signals: Optional[Dict[str, List[str]]] = None) -> None:
+        """Initialize an IOCEditor.
+
+        The arguments are:
+        * *ioc_file_name* (str): The `.ioc` file name.
+        * *ioc_text* (str): The `.ioc` file contents.
+        * *csv_text* (str): The pinout `.csv` file contents (empty if there is none.)
+        * *diagnostics* (Diagnostics): Where problems with the rules are reported.
+        * *pin_signals* (Optional[Dict[str, List[str]]]): The signals that can be routed to
+          each trimmed pin name (e.g. from the STM32CubeMX index.)  If None, moved signals
+          are not checked.
+        """
+        # ioc_editor: IOCEditor = self
+        self.changes: List[str] = []
+        self.csv_lines: List[str] = csv_text.split('\n') if csv_text else []
+        self.diagnostics: Diagnostics = diagnostics
+        self.file_name: str = ioc_file_name
+        self.keys_table: Dict[str, int] = {}
+        self.lines: List[str] = ioc_text.split('\n')
+        self.pin_signals: Optional[Dict[str, List[str]]] = pin_signals
+        self.pins_table: Dict[str, str] = {}
+        self.keys_index()
+
+    # IOCEditor.keys_index():
+    def keys_index(self) -> None:
+        """Rebuild the key to line index table and the trimmed pin name table."""
+        ioc_editor: IOCEditor = self
+        keys_table: Dict[str, int] = {}
+        pins_table: Dict[str, str] = {}
+        line_index: int
+        line: str
+        for line_index, line in enumerate(ioc_editor.lines):
+            equals_index: int = line.find('=')
+            if equals_index > 0 and not line.startswith('#'):
+                key: str = line[:equals_index]
+                keys_table[key] = line_index
+                pin_name: str = key.split('.')[0]
+                if re.match(r"P[A-K]\d+", pin_name):
+                    pins_table[pin_trim(pin_name)] = pin_name
+        ioc_editor.keys_table = keys_table
+        ioc_editor.pins_table = pins_table
+
+    # IOCEditor.value():
+    def value(self, key: str) -> Optional[str]:
+        """Return the value of a key or None if it is not present."""
+        ioc_editor: IOCEditor = self
+        line_index: Optional[int] = ioc_editor.keys_table.get(key)
+        return None if line_index is None else ioc_editor.lines[line_index][len(key) + 1:]
+
+    # IOCEditor.value_set():
+    def value_set(self, key: str, value: Optional[str]) -> None:
+        """Set the value of a key in place, removing the key if *value* is None.
+
+        A new key is inserted in sorted order among the keys with the same prefix (e.g. 'PA5.'),
+        or else in front of the first key that sorts after it.
+        """
+        ioc_editor: IOCEditor = self
+        lines: List[str] = ioc_editor.lines
+        old_value: Optional[str] = ioc_editor.value(key)
+        if old_value == value:
+            return
+        ioc_editor.changes.append(f"{key}: {old_value} => {value}")
+        line_index: Optional[int] = ioc_editor.keys_table.get(key)
+        if line_index is not None:
+            if value is None:
+                del lines[line_index]
+                ioc_editor.keys_index()
+            else:
+                lines[line_index] = f"{key}={value}"
+        elif value is not None:
+            prefix: str = key.split('.')[0] + '.'
+            prefix_indices: List[Tuple[str, int]] = [
+                (other_key, other_index)
+                for other_key, other_index in ioc_editor.keys_table.items()
+                if other_key.startswith(prefix)]
+            insert_index: int = -1
+            if len(prefix_indices) > 0:
+                insert_index = min([other_index for other_key, other_index in prefix_indices
+                                    if other_key > key] +
+                                   [max([other_index for _, other_index in prefix_indices]) + 1])
+            else:
+                insert_index = min([other_index
+                                    for other_key, other_index in ioc_editor.keys_table.items()
+                                    if other_key > key] + [len(lines)])
+                while insert_index > 0 and lines[insert_index - 1] == "":
+                    insert_index -= 1
+            lines.insert(insert_index, f"{key}={value}")
+            ioc_editor.keys_index()
+
+    # IOCEditor.key_rename():
+    def key_rename(self, old_key: str, new_key: str) -> None:
+        """Rename a key, keeping its position and value."""
+        ioc_editor: IOCEditor = self
+        line_index: int = ioc_editor.keys_table[old_key]
+        ioc_editor.lines[line_index] = f"{new_key}={ioc_editor.value(old_key)}"
+        ioc_editor.changes.append(f"{old_key} => {new_key}")
+        ioc_editor.keys_index()
+
+    # IOCEditor.csv_row_find():
+    def csv_row_find(self, pin: str) -> Tuple[int, List[str]]:
+        """Return the line index and fields of the pinout `.csv` row of a pin ((-1, []) if none)."""
+        ioc_editor: IOCEditor = self
+        line_index: int
+        line: str
+        for line_index, line in enumerate(ioc_editor.csv_lines[1:], 1):
+            fields: List[str] = line.replace('"', "").split(',')
+            if len(fields) == 5 and pin_trim(fields[1]) == pin:
+                return line_index, fields
+        return -1, []
+
+    # IOCEditor.csv_row_set():
+    def csv_row_set(self, pin: str, signal: Optional[str], label: Optional[str]) -> None:
+        """Set the signal and/or label of a pin in the pinout `.csv` lines (None means keep)."""
+        ioc_editor: IOCEditor = self
+        line_index: int
+        fields: List[str]
+        line_index, fields = ioc_editor.csv_row_find(pin)
+        if line_index >= 0:
+            if signal is not None:
+                fields[3] = signal
+            if label is not None:
+                fields[4] = label
+            ioc_editor.csv_lines[line_index] = '"' + '","'.join(fields) + '"'
+
+    # IOCEditor.label_set():
+    def label_set(self, pin: str, label: str) -> bool:
+        """Set (or remove if empty) the User Label of a pin, returning False if there is no pin."""
+        ioc_editor: IOCEditor = self
+        pin_name: Optional[str] = ioc_editor.pins_table.get(pin)
+        if pin_name is None:
+            ioc_editor.diagnostics.error("unknown-pin",
+                                         f"Pin '{pin}' has no settings in '{ioc_editor.file_name}'")
+            return False
+        label = label_normalize(label)
+        label_key: str = f"{pin_name}.GPIO_Label"
+        had_label: bool = ioc_editor.value(label_key) is not None
+        ioc_editor.value_set(label_key, label if label else None)
+
+        # Keep the 'GPIO_Label' entry of the pin's GPIOParameters list in step:
+        parameters_key: str = f"{pin_name}.GPIOParameters"
+        parameters_text: Optional[str] = ioc_editor.value(parameters_key)
+        if parameters_text is not None or (label and not had_label):
+            parameters: List[str] = parameters_text.split(',') if parameters_text else []
+            if label and "GPIO_Label" not in parameters:
+                parameters.append("GPIO_Label")
+            elif not label and "GPIO_Label" in parameters:
+                parameters.remove("GPIO_Label")
+            ioc_editor.value_set(parameters_key, ','.join(parameters) if parameters else None)
+        ioc_editor.csv_row_set(pin, None, label)
+        return True
+
+    # IOCEditor.rule_apply():
+    def rule_apply(self, rule: IOCRule) -> bool:
+        """Apply one rule, returning False if it could not be applied."""
+        ioc_editor: IOCEditor = self
+        diagnostics: Diagnostics = ioc_editor.diagnostics
+        operation: str = rule[1]
+        first: str = rule[2]
+        second: str = rule[3]
+        applied: bool = True
+        if operation == "label":
+            applied = ioc_editor.label_set(first, second)
+        elif operation == "rename":
+            old_label: str = label_normalize(first)
+            pins: List[str] = [pin for pin, pin_name in ioc_editor.pins_table.items()
+                               if ioc_editor.value(f"{pin_name}.GPIO_Label") == old_label]
+            if len(pins) == 0:
+                diagnostics.warning("unknown-label", f"No pin has the label '{first}'")
+            pin: str
+            for pin in pins:
+                applied = ioc_editor.label_set(pin, second) and applied
+        elif operation == "move":
+            applied = ioc_editor.pin_move(first, second)
+        return applied
+
+    # IOCEditor.pin_move():
+    def pin_move(self, from_pin: str, to_pin: str) -> bool:
+        """Move every setting of one pin to another unused pin."""
+        ioc_editor: IOCEditor = self
+        diagnostics: Diagnostics = ioc_editor.diagnostics
+        from_name: Optional[str] = ioc_editor.pins_table.get(from_pin)
+        if from_name is None:
+            diagnostics.error("unknown-pin",
+                              f"Pin '{from_pin}' has no settings in '{ioc_editor.file_name}'")
+            return False
+        if to_pin in ioc_editor.pins_table:
+            to_name: str = ioc_editor.pins_table[to_pin]
+            to_signal: Optional[str] = ioc_editor.value(f"{to_name}.Signal")
+            diagnostics.error("pin-in-use", f"Pin '{to_pin}' is already used for '{to_signal}'"
+                              if to_signal is not None else
+                              f"Pin '{to_pin}' already has settings in "
+                              f"'{ioc_editor.file_name}'")
+            return False
+
+        # Use the full pin name (e.g. 'PH0-OSC_IN') from the pinout `.csv` file, if any.  The
+        # `.ioc` keys escape its spaces:
+        to_fields: List[str] = ioc_editor.csv_row_find(to_pin)[1]
+        to_name = to_fields[1].replace(' ', "\\ ") if len(to_fields) == 5 else to_pin
+
+        # Check that the signal can be routed to *to_pin*:
+        signal: str = ioc_editor.value(f"{from_name}.Signal") or ""
+        shared_analog: str = f"SharedAnalog_{from_pin}"
+        exti_match: Optional[re.Match] = re.fullmatch(r"GPXTI(\d+)", signal)
+        if exti_match is not None and exti_match.group(1) != re.sub(r"^P[A-Z]", "", to_pin):
+            diagnostics.error("exti-line-change", f"Pin '{from_pin}' uses EXTI line "
+                              f"{exti_match.group(1)}, which '{to_pin}' does not have")
+            return False
+        signals: List[str] = [signal]
+        if signal == shared_analog:
+            signals = [(ioc_editor.value(key) or "").split(',')[0]
+                       for key in ioc_editor.keys_table
+                       if key.startswith(f"SH.{shared_analog}.") and key[-1].isdigit()]
+        signals = [signal for signal in signals
+                   if signal and not signal.startswith(("GPIO_", "GPXTI"))]
+        pin_signals: Optional[Dict[str, List[str]]] = ioc_editor.pin_signals
+        if pin_signals is None:
+            if len(signals) > 0:
+                diagnostics.warning("move-unchecked", f"Moving {signals} from '{from_pin}' to "
+                                    f"'{to_pin}' was not checked (see --cubemx-db)")
+        else:
+            unroutable: List[str] = [signal for signal in signals
+                                     if signal not in pin_signals.get(to_pin, [])]
+            if len(unroutable) > 0:
+                diagnostics.error("signal-not-routable",
+                                  f"Pin '{to_pin}' can not carry {unroutable}")
+                return False
+
+        # Rename the pin keys and the shared analog keys, and update the values that name the
+        # pin (e.g. 'Mcu.PinN=NAME' and 'PA4.Signal=SharedAnalog_PA4'):
+        key: str
+        for key in list(ioc_editor.keys_table.keys()):
+            value: Optional[str] = ioc_editor.value(key)
+            if key.startswith(from_name + '.'):
+                ioc_editor.key_rename(key, to_name + key[len(from_name):])
+                key = to_name + key[len(from_name):]
+            elif key.startswith(f"SH.{shared_analog}."):
+                ioc_editor.key_rename(key, f"SH.SharedAnalog_{to_pin}." +
+                                      key[len(f"SH.{shared_analog}."):])
+                key = f"SH.SharedAnalog_{to_pin}." + key[len(f"SH.{shared_analog}."):]
+            if key.startswith("Mcu.Pin") and value == from_name:
+                ioc_editor.value_set(key, to_name)
+            elif value == shared_analog:
+                ioc_editor.value_set(key, f"SharedAnalog_{to_pin}")
+
+        # Move the signal and label in the pinout `.csv` file:
+        fields: List[str] = ioc_editor.csv_row_find(from_pin)[1]
+        if len(fields) == 5:
+            ioc_editor.csv_row_set(to_pin, fields[3], fields[4])
+            ioc_editor.csv_row_set(from_pin, "", "")
+        return True
+
+    # IOCEditor.ioc_text():
+    def ioc_text(self) -> str:
+        """Return the edited `.ioc` file contents."""
+        return '\n'.join(self.lines)
+
+    # IOCEditor.csv_text():
+    def csv_text(self) -> str:
+        """Return the edited pinout `.csv` file contents."""
+        return '\n'.join(self.csv_lines)
+
+
+# text_replace():
+def text_replace(file_name: str, text: str) -> None:
+    """Replace the contents of a file atomically."""
+    temporary_file_name: str = f"{file_name}.{os.getpid()}.tmp"
+    temporary_file: IO[Any]
+    with open(temporary_file_name, "w") as temporary_file:
+        temporary_file.write(text)
+    os.replace(temporary_file_name, file_name)
+
+
+# project_edit():
+def project_edit(ioc_file_name: str, rules: List[IOCRule], dry_run: bool, kipart: bool,
+                 diagnostics: Diagnostics, verbose: bool = False,
+                 cubemx_index: Any = None) -> bool:
+    """Apply rules to one project and optionally regenerate its kipart file.
+
+    Nothing is written if any rule fails (or if *dry_run* is True.)  If *cubemx_index* (a
+    *CubeMXIndex*) is given, moved signals are checked against it.  False is returned on
+    failure.
+    """
+    csv_file_name: str = ioc_file_name[:-4] + ".csv"
+    ioc_text: str
+    csv_text: str = ""
+    text_file: IO[Any]
+    try:
+        with open(ioc_file_name, "r") as text_file:
+            ioc_text = text_file.read()
+        if os.path.isfile(csv_file_name):
+            with open(csv_file_name, "r") as text_file:
+                csv_text = text_file.read()
+    except OSError as error:
+        diagnostics.error("unreadable-project", str(error))
+        return False
+
+    # Look up the signals that each pin of the MCU can carry:
+    pin_signals: Optional[Dict[str, List[str]]] = None
+    if cubemx_index is not None:
+        mcu_match: Optional[re.Match] = re.search(r"^Mcu\.Name=(.*)$", ioc_text, re.MULTILINE)
+        pin_signals = {}
+        if mcu_match is not None:
+            pin_name: str
+            signals: List[str]
+            for _, pin_name, _, signals in cubemx_index.pins(mcu_match.group(1).strip()):
+                pin_signals.setdefault(pin_trim(pin_name), []).extend(signals)
+        if len(pin_signals) == 0:
+            diagnostics.warning("cubemx-unknown-mcu", f"The MCU of '{ioc_file_name}' is not in "
+                                "the CubeMX index, so moves are not checked")
+            pin_signals = None
+
+    ioc_editor: IOCEditor = IOCEditor(ioc_file_name, ioc_text, csv_text, diagnostics,
+                                      pin_signals)
+    applied: bool = True
+    rule: IOCRule
+    for rule in rules:
+        applied = ioc_editor.rule_apply(rule) and applied
+    if verbose or dry_run:
+        change: str
+        for change in ioc_editor.changes:
+            print(f"{ioc_file_name}: {change}")
+    if not applied or dry_run or len(ioc_editor.changes) == 0:
+        return applied
+
+    # A `.csv` file that is older than its `.ioc` file (i.e. stale, see *kicube32.main*())
+    # must be regenerated by STM32CubeMX; editing it does not make it current:
+    csv_current: bool = (bool(csv_text) and
+                         os.path.getmtime(csv_file_name) > os.path.getmtime(ioc_file_name))
+    if kipart and not csv_current:
+        diagnostics.error("stale-csv", f"'{csv_file_name}' is missing or older than "
+                          f"'{ioc_file_name}', so kipart can not be regenerated")
+        return False
+
+    # Write the `.ioc` file first so that the `.csv` file is never older than it.  The `.csv`
+    # file is edited in step with the `.ioc` file, so a current `.csv` file stays current even
+    # if both get the same (coarse) file system time stamp:
+    text_replace(ioc_file_name, ioc_editor.ioc_text())
+    if csv_text:
+        text_replace(csv_file_name, ioc_editor.csv_text())
+        ioc_mtime: float = os.path.getmtime(ioc_file_name)
+        if csv_current and os.path.getmtime(csv_file_name) <= ioc_mtime:
+            os.utime(csv_file_name, (ioc_mtime + 0.001, ioc_mtime + 0.001))
+
+    # Regenerate the kipart file from the edited texts without reading them back in:
+    if kipart:
+        ioc: IOC = IOC(ioc_file_name, ioc_text=ioc_editor.ioc_text(), timestamp=0.0)
+        kicube: KiCube = KiCube(ioc_file_name, csv_file_name, ioc.mcu_name, ioc.board_name,
+                                ioc.package, diagnostics=diagnostics,
+                                csv_text=ioc_editor.csv_text(), timestamp=1.0)
+        footprint_binding: Optional[FootprintBinding] = kicube.binding_generate()
+        if footprint_binding is None:
+            diagnostics.error("unsupported-footprint", "The default footprint is not supported")
+            return False
+        text_replace(ioc_file_name[:-4] + ".kipart.csv",
+                     "".join(footprint_binding.kipart_lines()))
+    return True
+
+
+# ioc_edit_main():
+def ioc_edit_main(arguments: List[str]) -> int:
+    """Apply a rules file to many STM32CubeMX projects."""
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="kicube32 ioc-edit",
+        description="Rename User Labels and move pins in many .ioc files at once.")
+    parser.add_argument("rules_file_name", metavar="RULES.txt", help="Edit rules file")
+    parser.add_argument("paths", metavar="PROJECT.ioc|DIR", nargs="+",
+                        help="Project .ioc files or directories to search for .ioc files")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Show the changes without writing anything")
+    parser.add_argument("--kipart", action="store_true",
+                        help="Regenerate BASE.kipart.csv next to each edited .ioc file")
+    parser.add_argument("--cubemx-db", default="", metavar="CUBEMX_MCU_DIR",
+                        help="Check moved signals against an STM32CubeMX 'db/mcu' directory")
+    parser.add_argument("--cubemx-cache", default="", metavar="INDEX.bin",
+                        help="CubeMX index file (default: in ~/.cache/kicube32)")
+    parser.add_argument("--verbose", action="store_true", help="Show every change")
+    parser.add_argument("--quiet", action="store_true", help="Do not print warnings or errors")
+    parser.add_argument("--json", action="store_true", help="Print warnings and errors as JSON")
+    parser.add_argument("--strict", action="store_true",
+                        help="Fail if there are any warnings or errors")
+    parsed_arguments: argparse.Namespace = parser.parse_args(arguments)
+
+    from kicube32.batch import ioc_file_names_find
+    diagnostics: Diagnostics = Diagnostics(os.path.basename(parsed_arguments.rules_file_name))
+    rules: List[IOCRule] = rules_read(parsed_arguments.rules_file_name, diagnostics)
+    ioc_file_names: List[str] = ioc_file_names_find(parsed_arguments.paths)
+    cubemx_index: Any = None
+    if parsed_arguments.cubemx_db:
+        from kicube32.cubemx_index import cubemx_index_open
+        try:
+            cubemx_index = cubemx_index_open(parsed_arguments.cubemx_db,
+                                             parsed_arguments.cubemx_cache)
+        except OSError as error:
+            print(error)
+            return 1
+    failures: int = 0
+    if diagnostics.severity_count("error") == 0:
+        ioc_file_name: str
+        for ioc_file_name in ioc_file_names:
+            project_diagnostics: Diagnostics = Diagnostics(os.path.basename(ioc_file_name)[:-4])
+            if not ioc_file_name.endswith(".ioc") or "!/" in ioc_file_name:
+                project_diagnostics.error("not-editable",
+                                          f"'{ioc_file_name}' is not an editable .ioc file")
+                failures += 1
+            elif not project_edit(ioc_file_name, rules, parsed_arguments.dry_run,
+                                  parsed_arguments.kipart, project_diagnostics,
+                                  parsed_arguments.verbose, cubemx_index):
+                failures += 1
+            diagnostics.merge(project_diagnostics)
+    if cubemx_index is not None:
+        cubemx_index.close()
+
+    diagnostics.summary_print(parsed_arguments.json, parsed_arguments.quiet)
+    result: int = 0
+    if (failures > 0 or diagnostics.severity_count("error") > 0 or
+            (parsed_arguments.strict and diagnostics.severity_count() > 0)):
+        result = 1
+    return result
@@ -28,38 +28,319 @@
 
 """kicube32: A program for generating KiCad schematic symbols for STM32 processors.
 
-Usage: kicube32 BASE.ioc BASE.csv KIPART.csv # input input output
+Usage: kicube32 BASE.ioc BASE.csv KIPART.csv [--footprint FOOTPRINT=KIPART.csv ...]
+                [--pins-db PINS.db [--project NAME]] [--quiet] [--json] [--strict]
+                [--cubemx-db CUBEMX_MCU_DIR [--cubemx-cache INDEX.bin]] [--dcm FILE.dcm]
+                [--metrics FILE.prom|FILE.json] [--snapshot BASE.kicube [--incremental]]
+       kicube32 batch [--jobs N] [--output-directory DIR] [--pins-db PINS.db]
+                      [--metrics FILE.prom|FILE.json [--metrics-interval SECONDS]]
+                      PROJECT.ioc|DIR ...
+       kicube32 cubemx-import CUBEMX_MCU_DIR [--cache INDEX.bin]
+       kicube32 cubemx-query CUBEMX_MCU_DIR MCU [--pin P] [--signal S]
+       kicube32 git-sweep [--diff] [--output-directory DIR] REPOSITORY BASE.ioc BASE.csv RANGE
+       kicube32 ioc-edit [--dry-run] [--kipart] RULES.txt PROJECT.ioc|DIR ...
+       kicube32 lib-diff [--quiet] OLD.lib NEW.lib
+       kicube32 lib-insert [--fixup] LIBRARY.lib SYMBOLS.lib ...
+       kicube32 lib-merge [--jobs N] OUTPUT.lib INPUT.lib ...
+       kicube32 lib-index INDEX.db INPUT.lib ...
+       kicube32 lib-query INDEX.db [--symbol S] [--pin P] [--number N] [--type T] [--signal S]
+       kicube32 pins-query PINS.db [--pin P] [--signal S] [--label L] [--connector-usage N]
+       kicube32 pinmux CUBEMX_MCU_DIR BOARD|all KIND[:COUNT] ... [--connector CN] [--exclude PINS]
 """
 
-from typing import Any, Dict, IO, List, Text, Tuple
+from typing import Any, Callable, Dict, IO, List, Optional, Text, Tuple
 
+import argparse
+import importlib
+import json
 import os
 import sys
+import threading
+
+
+# The processors that have Nucleo-144 boards:
+NUCLEO144_MCUS: List[str] = [
+  "F207ZG",
+  "F303ZE",        # FIXME: This one may be slightly different!!!
+  "F412ZG",
+  "F413ZG",
+  "F429ZI",
+  "F746ZG",
+  "F767ZI",
+  "H743ZI",
+]
+
+# The processors that have Nucleo-64 boards mapped to the processor with the same pin bindings:
+NUCLEO64_CPU_MAPPING: Dict[str, str] = {
+  "F030R8": "F030R8",
+  "F070RB": "F070RB",
+  "F334R8": "F334R8",
+  "F303RE": "F334R8",
+  "F091RC": "F334R8",
+  "F072RB": "F334R8",
+  "F103RB": "F103RB",
+  "F302RB": "F302RB",
+  "F401RE": "F446RE",
+  "F411RE": "F446RE",
+  "F446RE": "F446RE",
+  "L053R8": "L152RE",
+  "L073RZ": "L152RE",
+  "L152RE": "L152RE",
+  "L452RE": "L452RE",
+  "L476RG": "L476RG",
+  "F410RB": "L410RB"
+}
+
+# The format of each kipart `.csv` file line:
+KIPART_LINE_FORMAT: str = '"{0}", "{1}", "{2}", "{3}", "{4}", "{5}"\n'
+
+# The Nucleo-144 connector pin bindings (connector position, pin name).  The position is
+# 1000 * connector + pin (e.g. 1101 is CN11 pin 1.)  Being a tuple of constants, the whole table
+# is a single constant in the compiled `.pyc` file rather than being rebuilt on each call:
+NUCLEO144_BINDINGS: Tuple[Tuple[int, str], ...] = (
+    (1101, "PC10"),  (1102, "PC11"),  (1201, "PC9"),  (1202, "PC8"),
+    (1103, "PC12"),  (1104, "PD2"),   (1203, "PB8"),  (1204, "PC6"),
+    (1105, "VDD"),   (1106, "E5V"),   (1205, "PB9"),  (1206, "PC5"),
+    (1107, "BOOT0"), (1108, "GND"),   (1207, "AVDD"), (1208, "U5V"),
+    (1109, "PF6"),   (1110, "NC1"),   (1209, "GND"),  (1210, "PD8"),
+    (1111, "PF7"),   (1112, "IOREF"), (1211, "PA5"),  (1212, "PA12"),
+    (1113, "PA13"),  (1114, "RESET"), (1213, "PA6"),  (1214, "PA11"),
+    (1115, "PA14"),  (1116, "+3.3V"), (1215, "PA7"),  (1216, "PB12"),
+    (1117, "PA15"),  (1118, "+5V"),   (1217, "PB6"),  (1218, "PB11"),
+    (1119, "GND"),   (1120, "GND"),   (1219, "PC7"),  (1220, "GND"),
+    (1121, "PB7"),   (1122, "GND"),   (1221, "PA9"),  (1222, "PB2"),
+    (1123, "PC13"),  (1124, "VIN"),   (1223, "PA8"),  (1224, "PB1"),
+    (1125, "PC14"),  (1126, "NC2"),   (1225, "PB10"), (1226, "PB15"),
+    (1127, "PC15"),  (1128, "PA0"),   (1227, "PB4"),  (1228, "PB14"),
+    (1129, "PH0"),   (1130, "PA1"),   (1229, "PB5"),  (1230, "PB13"),
+    (1131, "PH1"),   (1132, "PA4"),   (1231, "PB3"),  (1232, "AGND"),
+    (1133, "VBAT"),  (1134, "PB0"),   (1233, "PA10"), (1234, "PC4"),
+    (1135, "PC2"),   (1136, "PC1"),   (1235, "PA2"),  (1236, "PF5"),
+    (1137, "PC3"),   (1138, "PC0"),   (1237, "PA3"),  (1238, "PF4"),
+    (1139, "PD4"),   (1140, "PD3"),   (1239, "GND"),  (1240, "PE8"),
+    (1141, "PD5"),   (1142, "PG2"),   (1241, "PD13"), (1242, "PF10"),
+    (1143, "PD6"),   (1144, "PG3"),   (1243, "PD12"), (1244, "PE7"),
+    (1145, "PD7"),   (1146, "PE2"),   (1245, "PD11"), (1246, "PD14"),
+    (1147, "PE3"),   (1148, "PE4"),   (1247, "PE10"), (1248, "PD15"),
+    (1149, "GND"),   (1150, "PE5"),   (1249, "PE12"), (1250, "PF14"),
+    (1151, "PF1"),   (1152, "PF2"),   (1251, "PE14"), (1252, "PE9"),
+    (1153, "PF0"),   (1154, "PF8"),   (1253, "PE15"), (1254, "GND"),
+    (1155, "PD1"),   (1156, "PF9"),   (1255, "PE13"), (1256, "PE11"),
+    (1157, "PD0"),   (1158, "PG1"),   (1257, "PF13"), (1258, "PF3"),
+    (1159, "PG0"),   (1160, "GND"),   (1259, "PF12"), (1260, "PF15"),
+    (1161, "PE1"),   (1162, "PE6"),   (1261, "PG14"), (1262, "PF11"),
+    (1163, "PG9"),   (1164, "PG15"),  (1263, "GND"),  (1264, "PE0"),
+    (1165, "PG12"),  (1166, "PG10"),  (1265, "PD10"), (1266, "PG8"),
+    (1167, "NC3"),   (1168, "PG13"),  (1267, "PG7"),  (1268, "PG5"),
+    (1169, "PD9"),   (1170, "PG11"),  (1269, "PG4"),  (1270, "PG6"),
+)
+
+# The Nucleo-64 connector pin bindings (connector position, pin name, alternate names).  Each
+# alternate name is (alternate_pin_name, processor, ...).  A pin name of the form 'A:B' can be
+# solder bridged to either pin A or pin B:
+NUCLEO64_PIN_BINDINGS: Tuple[Tuple[int, str, Tuple[Tuple[str, ...], ...]], ...] = (
+    (701, "PC10", ()),
+    (703, "PC12", ()),
+    (705, "VDD", ()),
+    (707, "BOOT0", (("PH3:BT0", "L452RE"),)),
+    (709, "NC1", (("PF6", "F030R8"),)),
+    (711, "NC2", (("PF7", "F030R8"),)),
+    (713, "PA13", ()),
+    (715, "PA14", ()),
+    (717, "PA15", ()),
+    (719, "GND", ()),
+    (721, "PB7", ()),
+    (723, "PC13", ()),
+    (725, "PC14", ()),
+    (727, "PC15", ()),
+    (729, "PF0", (("PD0", "F103RB"),
+                  ("PH0", "F446RE", "L152RE", "L452RE", "F476RG", "F410RB"))),
+    (731, "PF1", (("PD1", "F103RB"),
+                  ("PH1", "F446RE", "L152RE", "L452RE", "F476RG", "F410RB"))),
+    (733, "VBAT", (("VDD", "F070RB"), ("VLCD", "L152RE"))),
+    (735, "PC2", ()),
+    (737, "PC3", ()),
+    (702, "PC11", ()),
+    (704, "PD2", ()),
+    (706, "E5V", ()),
+    (708, "GND", ()),
+    (710, "NC3", ()),
+    (712, "IOREF", ()),
+    (714, "RESET", ()),
+    (716, "+3.3V", ()),
+    (718, "+5V", ()),
+    (720, "GND", ()),
+    (722, "GND", ()),
+    (724, "VIN", ()),
+    (726, "NC4", ()),
+    (728, "PA0", ()),
+    (730, "PA1", ()),
+    (732, "PA4", ()),
+    (734, "PB0", ()),
+    (736, "PC1:PB9", ()),
+    (738, "PC0:PB8", ()),
+    (1001, "PC9", ()),
+    (1003, "PB8", ()),
+    (1005, "PB9", ()),
+    (1007, "AVDD", ()),
+    (1009, "GND", ()),
+    (1011, "PA5", (("PB13", "F302R8"),)),
+    (1013, "PA6", (("PB14", "F302R8"),)),
+    (1015, "PA7", (("PB15", "F302R8"),)),
+    (1017, "PB6", ()),
+    (1019, "PC7", ()),
+    (1021, "PA9", ()),
+    (1023, "PA8", ()),
+    (1025, "PB10", ()),
+    (1027, "PB4", ()),
+    (1029, "PB5", ()),
+    (1031, "PB3", ()),
+    (1033, "PA10", ()),
+    (1035, "PA2", ()),
+    (1037, "PA3", ()),
+    (1002, "PC8", ()),
+    (1004, "PC6", ()),
+    (1006, "PC5", ()),
+    (1008, "U5V", ()),
+    (1010, "NC5", ()),
+    (1012, "PA12", ()),
+    (1014, "PA11", ()),
+    (1016, "PB12", ()),
+    (1018, "PB11", ()),
+    (1020, "GND", ()),
+    (1022, "PB2", ()),
+    (1024, "PB1", ()),
+    (1026, "PB15", (("PA7", "F302R8"),)),
+    (1028, "PB14", (("PA6", "F302R8"),)),
+    (1030, "PB13", (("PA5", "F302R8"),)),
+    (1032, "AGND", ()),
+    (1034, "PC4", ()),
+    (1036, "NC6", (("PF5", "F030R8"),)),
+    (1038, "NC7", (("PF4", "F030R8"),)),
+)
 
 
 # main:
 def main() -> int:
     """Parse arguments a execute program."""
+    # Dispatch to any sub-command first.  Sub-command modules are only imported when needed:
+    arguments: List[str] = sys.argv[1:]
+    commands: Dict[str, str] = {
+        "batch": "kicube32.batch:batch_main",
+        "cubemx-import": "kicube32.cubemx_index:cubemx_import_main",
+        "cubemx-query": "kicube32.cubemx_index:cubemx_query_main",
+        "git-sweep": "kicube32.git_sweep:git_sweep_main",
+        "ioc-edit": "kicube32.ioc_edit:ioc_edit_main",
+        "lib-diff": "kicube32.library_diff:library_diff_main",
+        "lib-index": "kicube32.symbol_index:library_index_main",
+        "lib-insert": "kicube32.library_journal:library_insert_main",
+        "lib-merge": "kicube32.schematic_library:library_merge_main",
+        "lib-query": "kicube32.symbol_index:library_query_main",
+        "pinmux": "kicube32.pinmux_solver:pinmux_main",
+        "pins-query": "kicube32.pin_database:pins_query_main",
+    }
+    if len(arguments) >= 1 and arguments[0] in commands:
+        module_name: str
+        function_name: str
+        module_name, function_name = commands[arguments[0]].split(':')
+        command_main: Callable[[List[str]], int]
+        command_main = getattr(importlib.import_module(module_name), function_name)
+        return command_main(arguments[1:])
+
     # Parse the command line *arguments*:
     tracing: Text = ""  # "    "
     result: int = 1  # Default to an error return.  Set to 0 only on success.
-    arguments: List[str] = sys.argv[1:]
-    arguments_size: int = len(arguments)
-    if arguments_size != 3:
-        print("Usage: kicube32 CUBE_IOC_FILE CUBE_CSV_FILE KIPART_CSV_FILE # input input output")
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="kicube32", description="Generate kipart .csv files from STM32CubeMX projects.")
+    parser.add_argument("ioc_file_name", metavar="CUBE_IOC_FILE", help="Input .ioc file")
+    parser.add_argument("stm32cube_csv_file_name", metavar="CUBE_CSV_FILE",
+                        help="Input STM32CubeMX pinout .csv file")
+    parser.add_argument("kipart_csv_file_name", metavar="KIPART_CSV_FILE",
+                        help="Output kipart .csv file for the default footprint")
+    parser.add_argument("--footprint", metavar="FOOTPRINT=KIPART_CSV_FILE",
+                        action="append", default=[],
+                        help="Additional kipart .csv file for FOOTPRINT "
+                        "(NUCLEO144, NUCLEO64, or the chip package)")
+    parser.add_argument("--pins-db", metavar="PINS.db", default="",
+                        help="Record the classified pins in a cross-project pin database")
+    parser.add_argument("--project", default="",
+                        help="Project name for --pins-db (default: CUBE_IOC_FILE base name)")
+    parser.add_argument("--quiet", action="store_true", help="Do not print warnings or errors")
+    parser.add_argument("--json", action="store_true", help="Print warnings and errors as JSON")
+    parser.add_argument("--strict", action="store_true",
+                        help="Fail if there are any warnings or errors")
+    parser.add_argument("--cubemx-db", default="", metavar="CUBEMX_MCU_DIR",
+                        help="Validate the pins against an STM32CubeMX 'db/mcu' directory")
+    parser.add_argument("--cubemx-cache", default="", metavar="INDEX.bin",
+                        help="CubeMX index file (default: in ~/.cache/kicube32)")
+    parser.add_argument("--dcm", default="", metavar="FILE.dcm",
+                        help="Add or update the .dcm documentation entry of each footprint")
+    parser.add_argument("--metrics", default="", metavar="FILE.prom|FILE.json",
+                        help="Write run metrics in Prometheus text (or .json) format at exit")
+    parser.add_argument("--snapshot", default="", metavar="BASE.kicube",
+                        help="Reuse (or write) a snapshot of the classified pins")
+    parser.add_argument("--incremental", action="store_true",
+                        help="With --snapshot, reclassify only the pins whose .csv row changed")
+    parsed_arguments: argparse.Namespace = parser.parse_args(arguments)
+    ioc_file_name: str = parsed_arguments.ioc_file_name
+    stm32cube_csv_file_name: str = parsed_arguments.stm32cube_csv_file_name
+    kipart_csv_file_name: str = parsed_arguments.kipart_csv_file_name
+
+    # Split each *footprint_argument* into a (footprint, kipart_csv_file_name) pair:
+    footprint_outputs: List[Tuple[str, str]] = [("", kipart_csv_file_name)]
+    footprint_argument: str
+    for footprint_argument in parsed_arguments.footprint:
+        equals_index: int = footprint_argument.find('=')
+        if equals_index <= 0:
+            print(f"--footprint '{footprint_argument}' is not of the form FOOTPRINT=FILE.csv")
+            return result
+        footprint_outputs.append((footprint_argument[:equals_index],
+                                  footprint_argument[equals_index + 1:]))
+
+    footprint: str
+    output_file_name: str
+    if parsed_arguments.incremental and not parsed_arguments.snapshot:
+        print("--incremental requires --snapshot")
+    elif not ioc_file_name.endswith(".ioc"):
+        print(f"First file name '{ioc_file_name}' does not end in '.ioc'.")
+    elif not stm32cube_csv_file_name.endswith(".csv"):
+        print(f"Second file name '{stm32cube_csv_file_name}' does not end in '.csv'.")
+    elif not all([output_file_name.endswith(".csv")
+                  for footprint, output_file_name in footprint_outputs]):
+        print("All kipart file names must end in '.csv'.")
     else:
-        ioc_file_name: str = arguments[0]
-        stm32cube_csv_file_name: str = arguments[1]
-        kipart_csv_file_name: str = arguments[2]
-        if not ioc_file_name.endswith(".ioc"):
-            print(f"First file name '{ioc_file_name}' does not end in '.ioc'.")
-        elif not stm32cube_csv_file_name.endswith(".csv"):
-            print(f"Second file name '{kipart_csv_file_name}' does not end in '.csv'.")
-        elif not kipart_csv_file_name.endswith(".csv"):
-            print(f"Third file name '{kipart_csv_file_name}' does not end in '.csv'.")
+        # Archive members (e.g. 'bundle.zip!/f767zi.ioc') are read straight into memory:
+        ioc_text: Optional[str] = None
+        ioc_timestamp: Optional[float] = None
+        csv_text: Optional[str] = None
+        csv_timestamp: Optional[float] = None
+        archived: bool = "!/" in ioc_file_name or "!/" in stm32cube_csv_file_name
+        if archived:
+            from kicube32.archive import ArchiveReader, text_read
+            archive_reader: ArchiveReader = ArchiveReader()
+            try:
+                ioc_text, ioc_timestamp = text_read(ioc_file_name, archive_reader)
+                csv_text, csv_timestamp = text_read(stm32cube_csv_file_name, archive_reader)
+            except OSError as error:
+                print(error)
+                return result
+            finally:
+                archive_reader.close()
+
+        from kicube32.metrics import Metrics
+        metrics: Metrics = Metrics(parsed_arguments.metrics)
+        if archived:
+            metrics.count("kicube32_read_bytes_total",
+                          len((ioc_text or "").encode()) + len((csv_text or "").encode()))
         else:
+            metrics.file_read(ioc_file_name)
+            metrics.file_read(stm32cube_csv_file_name)
+
+        try:
             # Read in the *ioc_file_name* extract the values:
-            ioc: IOC = IOC(ioc_file_name, tracing=tracing)
+            with metrics.stage("ioc-parse"):
+                ioc: IOC = IOC(ioc_file_name, tracing=tracing, ioc_text=ioc_text,
+                               timestamp=ioc_timestamp)
 
             board_name: str = ioc.board_name
             mcu_name: str = ioc.mcu_name
@@ -67,26 +348,311 @@ def main() -> int:
             # print("mcu_name='{0}'".format(mcu_name))
             # print("board_name='{0}".format(board_name))
             # print("package='{0}".format(package))
-            kicube: KiCube = KiCube(ioc_file_name, stm32cube_csv_file_name,
-                                    mcu_name, board_name, package, tracing=tracing)
-
-            # Verify timestamps:
-            if ioc.timestamp >= kicube.timestamp:
+            project: str = parsed_arguments.project or os.path.basename(ioc_file_name)[:-4]
+            diagnostics: Diagnostics = Diagnostics(project)
+
+            # Reuse the classified pins of a *snapshot* that matches the current inputs:
+            snapshot: Optional[Tuple[KiCube, List[FootprintBinding]]] = None
+            kicube_update: Any = None
+            if parsed_arguments.snapshot:
+                from kicube32.kicube_snapshot import inputs_hash, snapshot_load
+                ioc_hash: bytes
+                csv_hash: bytes
+                ioc_hash, csv_hash, csv_timestamp = inputs_hash(
+                    ioc_file_name, stm32cube_csv_file_name, ioc_text, csv_text)
+                snapshot_data: bytes = b""
+                if os.path.isfile(parsed_arguments.snapshot):
+                    with metrics.stage("snapshot-load"):
+                        snapshot_file: IO[Any]
+                        with open(parsed_arguments.snapshot, "rb") as snapshot_file:
+                            snapshot_data = snapshot_file.read()
+                        snapshot = snapshot_load(snapshot_data, ioc_hash, csv_hash, csv_timestamp)
+                metrics.count("kicube32_cache_hits_total" if snapshot is not None
+                              else "kicube32_cache_misses_total", cache="snapshot")
+
+                # Patch the previous state when only some of the `.csv` rows changed:
+                if snapshot is None and parsed_arguments.incremental and snapshot_data:
+                    previous: Optional[Tuple[KiCube, List[FootprintBinding]]]
+                    previous = snapshot_load(snapshot_data, None, None, csv_timestamp)
+                    if previous is not None and (
+                      (previous[0].mcu_name, previous[0].board_name, previous[0].package) ==
+                      (mcu_name, board_name, package)):
+                        from kicube32.incremental import kicube_update as update_compute
+                        if csv_text is None:
+                            from kicube32.archive import text_read
+                            csv_text = text_read(stm32cube_csv_file_name)[0]
+                        with metrics.stage("incremental-classify"):
+                            kicube_update = update_compute(previous[0], previous[1], csv_text,
+                                                           csv_timestamp, project, tracing=tracing)
+                        if kicube_update is not None:
+                            snapshot = (kicube_update.kicube, kicube_update.footprint_bindings)
+            # Only count the pins that this run actually classifies:
+            if snapshot is not None:
+                kicube: KiCube = snapshot[0]
+                if kicube_update is not None:
+                    metrics.kicube_record(kicube, kicube_update.reclassified_chip_pins)
+                diagnostics.merge(kicube.diagnostics)
+                kicube.diagnostics = diagnostics
+            else:
+                with metrics.stage("classify"):
+                    kicube = KiCube(ioc_file_name, stm32cube_csv_file_name, mcu_name, board_name,
+                                    package, tracing=tracing, diagnostics=diagnostics,
+                                    csv_text=csv_text, timestamp=csv_timestamp)
+                metrics.kicube_record(kicube)
+
+            # Validate the pins against the STM32CubeMX pin database:
+            if parsed_arguments.cubemx_db:
+                from kicube32.cubemx_index import CubeMXIndex, cubemx_index_open, kicube_validate
+                with metrics.stage("cubemx-validate"):
+                    try:
+                        cubemx_index: CubeMXIndex = cubemx_index_open(parsed_arguments.cubemx_db,
+                                                                      parsed_arguments.cubemx_cache,
+                                                                      metrics=metrics)
+                    except OSError as error:
+                        diagnostics.error("cubemx-db", str(error))
+                    else:
+                        kicube_validate(kicube, cubemx_index)
+                        cubemx_index.close()
+
+            # Verify timestamps.  Archive entry time stamps have only 1 or 2 second resolution,
+            # so equal archive time stamps are accepted:
+            ioc_changed: bool = (ioc.timestamp > kicube.timestamp if archived else
+                                 ioc.timestamp >= kicube.timestamp)
+            if ioc_changed:
                 print(f"File '{ioc_file_name}' has changed! "
                       f"Please update file '{stm32cube_csv_file_name}'!!!")
             else:
-                kicube.kipart_generate(kipart_csv_file_name, tracing=tracing)
+                # Generate each of the footprints from the one parsed *kicube*.  Footprints that
+                # are already bound in the *snapshot* are written out without rebinding them:
                 result = 0
+                snapshot_bindings: Dict[str, FootprintBinding] = {}
+                if snapshot is not None:
+                    snapshot_bindings = {footprint_binding.footprint: footprint_binding
+                                         for footprint_binding in snapshot[1]}
+                snapshot_stale: bool = snapshot is None or kicube_update is not None
+                footprint_bindings: List[FootprintBinding] = []
+                for footprint, output_file_name in footprint_outputs:
+                    footprint_binding: Optional[FootprintBinding]
+                    footprint_binding = snapshot_bindings.get(
+                        (footprint or kicube.footprint).upper())
+                    with metrics.stage("kipart-generate"):
+                        if footprint_binding is not None:
+                            if kicube_update is None or not kicube_update.kipart_patch(
+                              footprint_binding, output_file_name):
+                                footprint_binding.kipart_write(output_file_name)
+                        else:
+                            snapshot_stale = True
+                            footprint_binding = kicube.kipart_generate(output_file_name, footprint,
+                                                                       tracing=tracing)
+                    if footprint_binding is None:
+                        result = 1
+                    else:
+                        footprint_bindings.append(footprint_binding)
+                        metrics.file_written(output_file_name)
+
+                # Save the classified and bound pins for the next run and for other tools:
+                if parsed_arguments.snapshot and snapshot_stale:
+                    from kicube32.kicube_snapshot import snapshot_write
+                    with metrics.stage("snapshot-write"):
+                        snapshot_write(parsed_arguments.snapshot, kicube, footprint_bindings,
+                                       ioc_hash, csv_hash)
+                    metrics.file_written(parsed_arguments.snapshot)
+
+                # Record the *footprint_bindings* in the pin database in one transaction:
+                if parsed_arguments.pins_db:
+                    from kicube32.pin_database import PinDatabase
+                    with metrics.stage("pins-db"):
+                        try:
+                            pin_database: PinDatabase = PinDatabase(parsed_arguments.pins_db)
+                        except ValueError as error:
+                            diagnostics.error("pins-db", str(error))
+                        else:
+                            for footprint_binding in footprint_bindings:
+                                pin_database.kicube_upsert(project, kicube, footprint_binding,
+                                                           tracing=tracing)
+                            pin_database.close()
+
+                # Replace just the `.dcm` entries of the *footprint_bindings*:
+                if parsed_arguments.dcm:
+                    from kicube32.doc_library import DocLibrary, component_lines
+                    with metrics.stage("dcm-update"):
+                        doc_library: DocLibrary = DocLibrary(parsed_arguments.dcm)
+                        for footprint_binding in footprint_bindings:
+                            doc_library.update(footprint_binding.symbol_name, component_lines(
+                                footprint_binding.symbol_name, footprint_binding.data_sheet_url,
+                                footprint_binding.description))
+                        doc_library.write()
+                    metrics.file_written(parsed_arguments.dcm)
+
+            # Report the symbol pins that an incremental update changed:
+            if kicube_update is not None and not (parsed_arguments.quiet or parsed_arguments.json):
+                report_line: str
+                for report_line in kicube_update.report_lines():
+                    print(report_line)
+
+            # Report all of the problems once:
+            diagnostics.summary_print(parsed_arguments.json, parsed_arguments.quiet)
+            if diagnostics.severity_count("error") > 0 or (
+              parsed_arguments.strict and diagnostics.severity_count() > 0):
+                result = 1
+        except BaseException:
+            result = 1
+            raise
+        finally:
+            # Export the metrics even when the run fails:
+            metrics.count("kicube32_projects_total", result="ok" if result == 0 else "failed")
+            metrics.write()
 
     return result
 
 
+# position_key_compute():
+def position_key_compute(position: str) -> int:
+    """Return a natural order integer sort key for a physical pin position.
+
+    Numeric positions (e.g. '9', '10', '144') sort numerically, so '9' comes before '10'.
+    Ball grid positions (e.g. 'B12', 'AA3') sort first by row letters and then by column number.
+    The row letters are treated as a base 26 number (A=1, ..., Z=26, AA=27, ...) that is shifted
+    up 16 bits above the column number.  Numeric positions have no row letters, so they all sort
+    before ball grid positions.
+    """
+    letters_size: int = 0
+    while letters_size < len(position) and position[letters_size].isalpha():
+        letters_size += 1
+    digits: str = position[letters_size:]
+    assert digits.isdigit(), f"Bad pin position '{position}'"
+    row: int = 0
+    letter: str
+    for letter in position[:letters_size].upper():
+        row = row * 26 + ord(letter) - ord('A') + 1
+    return (row << 16) | int(digits)
+
+
+# Diagnostics:
+class Diagnostics:
+    """Collects, counts and reports the problems found while processing projects."""
+
+    # Diagnostics.__init__():
+    def __init__(self, project: str = "", immediate: bool = False) -> None:
+        """Initialize a Diagnostics collector.
+
+        The arguments are:
+        * *project* (str): The project name that is attached to each reported problem.
+        * *immediate* (bool): If *True*, problems are printed as they are reported and
+          are not collected.
+        Identical problems (same severity, code, project, pin and message) are only stored
+        once along with a count of the number of times they were reported.  Problems can be
+        reported and merged from multiple threads.
+        """
+        # diagnostics: Diagnostics = self
+        self.project: str = project
+        self.immediate: bool = immediate
+        self.counts_table: Dict[Tuple[str, str, str, str, str], int] = {}
+        self.lock: threading.Lock = threading.Lock()
+
+    # Diagnostics.report():
+    def report(self, severity: str, code: str, message: str, pin: str = "") -> None:
+        """Report a problem with a severity ("error" or "warning") and code."""
+        diagnostics: Diagnostics = self
+        if diagnostics.immediate:
+            print(message)
+        else:
+            key: Tuple[str, str, str, str, str] = (
+                severity, code, diagnostics.project, pin, message)
+            counts_table: Dict[Tuple[str, str, str, str, str], int] = diagnostics.counts_table
+            with diagnostics.lock:
+                counts_table[key] = counts_table.get(key, 0) + 1
+
+    # Diagnostics.error():
+    def error(self, code: str, message: str, pin: str = "") -> None:
+        """Report an error."""
+        diagnostics: Diagnostics = self
+        diagnostics.report("error", code, message, pin)
+
+    # Diagnostics.warning():
+    def warning(self, code: str, message: str, pin: str = "") -> None:
+        """Report a warning."""
+        diagnostics: Diagnostics = self
+        diagnostics.report("warning", code, message, pin)
+
+    # Diagnostics.merge():
+    def merge(self, other_diagnostics: "Diagnostics") -> None:
+        """Merge the problems collected by another Diagnostics into a Diagnostics."""
+        diagnostics: Diagnostics = self
+        counts_table: Dict[Tuple[str, str, str, str, str], int] = diagnostics.counts_table
+        # Copy the other counts first, so the two locks are never held at the same time:
+        with other_diagnostics.lock:
+            other_counts: List[Tuple[Tuple[str, str, str, str, str], int]] = list(
+                other_diagnostics.counts_table.items())
+        key: Tuple[str, str, str, str, str]
+        count: int
+        with diagnostics.lock:
+            for key, count in other_counts:
+                counts_table[key] = counts_table.get(key, 0) + count
+
+    # Diagnostics.severity_count():
+    def severity_count(self, severity: str = "") -> int:
+        """Return the number of distinct problems of one severity, or of all severities."""
+        diagnostics: Diagnostics = self
+        return len([key for key in diagnostics.counts_table.keys()
+                    if severity == "" or key[0] == severity])
+
+    # Diagnostics.json_text():
+    def json_text(self) -> str:
+        """Return the collected problems as JSON text."""
+        diagnostics: Diagnostics = self
+        problems: List[Dict[str, Any]] = []
+        key: Tuple[str, str, str, str, str]
+        count: int
+        for key, count in sorted(diagnostics.counts_table.items()):
+            severity, code, project, pin, message = key
+            problems.append({"severity": severity, "code": code, "project": project,
+                             "pin": pin, "message": message, "count": count})
+        return json.dumps({"errors": diagnostics.severity_count("error"),
+                           "warnings": diagnostics.severity_count("warning"),
+                           "problems": problems}, indent=2)
+
+    # Diagnostics.text_lines():
+    def text_lines(self) -> List[str]:
+        """Return the collected problems as lines of text."""
+        diagnostics: Diagnostics = self
+        lines: List[str] = []
+        key: Tuple[str, str, str, str, str]
+        count: int
+        for key, count in sorted(diagnostics.counts_table.items()):
+            severity, code, project, pin, message = key
+            context: str = ":".join([text for text in (project, pin) if text != ""])
+            repeats: str = f" (x{count})" if count > 1 else ""
+            lines.append(f"{severity}[{code}] {context}: {message}{repeats}")
+        errors_count: int = diagnostics.severity_count("error")
+        warnings_count: int = diagnostics.severity_count("warning")
+        if errors_count + warnings_count > 0:
+            lines.append(f"{errors_count} errors, {warnings_count} warnings")
+        return lines
+
+    # Diagnostics.summary_print():
+    def summary_print(self, json_format: bool = False, quiet: bool = False) -> None:
+        """Print the collected problems once at the end of a run."""
+        diagnostics: Diagnostics = self
+        if json_format:
+            print(diagnostics.json_text())
+        elif not quiet:
+            line: str
+            for line in diagnostics.text_lines():
+                print(line)
+
+
+# Problems reported by ChipPin's created without a Diagnostics are printed immediately:
+immediate_diagnostics: Diagnostics = Diagnostics(immediate=True)
+
+
 # ChipPin:
 class ChipPin:
     """Represents information about one physical microcontroller pin."""
 
     # ChipPin.__init__():
-    def __init__(self, line: str, tracing: Text = "") -> None:
+    def __init__(self, line: str, tracing: Text = "",
+                 diagnostics: Optional["Diagnostics"] = None) -> None:
         """Initialize ChipPin object.
 
         The arguments are:
@@ -97,11 +663,13 @@ class ChipPin:
           * "S" is the internal signal name for chip pin (e.g. 'UART7_RX', etc.)
           * "L" is some additional information about the pin, usually for GPI pins.
         These values are stuffed into directly into attributes named *position*, *name*,
-        *kind*, *signal*, and *label*.
+        *kind*, *signal*, and *label*.  Any classification problems are reported to
+        *diagnostics*.  If *diagnostics* is None, problems are printed immediately.
 
         In addition, two sort keys are generated to order a list of *ChipPin* objects.
         The *position_key* is used to sort exclusively by *position*.  The *group_key* is used
-        to group pins into ordered groups.
+        to group pins into ordered groups.  The original vendor name is kept in *vendor_name*
+        since *name* gets decorated with signal and label information.
 
         ??The arguments are directly stuffed into the *ChipPin* object (i.e. *self*).
         In addition, to make sorting lists easier, sort keys named *position_key* and *name_key*
@@ -111,6 +679,8 @@ class ChipPin:
         # Verify argument types:
         assert isinstance(line, str)
         # print("line={0}".format(line))
+        if diagnostics is None:
+            diagnostics = immediate_diagnostics
 
         # Split *line* into *fields* and break them out into *position*, *name*, *kind*, etc.:
         fields: List[str] = line.replace('"', "").split(',')
@@ -132,15 +702,8 @@ class ChipPin:
         trimmed_name: str = name if trim_index < 0 else name[:trim_index]
 
         # Create *position_key* from *position* and stuff into *chip_pin*:
-        position_key: Tuple[Any, ...]
-        if position[0].isalpha():
-            # We have1 a ball grid pin:
-            assert position[1:].isdigit()
-            position_key = (position[0], int(position[1:]))
-        else:
-            # We have a more standard numerical pin:
-            assert position.isdigit()
-            position_key = tuple(position)
+        position_key: int = position_key_compute(position)
+        vendor_name: str = name
 
         # if trimmed_name in ("PA7", "PA15", "PA14"):
         #     print("name='{0}' trimmed_name='{1}' position='{2}'".
@@ -165,7 +728,8 @@ class ChipPin:
             else:
                 unit = "?"
                 unit_sort = tuple("")
-                print("Unknown I/O name '{0}' (trimmed_name = '{1}')".format(name, trimmed_name))
+                diagnostics.warning("unknown-io-name", f"Unknown I/O name '{name}' "
+                                    f"(trimmed_name = '{trimmed_name}')", position)
 
             # Set *style* to be either a regular line or an inverted line:
             style = "line"
@@ -196,7 +760,8 @@ class ChipPin:
                 elif label.startswith("USB_OverCurrent"):
                     tag = "USB_OVER_CURRENT"
                 elif '[' in label:
-                    print("Unhandled Input label '{0}'".format(label))
+                    diagnostics.warning("unhandled-input-label",
+                                        f"Unhandled Input label '{label}'", position)
                     tag = label
                 else:
                     tag = label
@@ -212,7 +777,8 @@ class ChipPin:
                         bracket_index = label.find('[')
                         tag = "NUCELO_{0}_LED".format(label[bracket_index+1:-1].upper())
                     else:
-                        print("Unhandled Output label '{0}'".format(label))
+                        diagnostics.warning("unhandled-output-label",
+                                            f"Unhandled Output label '{label}'", position)
                         tag = label
                 else:
                     # print("signal[-7:-2]='{0}'".format(signal[-7:-2]))
@@ -225,13 +791,15 @@ class ChipPin:
                 if signal.endswith("_SDA") or signal.endswith("_SCL"):
                     kicad_type = "bidirectional"
                 else:
-                    print("Unrecognized I2C signal: '{0}'".format(signal))
+                    diagnostics.warning("unrecognized-signal",
+                                        f"Unrecognized I2C signal: '{signal}'", position)
                 name += f"({label})"
             elif signal.startswith("LPTIM"):
                 if signal.endswith("_IN1") or signal.endswith("_IN2"):
                     kicad_type = "input"
                 else:
-                    print("Unrecognized I2C signals: '{0}'".format(signal))
+                    diagnostics.warning("unrecognized-signal",
+                                        f"Unrecognized LPTIM signal: '{signal}'", position)
                 name += f"({label})"
             elif signal.startswith("RCC_"):
                 if signal.endswith("_IN"):
@@ -239,7 +807,8 @@ class ChipPin:
                 elif signal.endswith("_OUT"):
                     kicad_type = "output"
                 else:
-                    print("Unrecognized RCC signal: '{0}'".format(signal))
+                    diagnostics.warning("unrecognized-signal",
+                                        f"Unrecognized RCC signal: '{signal}'", position)
                 name += "({0})*".format(signal[4:])
                 asterisk_appended = True
             elif signal.startswith("SPI"):
@@ -255,7 +824,8 @@ class ChipPin:
                 elif signal.endswith("_SCK"):
                     kicad_type = "output"
                 else:
-                    print("Unrecognized SPI signal: '{0}'".format(signal))
+                    diagnostics.warning("unrecognized-signal",
+                                        f"Unrecognized SPI signal: '{signal}'", position)
                 name += f"({label})"
             elif signal.startswith("SYS_"):
                 kicad_type = "bidirectional"
@@ -272,7 +842,8 @@ class ChipPin:
                 elif signal.endswith("_TX"):
                     kicad_type = "output"
                 else:
-                    print("Unrecognized UART/USART signal: '{0}'".format(signal))
+                    diagnostics.warning("unrecognized-signal",
+                                        f"Unrecognized UART/USART signal: '{signal}'", position)
                     kicad_type = "bidirectional"
                 name += "({0})".format(signal)
             elif signal.startswith("USB_"):
@@ -281,45 +852,48 @@ class ChipPin:
                     name += "(USB_OTG_{0})*".format(signal[12:])
                     asterisk_appended = True
                 else:
-                    print("Unhandled USB signal '{0}'".format(signal))
+                    diagnostics.warning("unhandled-usb-signal",
+                                        f"Unhandled USB signal '{signal}'", position)
                     name += "({0})*".format(signal[4:])
                     asterisk_appended = True
             else:
-                print("Unhandled I/O signal'{0}' for '{1}'".format(signal, name))
+                diagnostics.warning("unhandled-io-signal",
+                                    f"Unhandled I/O signal '{signal}' for '{name}'", position)
         elif kind == "Power":
             unit = "ZPWR"
             style = "line"
             if name in ("VSS", "VSSA", "GND", "AGND"):
-                unit_sort = tuple('G') + position_key
+                unit_sort = ('G', position_key)
                 kicad_type = "power_in"
                 name += "(PI)"
             elif name in ("VDD", "AVDD", "VBAT", "VIN", "VREF+", "VDDA", "VCAP_1", "VCAP_2",
                           "VDDUSB", "VDDSDMMC", "E5V"):
-                unit_sort = tuple('V') + position_key
+                unit_sort = ('V', position_key)
                 kicad_type = "power_in"
                 name += "(PI)"
                 side = "left"
             elif name in ("+5V", "+3.3V", "U5V", "IOREF"):
-                unit_sort = tuple('V') + position_key
+                unit_sort = ('V', position_key)
                 side = "left"
                 kicad_type = "power_out"
                 name += "(PO)"
             else:
-                unit_sort = tuple('?') + position_key
-                print("Unrecognized Power '{0}'".format(name))
+                unit_sort = ('?', position_key)
+                diagnostics.warning("unrecognized-power", f"Unrecognized Power '{name}'",
+                                    position)
         elif kind in ("Reset", "Boot"):
             unit = "YMISC"
             kicad_type = "input"
             style = "line"
-            unit_sort = tuple('?') + position_key
+            unit_sort = ('?', position_key)
         elif kind in ("NC",):
             unit = "YMISC"
             kicad_type = "no_connect"
-            unit_sort = tuple('?') + position_key
+            unit_sort = ('?', position_key)
         else:
             unit = "~"
             unit_sort = tuple("?")
-            print("Unrecognized kind='{0}'".format(kind))
+            diagnostics.warning("unrecognized-kind", f"Unrecognized kind='{kind}'", position)
         if '[' in label and not asterisk_appended:
             name += "*"
 
@@ -331,6 +905,7 @@ class ChipPin:
         # chip_pin: ChipPin = self
         self.position: str = position
         self.name: str = name
+        self.vendor_name: str = vendor_name
         self.kind: str = kind
         self.trimmed_name: str = trimmed_name
         self.signal: str = signal
@@ -340,7 +915,7 @@ class ChipPin:
         self.kicad_type: str = kicad_type
         self.style: str = style
         self.side: str = side
-        self.position_key: Tuple[Any, ...] = position_key
+        self.position_key: int = position_key
 
     def __format__(self, format: str) -> str:
         """Convert the ChipPin object to a string."""
@@ -352,10 +927,104 @@ class ChipPin:
         label: str = chip_pin.label
         return "{0:4} {1:25} {2:15} {3:20} {4}".format(position, name, kind, signal, label)
 
-    def position_set(self, position: str) -> None:
-        """Set the ChipPin position."""
-        chip_pin: ChipPin = self
-        chip_pin.position = position
+    # ChipPin.__setattr__():
+    def __setattr__(self, attribute_name: str, value: Any) -> None:
+        """Allow each ChipPin attribute to be set only once.
+
+        *ChipPin*'s are shared between all of the *FootprintBinding*'s of a *KiCube*
+        (possibly from multiple threads), so they must not be modified after initialization.
+        """
+        if hasattr(self, attribute_name):
+            raise AttributeError(f"ChipPin.{attribute_name} is read-only")
+        super().__setattr__(attribute_name, value)
+
+
+# ChipPinIndex:
+class ChipPinIndex:
+    """Represents a set of lookup tables over a list of ChipPin's."""
+
+    # ChipPinIndex.__init__():
+    def __init__(self, chip_pins: List[ChipPin], lazy: bool = False) -> None:
+        """Initialize a ChipPinIndex.
+
+        The arguments are:
+        * *chip_pins* (List[ChipPin]): The ChipPin's to index.
+        * *lazy* (bool): If *True*, the tables are only built when first used (e.g. for pins
+          reloaded from a snapshot, which are usually never looked up.)
+        The *chip_pins* are indexed by *position*, *vendor_name*, *trimmed_name*, and *signal*.
+        Since power pins (e.g. 'VSS', 'VDD') occur many times, all but the *position* table
+        map to a list of *ChipPin*'s in the same order as *chip_pins*.  Unused pins
+        (i.e. an empty *signal*) are not entered into the *signal* table.
+        """
+        # chip_pin_index: ChipPinIndex = self
+        self.chip_pins: List[ChipPin] = chip_pins
+        if not lazy:
+            self.tables_build()
+
+    # ChipPinIndex.__getattr__():
+    def __getattr__(self, attribute_name: str) -> Any:
+        """Build the tables of a lazy ChipPinIndex when one of them is first used."""
+        chip_pin_index: ChipPinIndex = self
+        if attribute_name not in ("positions_table", "names_table", "trimmed_names_table",
+                                  "signals_table"):
+            raise AttributeError(f"'ChipPinIndex' object has no attribute '{attribute_name}'")
+        chip_pin_index.tables_build()
+        return chip_pin_index.__dict__[attribute_name]
+
+    # ChipPinIndex.tables_build():
+    def tables_build(self) -> None:
+        """Build the lookup tables of a ChipPinIndex."""
+        chip_pin_index: ChipPinIndex = self
+        chip_pins: List[ChipPin] = chip_pin_index.chip_pins
+        positions_table: Dict[str, ChipPin] = {}
+        names_table: Dict[str, List[ChipPin]] = {}
+        trimmed_names_table: Dict[str, List[ChipPin]] = {}
+        signals_table: Dict[str, List[ChipPin]] = {}
+        chip_pin: ChipPin
+        for chip_pin in chip_pins:
+            position: str = chip_pin.position
+            assert position not in positions_table, f"Duplicate pin position '{position}'"
+            positions_table[position] = chip_pin
+            names_table.setdefault(chip_pin.vendor_name, []).append(chip_pin)
+            trimmed_names_table.setdefault(chip_pin.trimmed_name, []).append(chip_pin)
+            if chip_pin.signal != "":
+                signals_table.setdefault(chip_pin.signal, []).append(chip_pin)
+
+        # Stuff the tables into *chip_pin_index* (i.e. *self*):
+        self.positions_table: Dict[str, ChipPin] = positions_table
+        self.names_table: Dict[str, List[ChipPin]] = names_table
+        self.trimmed_names_table: Dict[str, List[ChipPin]] = trimmed_names_table
+        self.signals_table: Dict[str, List[ChipPin]] = signals_table
+
+    # ChipPinIndex.position_lookup():
+    def position_lookup(self, position: str) -> Optional[ChipPin]:
+        """Return the ChipPin at a physical position (e.g. '29', 'B12') or None."""
+        chip_pin_index: ChipPinIndex = self
+        return chip_pin_index.positions_table.get(position)
+
+    # ChipPinIndex.name_lookup():
+    def name_lookup(self, vendor_name: str) -> List[ChipPin]:
+        """Return the ChipPin's with a vendor name (e.g. 'PH0-OSC_IN', 'VSS')."""
+        chip_pin_index: ChipPinIndex = self
+        return chip_pin_index.names_table.get(vendor_name, [])
+
+    # ChipPinIndex.trimmed_name_lookup():
+    def trimmed_name_lookup(self, trimmed_name: str) -> List[ChipPin]:
+        """Return the ChipPin's with a trimmed name (e.g. 'PH0', 'VSS')."""
+        chip_pin_index: ChipPinIndex = self
+        return chip_pin_index.trimmed_names_table.get(trimmed_name, [])
+
+    # ChipPinIndex.signal_lookup():
+    def signal_lookup(self, signal: str) -> List[ChipPin]:
+        """Return the ChipPin's bound to an internal signal (e.g. 'SPI1_SCK')."""
+        chip_pin_index: ChipPinIndex = self
+        return chip_pin_index.signals_table.get(signal, [])
+
+    # ChipPinIndex.position_sorted():
+    def position_sorted(self) -> List[ChipPin]:
+        """Return the ChipPin's sorted in natural position order."""
+        chip_pin_index: ChipPinIndex = self
+        return sorted(chip_pin_index.chip_pins, key=lambda chip_pin: chip_pin.position_key)
 
 
 # IOC:
@@ -363,29 +1032,37 @@ class IOC:
     """Represents an STM32CubeMX .ioc file."""
 
     # IOC.__init__():
-    def __init__(self, ioc_file_name: str, tracing: Text = "") -> None:
-        """Read in and process an ioc file."""
+    def __init__(self, ioc_file_name: str, tracing: Text = "",
+                 ioc_text: Optional[str] = None, timestamp: Optional[float] = None) -> None:
+        """Read in and process an ioc file.
+
+        If *ioc_text* is provided, it is used instead of reading *ioc_file_name*, and
+        *timestamp* is used instead of the *ioc_file_name* modification time.
+        """
         if tracing:
             print(f"{tracing}=>IOC.__init__({ioc_file_name})")
         assert ioc_file_name.endswith(".ioc")
         base_name: str = ioc_file_name[:-4]
-        timestamp: float = os.path.getmtime(ioc_file_name)
+        if ioc_text is None:
+            ioc_file: Any[IO]
+            with open(ioc_file_name, "r") as ioc_file:
+                ioc_text = ioc_file.read()
+        if timestamp is None:
+            timestamp = os.path.getmtime(ioc_file_name)
         mcu_name: str = ""
         board_name: str = ""
         package: str = ""
-        ioc_file: Any[IO]
-        with open(ioc_file_name, "r") as ioc_file:
-            lines: List[str] = ioc_file.read().split('\n')
-            line: str
-            for line in lines:
-                if line.startswith("Mcu.Name="):
-                    mcu_name = line[9:]
-                    if mcu_name.endswith('x'):
-                        mcu_name = mcu_name[:-1]
-                elif line.startswith("board="):
-                    board_name = line[6:]
-                elif line.startswith("Mcu.Package="):
-                    package = line[12:]
+        lines: List[str] = ioc_text.split('\n')
+        line: str
+        for line in lines:
+            if line.startswith("Mcu.Name="):
+                mcu_name = line[9:]
+                if mcu_name.endswith('x'):
+                    mcu_name = mcu_name[:-1]
+            elif line.startswith("board="):
+                board_name = line[6:]
+            elif line.startswith("Mcu.Package="):
+                package = line[12:]
 
         # Load values into *ioc*:
         # ioc: IOC = self
@@ -406,12 +1083,22 @@ class KiCube:
 
     # Kicube.__init__():
     def __init__(self, ioc_file_name: str, stm32cube_csv_file_name: str,
-                 mcu_name: str, board_name: str, package: str, tracing: Text = "") -> None:
-        """Initialize a KiCube object."""
+                 mcu_name: str, board_name: str, package: str, tracing: Text = "",
+                 diagnostics: Optional[Diagnostics] = None, csv_text: Optional[str] = None,
+                 timestamp: Optional[float] = None) -> None:
+        """Initialize a KiCube object.
+
+        Classification problems are collected in *diagnostics*, which defaults to a new
+        *Diagnostics* object for the project.  It is available as *KiCube.diagnostics*.
+        If *csv_text* is provided, it is used instead of reading *stm32cube_csv_file_name*,
+        and *timestamp* is used instead of the file modification time.
+        """
         if tracing:
             print(f"{tracing}=>Kicube.__init('{ioc_file_name}', '{stm32cube_csv_file_name}'"
                   f"'{mcu_name}', '{board_name}', '{package}')")
         kicube: KiCube = self
+        if diagnostics is None:
+            diagnostics = Diagnostics(os.path.basename(ioc_file_name)[:-4])
         cpu_name: str = ""
         footprint: str = ""
         nucleo_bindings: List[Tuple[int, str]] = []
@@ -422,10 +1109,10 @@ class KiCube:
             nucleo144_bindings: List[Tuple[int, str]] = kicube.nucleo144_bindings_generate(cpu_name)
             nucleo64_bindings: List[Tuple[int, str]]
             nucleo64_bindings = kicube.nucleo64_bindings_generate(cpu_name, ["PC0", "PC1"])
-            if isinstance(nucleo144_bindings, list):
+            if len(nucleo144_bindings) > 0:
                 footprint = "NUCLEO144"
                 nucleo_bindings = nucleo144_bindings
-            elif isinstance(nucleo64_bindings, list):
+            elif len(nucleo64_bindings) > 0:
                 footprint = "NUCLEO64"
                 nucleo_bindings = nucleo64_bindings
             else:
@@ -441,20 +1128,24 @@ class KiCube:
         # Read in *stm32cube_csv_file_name*, break it into *lines* and extract the interesting
         # lines into *all__pins*:
         chip_pins: List[ChipPin] = []
-        if not os.path.isfile(stm32cube_csv_file_name):
-            print(f"File '{stm32cube_csv_file_name}' does not exist!!!")
-            sys.exit(1)
-        csv_file: Any[IO]
-        with open(stm32cube_csv_file_name, "r") as csv_file:
-            lines: List[str] = csv_file.read().splitlines()
-            index: int
-            line: str
-            for index, line in enumerate(lines[1:]):
-                chip_pin: ChipPin = ChipPin(line, tracing=tracing)
-                if tracing:
-                    print(f"{tracing}{chip_pin}")
-                chip_pins.append(chip_pin)
-                # print("{0}".format(chip_pin))
+        if csv_text is None:
+            if not os.path.isfile(stm32cube_csv_file_name):
+                print(f"File '{stm32cube_csv_file_name}' does not exist!!!")
+                sys.exit(1)
+            csv_file: Any[IO]
+            with open(stm32cube_csv_file_name, "r") as csv_file:
+                csv_text = csv_file.read()
+        if timestamp is None:
+            timestamp = os.path.getmtime(stm32cube_csv_file_name)
+        lines: List[str] = csv_text.splitlines()
+        index: int
+        line: str
+        for index, line in enumerate(lines[1:]):
+            chip_pin: ChipPin = ChipPin(line, tracing=tracing, diagnostics=diagnostics)
+            if tracing:
+                print(f"{tracing}{chip_pin}")
+            chip_pins.append(chip_pin)
+            # print("{0}".format(chip_pin))
         if tracing:
             print(f"{tracing}{len(chip_pins)} ChipPin's read from '{stm32cube_csv_file_name}'")
 
@@ -462,290 +1153,173 @@ class KiCube:
         # kicube: KiCub = self
         self.board_name: str = board_name
         self.ioc_file_name: str = ioc_file_name
+        self.mcu_name: str = mcu_name
+        self.package: str = package
         self.stm32cube_csv_file_name: str = stm32cube_csv_file_name
         self.chip_pins: List[ChipPin] = chip_pins
+        self.chip_pin_index: ChipPinIndex = ChipPinIndex(chip_pins)
         self.cpu_name: str = cpu_name
+        self.diagnostics: Diagnostics = diagnostics
         self.footprint: str = footprint
         self.nucleo_bindings: List[Tuple[int, str]] = nucleo_bindings
-        self.timestamp: float = os.path.getmtime(stm32cube_csv_file_name)
+        self.timestamp: float = timestamp
         # print("len(kicube.nucleo_bindings)={0}".format(len(kicube.nucleo_bindings)))
         if tracing:
             print(f"{tracing}<=Kicube.__init('{ioc_file_name}', '{stm32cube_csv_file_name}'"
                   f"'{mcu_name}', '{board_name}', '{package}')")
 
-    # KiCube.kipart_genarate():
-    def kipart_generate(self, kipart_csv_file_name: str, tracing: Text = "") -> None:
-        """Generate a KiPart .csv file."""
+    # KiCube.binding_generate():
+    def binding_generate(self, footprint: str = "",
+                         tracing: Text = "") -> Optional["FootprintBinding"]:
+        """Return a FootprintBinding for a footprint.
+
+        The arguments are:
+        * *footprint* (str): One of "NUCLEO144", "NUCLEO64" or the chip package name
+          (e.g. "LQFP144".)  An empty string selects the *KiCube* default footprint.
+        None is returned if *footprint* is not supported for the *KiCube* processor.
+        The *KiCube* and its *ChipPin*'s are not modified, so multiple bindings can be
+        generated from one *KiCube* (even from multiple threads, since problems are reported
+        to the thread safe *Diagnostics*.)
+        """
         if tracing:
-            print(f"{tracing}=>KiCube.kipart_generate(*, '{kipart_csv_file_name})'")
-        # Grab some values from *kicube* (i.e. *self*):
+            print(f"{tracing}=>KiCube.binding_generate(*, '{footprint}')")
         kicube: KiCube = self
+        if footprint == "":
+            footprint = kicube.footprint
+        footprint = footprint.upper()
+        chip_pin_index: ChipPinIndex = kicube.chip_pin_index
+        diagnostics: Diagnostics = kicube.diagnostics
+        cpu_name: str = kicube.cpu_name
         board_name: str = kicube.board_name.upper()
-        chip_pins: List[ChipPin] = kicube.chip_pins
-        nucleo_bindings: List[Tuple[int, str]] = kicube.nucleo_bindings
+        base_name: str = os.path.basename(kicube.ioc_file_name)[:-4].upper()
 
-        # Sweep through *chip_pins* and build up a table based on
-        chip_pins_table: Dict[str, ChipPin] = {}
+        footprint_binding: Optional[FootprintBinding] = None
+        bindings: List[Tuple[str, ChipPin]] = []
         chip_pin: ChipPin
-        for chip_pin in chip_pins:
-            chip_pins_table[chip_pin.trimmed_name] = chip_pin
-
-        nucleo_chip_pins: List[ChipPin] = list()
-        nucleo_position: int
-        name: str
-        for nucleo_position, name in nucleo_bindings:
-            if name in ("GND", "AGND", "E5V", "U5V", "+3.3V", "+5V", "AVDD", "VIN", "IOREF"):
-                # Power/Ground pin
-                chip_pin = ChipPin('"{0}","{1}","Power","",""'.format(nucleo_position, name))
-            elif name in ("RESET"):
-                chip_pin = ChipPin('"{0}","{1}","Reset","",""'.format(nucleo_position, name))
-            elif name.startswith("NC"):
-                chip_pin = ChipPin('"{0}","{1}","NC","",""'.format(nucleo_position, name))
-            elif name in chip_pins_table:
-                chip_pin = chip_pins_table[name]
-                chip_pin.position_set(str(nucleo_position))
-            else:
-                print("Need to deal with nucleo_pin: '{0}'".format(name))
-            nucleo_chip_pins.append(chip_pin)
-        if tracing:
-            print(f"{tracing}{len(nucleo_chip_pins)} nucleo_chip_pins")
-
-        # Sort *nucleo_chip_pins* using the group key:
-        nucleo_chip_pins.sort(key=lambda chip_pin: (chip_pin.unit, chip_pin.unit_sort))
-        ioc_file_name: str = kicube.ioc_file_name
-        base_name: str = ioc_file_name[:-4].upper()
-        foot_print: str = kicube.footprint.upper()
-
-        # Construct the file as a list of *lines*.
-        lines: List[str] = []
-        line_format: str = '"{0}", "{1}", "{2}", "{3}", "{4}", "{5}"\n'
+        if footprint in ("NUCLEO144", "NUCLEO64"):
+            nucleo_bindings: List[Tuple[int, str]] = (
+                kicube.nucleo144_bindings_generate(cpu_name) if footprint == "NUCLEO144" else
+                kicube.nucleo64_bindings_generate(cpu_name, ["PC0", "PC1"]))
+            nucleo_position: int
+            name: str
+            for nucleo_position, name in nucleo_bindings:
+                kind: str = ""
+                if name in ("GND", "AGND", "E5V", "U5V", "+3.3V", "+5V", "AVDD", "VIN", "IOREF"):
+                    # Power/Ground pin
+                    kind = "Power"
+                elif name in ("RESET"):
+                    kind = "Reset"
+                elif name.startswith("NC"):
+                    kind = "NC"
+                elif chip_pin_index.trimmed_name_lookup(name):
+                    # Several chip pins can share a trimmed name; the last one wins:
+                    chip_pin = chip_pin_index.trimmed_name_lookup(name)[-1]
+                else:
+                    # Bind the connector pin as a no connect rather than dropping it:
+                    diagnostics.warning("unbound-nucleo-pin",
+                                        f"Nucleo pin '{name}' is not bound to a chip pin",
+                                        str(nucleo_position))
+                    kind = "NC"
+                if kind != "":
+                    chip_pin = ChipPin(f'"{nucleo_position}","{name}","{kind}","",""',
+                                       diagnostics=diagnostics)
+                bindings.append((str(nucleo_position), chip_pin))
+
+            if len(bindings) > 0:
+                if board_name == "":
+                    board_name = f"NUCLEO-{cpu_name}"
+                connectors: str
+                data_sheet_url: str
+                if footprint == "NUCLEO144":
+                    connectors = "2xF2x35"
+                    data_sheet_url = ("https://www.st.com/resource/en/user_manual/" +
+                                      "dm00244518-stm32-nucleo144-boards-stmicroelectronics.pdf")
+                else:
+                    # The Nucleo-64 names follow the Nucleo-144 convention above: its two ST
+                    # morpho connectors (CN7/CN10) are 2x19 female headers.  No matching
+                    # `HR2:*_2xF2x19` footprint is assumed to exist in the footprint library:
+                    connectors = "2xF2x19"
+                    data_sheet_url = ("https://www.st.com/resource/en/user_manual/" +
+                                      "dm00105823-stm32-nucleo64-boards-mb1136-" +
+                                      "stmicroelectronics.pdf")
+                nucleo_name: str = "Nucleo144" if footprint == "NUCLEO144" else "Nucleo64"
+                footprint_binding = FootprintBinding(
+                    footprint, bindings,
+                    f"{board_name};{connectors}", "CN",
+                    f"HR2:{board_name.replace('-', '_')}_{connectors}", data_sheet_url,
+                    f"{footprint}-{base_name}",
+                    f"{footprint}-{base_name};{nucleo_name} STM32{base_name}")
+        elif footprint == kicube.package.upper():
+            # Bare chip package.  The symbol and footprint names are formed by analogy with the
+            # Nucleo ones; `HR2:{footprint}` is a placeholder for the package footprint:
+            for chip_pin in chip_pin_index.chip_pins:
+                bindings.append((chip_pin.position, chip_pin))
+            mcu_name: str = kicube.mcu_name
+            footprint_binding = FootprintBinding(
+                footprint, bindings,
+                f"{mcu_name}_{footprint}", "U", f"HR2:{footprint}", "",
+                f"{footprint}-{base_name}",
+                f"{mcu_name}-{base_name};{mcu_name} in {footprint} package")
 
-        # Output the first line which is a comma separated list of values:
-        #     SYMBOL_NAME,REF_PREFIX,FOOTPRINT,DATA_SHEET_URL,SHORT_DESCRIPTION;LONG_DESCRIPTION
         if tracing:
-            print(f"{tracing}Generate kipart header line")
-        symbol_name: str = f"{board_name};2xF2x35"
-        data_sheet_url: str = ("https://www.st.com/resource/en/user_manual/" +
-                               "dm00244518-stm32-nucleo144-boards-stmicroelectronics.pdf")
-        manufacturer_number: str = f"{foot_print}-{base_name}"
-        footprint: str = f"HR2:{board_name.replace('-', '_')}_2xF2x35"
-        description: str = f"NUCLEO144-{base_name};Nucleo144 STM32{base_name}"
-        if tracing:
-            print(f"{tracing}Generate headings line")
-        lines.append(line_format.format(
-            symbol_name, "CN", footprint, data_sheet_url, manufacturer_number, description))
-        lines.append(line_format.format("Pin", "Unit", "Type", "Name", "Style", "Side"))
+            binding_size: int = 0 if footprint_binding is None else len(bindings)
+            print(f"{tracing}<=KiCube.binding_generate(*, '{footprint}')=>{binding_size} pins")
+        return footprint_binding
 
-        for nucleo_chip_pin in nucleo_chip_pins:
-            position = nucleo_chip_pin.position
-            unit: str = nucleo_chip_pin.unit
-            kicad_type: str = nucleo_chip_pin.kicad_type
-            name = nucleo_chip_pin.name
-            style: str = nucleo_chip_pin.style
-            side: str = nucleo_chip_pin.side
-            line: str = line_format.format(position, unit, kicad_type, name, style, side)
-            lines.append(line)
-
-        # Terminate the file with ",,,,,," and a blank line:
-        lines.append(",,,,,,\n")
-        lines.append("\n")
+    # KiCube.kipart_genarate():
+    def kipart_generate(self, kipart_csv_file_name: str, footprint: str = "",
+                        tracing: Text = "") -> Optional["FootprintBinding"]:
+        """Generate a KiPart .csv file.
 
-        kipart_csv_file: IO[Any]
-        with open(kipart_csv_file_name, "w") as kipart_csv_file:
-            kipart_csv_file.writelines(lines)
+        The arguments are:
+        * *kipart_csv_file_name* (str): The kipart `.csv` file to write.
+        * *footprint* (str): The footprint to generate for (see *KiCube.binding_generate*().)
+        The *FootprintBinding* that was written is returned, or None if *footprint*
+        is not supported.
+        """
         if tracing:
-            print(f"{tracing}<=KiCube.kipart_generate(*, '{kipart_csv_file_name})'")
-
-        # print("calling kipart...")
-        # lib_file_name: str = "{0}_{1}.lib".format(kicube.base_name.upper(),
-        #                                           kicube.footprint.upper())
-        # subprocess.call(
-        #   ("kipart", kipart_csv_file_name, "--overwrite", "-o", lib_file_name))
-        # print("kipart called...")
-
-        # Read *lib_file_name* in:
-        # schematic_library: SchematicLibrary = SchematicLibrary(lib_file_name)
-        # cpu_symbol = schematic_library.lookup(kicad_part_name)
-        # cpu_symbol.fixup()
-        # output_library.insert(cpu_symbol)
+            print(f"{tracing}=>KiCube.kipart_generate(*, '{kipart_csv_file_name}', '{footprint}')")
+        kicube: KiCube = self
+        next_tracing: Text = tracing + " " if tracing else ""
+        footprint_binding: Optional[FootprintBinding]
+        footprint_binding = kicube.binding_generate(footprint, tracing=next_tracing)
+        if footprint_binding is None:
+            kicube.diagnostics.error("unsupported-footprint",
+                                     f"Footprint '{footprint}' is not supported")
+        else:
+            footprint_binding.kipart_write(kipart_csv_file_name)
+        if tracing:
+            print(f"{tracing}<=KiCube.kipart_generate(*, '{kipart_csv_file_name}', '{footprint}')")
+        return footprint_binding
 
     # KiCube.nucleo144_bindings_generate():
-    def nucleo144_bindings_generate(self, processor: str) -> List[Tuple[int, str]]:
+    @staticmethod
+    def nucleo144_bindings_generate(processor: str) -> List[Tuple[int, str]]:
         """Return list of Nucleo-144 pin bindings."""
-        nucleo144_mcus: List[str] = [
-          "F207ZG",
-          "F303ZE",        # FIXME: This one may be slightly different!!!
-          "F412ZG",
-          "F413ZG",
-          "F429ZI",
-          "F746ZG",
-          "F767ZI",
-          "H743ZI",
-        ]
-
         nucleo144_bindings: List[Tuple[int, str]] = []
-        if processor in nucleo144_mcus:
-            nucleo144_bindings = [
-              (1101, "PC10"),  (1102, "PC11"),  (1201, "PC9"),  (1202, "PC8"),
-              (1103, "PC12"),  (1104, "PD2"),   (1203, "PB8"),  (1204, "PC6"),
-              (1105, "VDD"),   (1106, "E5V"),   (1205, "PB9"),  (1206, "PC5"),
-              (1107, "BOOT0"), (1108, "GND"),   (1207, "AVDD"), (1208, "U5V"),
-              (1109, "PF6"),   (1110, "NC1"),   (1209, "GND"),  (1210, "PD8"),
-              (1111, "PF7"),   (1112, "IOREF"), (1211, "PA5"),  (1212, "PA12"),
-              (1113, "PA13"),  (1114, "RESET"), (1213, "PA6"),  (1214, "PA11"),
-              (1115, "PA14"),  (1116, "+3.3V"), (1215, "PA7"),  (1216, "PB12"),
-              (1117, "PA15"),  (1118, "+5V"),   (1217, "PB6"),  (1218, "PB11"),
-              (1119, "GND"),   (1120, "GND"),   (1219, "PC7"),  (1220, "GND"),
-              (1121, "PB7"),   (1122, "GND"),   (1221, "PA9"),  (1222, "PB2"),
-              (1123, "PC13"),  (1124, "VIN"),   (1223, "PA8"),  (1224, "PB1"),
-              (1125, "PC14"),  (1126, "NC2"),   (1225, "PB10"), (1226, "PB15"),
-              (1127, "PC15"),  (1128, "PA0"),   (1227, "PB4"),  (1228, "PB14"),
-              (1129, "PH0"),   (1130, "PA1"),   (1229, "PB5"),  (1230, "PB13"),
-              (1131, "PH1"),   (1132, "PA4"),   (1231, "PB3"),  (1232, "AGND"),
-              (1133, "VBAT"),  (1134, "PB0"),   (1233, "PA10"), (1234, "PC4"),
-              (1135, "PC2"),   (1136, "PC1"),   (1235, "PA2"),  (1236, "PF5"),
-              (1137, "PC3"),   (1138, "PC0"),   (1237, "PA3"),  (1238, "PF4"),
-              (1139, "PD4"),   (1140, "PD3"),   (1239, "GND"),  (1240, "PE8"),
-              (1141, "PD5"),   (1142, "PG2"),   (1241, "PD13"), (1242, "PF10"),
-              (1143, "PD6"),   (1144, "PG3"),   (1243, "PD12"), (1244, "PE7"),
-              (1145, "PD7"),   (1146, "PE2"),   (1245, "PD11"), (1246, "PD14"),
-              (1147, "PE3"),   (1148, "PE4"),   (1247, "PE10"), (1248, "PD15"),
-              (1149, "GND"),   (1150, "PE5"),   (1249, "PE12"), (1250, "PF14"),
-              (1151, "PF1"),   (1152, "PF2"),   (1251, "PE14"), (1252, "PE9"),
-              (1153, "PF0"),   (1154, "PF8"),   (1253, "PE15"), (1254, "GND"),
-              (1155, "PD1"),   (1156, "PF9"),   (1255, "PE13"), (1256, "PE11"),
-              (1157, "PD0"),   (1158, "PG1"),   (1257, "PF13"), (1258, "PF3"),
-              (1159, "PG0"),   (1160, "GND"),   (1259, "PF12"), (1260, "PF15"),
-              (1161, "PE1"),   (1162, "PE6"),   (1261, "PG14"), (1262, "PF11"),
-              (1163, "PG9"),   (1164, "PG15"),  (1263, "GND"),  (1264, "PE0"),
-              (1165, "PG12"),  (1166, "PG10"),  (1265, "PD10"), (1266, "PG8"),
-              (1167, "NC3"),   (1168, "PG13"),  (1267, "PG7"),  (1268, "PG5"),
-              (1169, "PD9"),   (1170, "PG11"),  (1269, "PG4"),  (1270, "PG6")]
-
-            # Sort the *nucleo144_bindings*:
-            key: str
-            nucleo144_bindings.sort(key=lambda binding: binding[0])
-
+        if processor in NUCLEO144_MCUS:
+            nucleo144_bindings = sorted(NUCLEO144_BINDINGS, key=lambda binding: binding[0])
         return nucleo144_bindings
 
     # KiCube.nucleo64_bindings_generate():
-    def nucleo64_bindings_generate(self, processor: str, pin_selects) -> List[Tuple[int, str]]:
+    @staticmethod
+    def nucleo64_bindings_generate(processor: str, pin_selects) -> List[Tuple[int, str]]:
         """Return the Nucleo64 pin bindings for a proceesor."""
         assert isinstance(processor, str)
         assert isinstance(pin_selects, list)
         # print("KiCube.nucleo64_bindings_generate(*, '{0}", "{1}')".format(processor, pin_selects))
-
-        cpu_mapping = {
-          "F030R8": "F030R8",
-          "F070RB": "F070RB",
-          "F334R8": "F334R8",
-          "F303RE": "F334R8",
-          "F091RC": "F334R8",
-          "F072RB": "F334R8",
-          "F103RB": "F103RB",
-          "F302RB": "F302RB",
-          "F401RE": "F446RE",
-          "F411RE": "F446RE",
-          "F446RE": "F446RE",
-          "L053R8": "L152RE",
-          "L073RZ": "L152RE",
-          "L152RE": "L152RE",
-          "L452RE": "L452RE",
-          "L476RG": "L476RG",
-          "F410RB": "L410RB"
-        }
+        cpu_mapping: Dict[str, str] = NUCLEO64_CPU_MAPPING
 
         nucleo64_bindings: List[Tuple[int, str]] = []
-        pin_bindings: List[Tuple[int, str, List[Tuple[str, ...]]]]
         if processor in cpu_mapping:
-            pin_bindings = [
-                (701, "PC10", []),
-                (703, "PC12", []),
-                (705, "VDD", []),
-                (707, "BOOT0", [("PH3:BT0", "L452RE")]),
-                (709, "NC1", [("PF6", "F030R8")]),
-                (711, "NC2", [("PF7", "F030R8")]),
-                (713, "PA13", []),
-                (715, "PA14", []),
-                (717, "PA15", []),
-                (719, "GND", []),
-                (721, "PB7", []),
-                (723, "PC13", []),
-                (725, "PC14", []),
-                (727, "PC15", []),
-                (729, "PF0", [("PD0", "F103RB"),
-                              ("PH0", "F446RE", "L152RE", "L452RE", "F476RG", "F410RB")]),
-                (731, "PF1", [("PD1", "F103RB"),
-                              ("PH1", "F446RE", "L152RE", "L452RE", "F476RG", "F410RB")]),
-                (733, "VBAT", [("VDD", "F070RB"), ("VLCD", "L152RE")]),
-                (735, "PC2", []),
-                (737, "PC3", []),
-                (702, "PC11", []),
-                (704, "PD2", []),
-                (706, "E5V", []),
-                (708, "GND", []),
-                (710, "NC3", []),
-                (712, "IOREF", []),
-                (714, "RESET", []),
-                (716, "+3.3V", []),
-                (718, "+5V", []),
-                (720, "GND", []),
-                (722, "GND", []),
-                (724, "VIN", []),
-                (726, "NC4", []),
-                (728, "PA0", []),
-                (730, "PA1", []),
-                (732, "PA4", []),
-                (734, "PB0", []),
-                (736, "PC1:PB9", []),
-                (738, "PC0:PB8", []),
-                (1001, "PC9", []),
-                (1003, "PB8", []),
-                (1005, "PB9", []),
-                (1007, "AVDD", []),
-                (1009, "GND", []),
-                (1011, "PA5", [("PB13", "F302R8")]),
-                (1013, "PA6", [("PB14", "F302R8")]),
-                (1015, "PA7", [("PB15", "F302R8")]),
-                (1017, "PB6", []),
-                (1019, "PC7", []),
-                (1021, "PA9", []),
-                (1023, "PA8", []),
-                (1025, "PB10", []),
-                (1027, "PB4", []),
-                (1029, "PB5", []),
-                (1031, "PB3", []),
-                (1033, "PA10", []),
-                (1035, "PA2", []),
-                (1037, "PA3", []),
-                (1002, "PC8", []),
-                (1004, "PC6", []),
-                (1006, "PC5", []),
-                (1008, "U5V", []),
-                (1010, "NC5", []),
-                (1012, "PA12", []),
-                (1014, "PA11", []),
-                (1016, "PB12", []),
-                (1018, "PB11", []),
-                (1020, "GND", []),
-                (1022, "PB2", []),
-                (1024, "PB1", []),
-                (1026, "PB15", [("PA7", "F302R8")]),
-                (1028, "PB14", [("PA6", "F302R8")]),
-                (1030, "PB13", [("PA5", "F302R8")]),
-                (1032, "AGND", []),
-                (1034, "PC4", []),
-                (1036, "NC6", [("PF5", "F030R8")]),
-                (1038, "NC7", [("PF4", "F030R8")]),
-            ]
 
             # mapped_processor: Dict[str, str] = cpu_mapping[processor]
-            pin_binding: Tuple[int, str, List[Tuple[str, ...]]]
-            for pin_binding in pin_bindings:
+            pin_binding: Tuple[int, str, Tuple[Tuple[str, ...], ...]]
+            for pin_binding in NUCLEO64_PIN_BINDINGS:
                 # print(pin_binding)
                 pin_number: int = pin_binding[0]
                 name: str = pin_binding[1]
-                alternate_pin_bindings: List[Tuple[str, ...]] = pin_binding[2]
+                alternate_pin_bindings: Tuple[Tuple[str, ...], ...] = pin_binding[2]
                 alternate_pin_binding: Tuple[str, ...]
                 for alternate_pin_binding in alternate_pin_bindings:
                     assert len(alternate_pin_binding) >= 2
@@ -786,172 +1360,136 @@ class KiCube:
         return nucleo64_bindings
 
 
-# SchematicLibaray:
-class SchematicLibrary:
-    """Represents a KiCad schematic symbol library."""
+# FootprintBinding:
+class FootprintBinding:
+    """Represents the binding of footprint positions to ChipPin's for one footprint."""
 
-    # SchematicLibrary.__init__():
-    def __init__(self, file_name: str) -> None:
-        """Initialize SchematicLibary object.
+    # FootprintBinding.__init__():
+    def __init__(self, footprint: str, bindings: List[Tuple[str, ChipPin]],
+                 symbol_name: str, reference_prefix: str, footprint_name: str,
+                 data_sheet_url: str, manufacturer_number: str, description: str) -> None:
+        """Initialize a FootprintBinding.
 
-        Args:
-            *library_file_name* (*str*):
-             The `.lib` file to open and read in.
+        The arguments are:
+        * *footprint* (str): The footprint (e.g. "NUCLEO144", "LQFP144", etc.)
+        * *bindings* (List[Tuple[str, ChipPin]]): The (position, chip_pin) bindings, where
+          position is the footprint position, which need not match the *ChipPin* position.
+        * The remaining arguments are the kipart header line values.
+        The *bindings* are sorted into kipart unit order.
+        """
+        bindings = sorted(bindings,
+                          key=lambda binding: (binding[1].unit, binding[1].unit_sort))
 
+        # Stuff everything into *footprint_binding* (i.e. *self*):
+        # footprint_binding: FootprintBinding = self
+        self.footprint: str = footprint
+        self.bindings: List[Tuple[str, ChipPin]] = bindings
+        self.symbol_name: str = symbol_name
+        self.reference_prefix: str = reference_prefix
+        self.footprint_name: str = footprint_name
+        self.data_sheet_url: str = data_sheet_url
+        self.manufacturer_number: str = manufacturer_number
+        self.description: str = description
+
+    # FootprintBinding.diff():
+    def diff(self, old_footprint_binding: "FootprintBinding") -> List[str]:
+        """Return the pin differences from an older FootprintBinding.
+
+        Each difference is one line of the form '+ POSITION: PIN' (added),
+        '- POSITION: PIN' (removed) or '~ POSITION: OLD_PIN => NEW_PIN' (changed), where
+        PIN is the kipart unit, type, name, style and side.  The lines are in natural
+        position order.  An empty list means that the bindings generate the same pins.
         """
-        # Verify argument types:
-        assert file_name.endswith(".lib")
-        # print("SchematicLibrary.__init__(*, '{0}')".format(file_name))
+        footprint_binding: FootprintBinding = self
+        old_table: Dict[str, str] = old_footprint_binding.pin_descriptions()
+        new_table: Dict[str, str] = footprint_binding.pin_descriptions()
+        positions: List[str] = sorted(set(old_table.keys()) | set(new_table.keys()),
+                                      key=position_key_compute)
+        differences: List[str] = []
+        position: str
+        for position in positions:
+            old_description: Optional[str] = old_table.get(position)
+            new_description: Optional[str] = new_table.get(position)
+            if old_description is None:
+                differences.append(f"+ {position}: {new_description}")
+            elif new_description is None:
+                differences.append(f"- {position}: {old_description}")
+            elif old_description != new_description:
+                differences.append(f"~ {position}: {old_description} => {new_description}")
+        return differences
+
+    # FootprintBinding.pin_descriptions():
+    def pin_descriptions(self) -> Dict[str, str]:
+        """Return a table mapping each footprint position to a kipart pin description."""
+        footprint_binding: FootprintBinding = self
+        pin_descriptions: Dict[str, str] = {}
+        position: str
+        chip_pin: ChipPin
+        for position, chip_pin in footprint_binding.bindings:
+            pin_descriptions[position] = (f"{chip_pin.unit} {chip_pin.kicad_type} "
+                                          f"{chip_pin.name} {chip_pin.style} {chip_pin.side}")
+        return pin_descriptions
 
-        # Start with an empty *symbols_table*:
-        # schematic_library SchematicLibrary = self
-        symbols_table: Dict[str, SchematicSymbol] = dict()
-        self.symbols_table = symbols_table
+    # FootprintBinding.kipart_lines():
+    def kipart_lines(self) -> List[str]:
+        """Return the kipart `.csv` file lines for a FootprintBinding."""
+        footprint_binding: FootprintBinding = self
 
-        # Open *schematic_library_file_name* and break it into *lines*:
-        library_file: IO[Any]
-        with open(file_name, "r") as library_file:
-            lines: List[str] = library_file.read().split('\n')
+        # Construct the file as a list of *lines*.
+        lines: List[str] = []
+        line_format: str = KIPART_LINE_FORMAT
 
-            # Sweep through *lines* looking for first/last lines a schematic symbol definition:
-            def_line_index: int = -1
-            line: str
-            for line_index, line in enumerate(lines):
-                # print("[{0}]: '{1}'".format(line_index, line))
-                if line.startswith("DEF "):
-                    # Found first line of schematic symbol definition:
-                    def_line_index = line_index
-                elif line.startswith("ENDDEF"):
-                    # Found last line of schematic symbol defintion:
-                    assert def_line_index >= 0
-                    symbol: SchematicSymbol = SchematicSymbol(lines[def_line_index:line_index + 1])
-                    symbol_name: str = symbol.name
-                    assert symbol not in symbols_table
-                    symbols_table[symbol_name] = symbol
-                    def_line_index = -1
-
-    # SchematicLibrary.insert():
-    def insert(self, schematic_symbol: "SchematicSymbol") -> None:
-        """Insert schematic symbol into a library."""
-        assert isinstance(schematic_symbol, SchematicSymbol)
-        schematic_library: SchematicLibrary = self
-        symbols_table: Dict[str, SchematicSymbol] = schematic_library.symbols_table
-        symbol_name: str = schematic_symbol.name
-        symbols_table[symbol_name] = schematic_symbol
-
-    # SchematicLibrary.fixup():
-    def fixup(self) -> None:
-        """Fixup a schematic library."""
-        schematic_library: SchematicLibrary = self
-        symbols_table: Dict[str, SchematicSymbol] = schematic_library.symbols_table
-        symbol: SchematicSymbol
-        for symbol in symbols_table.values():
-            symbol.fixup()
-
-    # SchematicLibrary.lookup():
-    def lookup(self, part_name) -> "SchematicSymbol":
-        """Lookup a schematic symbol by part name."""
-        schematic_library: SchematicLibrary = self
-        symbols_table: Dict[str, SchematicSymbol] = schematic_library.symbols_table
-        assert part_name in symbols_table
-        symbol: SchematicSymbol = symbols_table[part_name]
-        return symbol
-
-    # SchematicLibrary.write():
-    def write(self, lib_file_name: str) -> None:
-        """Write a schematic library out to a file."""
-        # print("SchematicLibrary.write('{0}')".format(lib_file_name))
-
-        # Create a sorted list of *symbols*:
-        schematic_library: SchematicLibrary = self
-        symbols_table: Dict[str, SchematicSymbol] = schematic_library.symbols_table
-        symbols: List[SchematicSymbol] = list(symbols_table.values())
-        symbol: SchematicSymbol
-        symbols.sort(key=lambda symbol: symbol.name)
-
-        # Open *lib_file_name*:
-        lib_file: IO[Any]
-        with open(lib_file_name, "w") as lib_file:
-            # Write out the header:
-            lib_file.write("EESchema-LIBRARY Version 2.3\n")
-            lib_file.write("#encoding utf-8\n")
-
-            # Output all of the *symbols* in sorted order:
-            for symbol in symbols:
-                symbol.write(lib_file)
-
-            # Terminate the library:
-            lib_file.write("#\n")
-            lib_file.write("#End Library\n")
-
-
-# SchematicSymbol:
-class SchematicSymbol:
-    """Represents a schematic symbol."""
-
-    # SchematicSymbol.__init__():
-    def __init__(self, lines: List[str]) -> None:
-        """Initialize a SchematicSymbol."""
-        first_line: str = lines[0]
-        last_line: str = lines[-1]
-        assert first_line.startswith("DEF"), "first_line='{0}'".format(first_line)
-        assert last_line.startswith("ENDDEF"), "last_line='{0}'".format(last_line)
-        first_line_trimmed: str = first_line[4:]
-        space_index: int = first_line_trimmed.find(' ')
-        assert space_index >= 0
-        name: str = first_line_trimmed[:space_index]
-
-        # schematic_symbol: SchematicSymbol = self
-        self.lines: List[str] = lines
-        self.name: str = name
-        # print("second_space_index='{0}'".format(first_line))
-        # print("first_line='{0}'".format(first_line))
-        # print("Created Symbol '{0}'".format(name))
-
-    # SchematicSymbol.fixup():
-    def fixup(self) -> None:
-        """Fix up a Sechemtaic symbol."""
-        # Insert the "F2 ..." and "F3 ..." lines into *lines*
-        symbol: SchematicSymbol = self
-        lines: List[str] = symbol.lines
-        line_index: int
-        line: str
-        for line_index, line in enumerate(lines):
-            if line.startswith("F1"):
-                lines.insert(line_index + 1, 'F2 "" 0 0 50 H I C CNN')
-                lines.insert(line_index + 2, 'F3 "" 0 0 50 H I C CNN')
-                break
-
-        # Sweep through *lines* performing minor tweaks:
-        for line_index, line in enumerate(lines):
-            initial_line = line
-            # Change reference label from U to N:
-            if line.startswith('F0 "U"'):
-                line = 'F0 "N"' + line[6:]
-
-            # Turn on background highlighting for rectangles:
-            if line.startswith("S ") and line.endswith(" N"):
-                line = line[:-1] + "f N"
-
-            # Force font sizes from 60 down to 50:
-            if line.endswith("60 H V L CNN"):
-                line = line[:-12] + "50 H V L CNN"
-
-            # Update any *line* that changed:
-            if initial_line != line:
-                # print("'{0}' => '{1}'".format(initial_line, line))
-                lines[line_index] = line
-
-    # SchematicSymbol.write():
-    def write(self, schematic_library_output_file: IO[Any]) -> None:
-        """Write a SechematicySymbol out to an open file."""
-        schematic_symbol: SchematicSymbol = self
-        schematic_library_output_file.write("#\n")
-        schematic_library_output_file.write("# {0}\n".format(schematic_symbol.name))
-        schematic_library_output_file.write("#\n")
-        schematic_library_output_file.write('\n'.join(schematic_symbol.lines))
-        schematic_library_output_file.write('\n')
+        # Output the first line which is a comma separated list of values:
+        #     SYMBOL_NAME,REF_PREFIX,FOOTPRINT,DATA_SHEET_URL,SHORT_DESCRIPTION;LONG_DESCRIPTION
+        lines.append(line_format.format(
+            footprint_binding.symbol_name, footprint_binding.reference_prefix,
+            footprint_binding.footprint_name, footprint_binding.data_sheet_url,
+            footprint_binding.manufacturer_number, footprint_binding.description))
+        lines.append(line_format.format("Pin", "Unit", "Type", "Name", "Style", "Side"))
+
+        position: str
+        chip_pin: ChipPin
+        for position, chip_pin in footprint_binding.bindings:
+            lines.append(kipart_row(position, chip_pin))
+
+        # Terminate the file with ",,,,,," and a blank line:
+        lines.append(",,,,,,\n")
+        lines.append("\n")
+        return lines
+
+    # FootprintBinding.kipart_write():
+    def kipart_write(self, kipart_csv_file_name: str) -> None:
+        """Write the kipart `.csv` file for a FootprintBinding."""
+        footprint_binding: FootprintBinding = self
+        kipart_csv_file: IO[Any]
+        with open(kipart_csv_file_name, "w") as kipart_csv_file:
+            kipart_csv_file.writelines(footprint_binding.kipart_lines())
+
+
+# kipart_row():
+def kipart_row(position: str, chip_pin: ChipPin) -> str:
+    """Return the kipart `.csv` file line that binds a footprint position to a ChipPin."""
+    return KIPART_LINE_FORMAT.format(position, chip_pin.unit, chip_pin.kicad_type,
+                                     chip_pin.name, chip_pin.style, chip_pin.side)
+
+
+# The schematic library code is only loaded when one of these names is first used:
+LAZY_ATTRIBUTES: Dict[str, str] = {
+    "SchematicLibrary": "kicube32.schematic_library",
+    "SchematicSymbol": "kicube32.schematic_library",
+    "library_merge_main": "kicube32.schematic_library",
+    "schematic_libraries_merge": "kicube32.schematic_library",
+    "schematic_library_load": "kicube32.schematic_library",
+}
+
+
+# __getattr__():
+def __getattr__(name: str) -> Any:
+    """Return the lazily loaded module attributes listed in LAZY_ATTRIBUTES."""
+    if name not in LAZY_ATTRIBUTES:
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+    return getattr(importlib.import_module(LAZY_ATTRIBUTES[name]), name)
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
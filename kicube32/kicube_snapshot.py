@@ -0,0 +1,255 @@
+# This file is licensed using the "MIT License" below:
+#
+# ##################################################################################################
+#
+# MIT License
+#
+# Copyright 2019-2020 Home Brew Robotics Club
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies
+# or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# ##################################################################################################
+# <======================================= 100 characters =======================================> #
+
+
+"""kicube_snapshot: Save and reload the parsed, classified and bound state of a KiCube.
+
+Usage: kicube32 BASE.ioc BASE.csv KIPART.csv --snapshot BASE.kicube
+       kicube32 batch --snapshots PROJECT.ioc|DIR|ARCHIVE ...
+
+Tools that need the classified pins of a project (e.g. a BOM checker or a connector label
+printer) can call *snapshot_read*() instead of re-parsing and re-classifying the `.ioc` and
+`.csv` files.  A snapshot is only used if the SHA-256 hashes of the current `.ioc` and `.csv`
+contents match the ones it was written from, so a stale snapshot is never loaded.
+
+The snapshot file layout is:
+* Header: magic, snapshot version, `marshal` format version, payload size (little endian
+  32-bit unsigned integers after the 8 byte magic), the 32 byte `.ioc` and `.csv` hashes, and
+  the 32 byte SHA-256 digest of the payload.
+* Payload: a `marshal`ed tuple of the *KiCube* attributes, the attribute dictionary of each
+  *ChipPin* (the *KiCube* pins followed by any extra pins that only occur in bindings, such
+  as Nucleo power pins), the diagnostics, and each *FootprintBinding* with its bindings as
+  (footprint position, pin number) pairs in kipart unit order.
+Bump SNAPSHOT_VERSION whenever the payload or the *ChipPin* attributes change.  A snapshot
+with a bad payload digest (e.g. a corrupted file) is treated like a stale one.
+"""
+
+from typing import Any, Dict, IO, List, Optional, Tuple
+
+import hashlib
+import marshal
+import os
+import struct
+
+from kicube32.kicube32 import ChipPin, ChipPinIndex, Diagnostics, FootprintBinding, KiCube
+
+SNAPSHOT_MAGIC: bytes = b"KC32SNP\0"
+SNAPSHOT_VERSION: int = 2
+HEADER: struct.Struct = struct.Struct("<8s3I32s32s32s")
+
+# The ChipPin attributes stored in the payload:
+CHIP_PIN_ATTRIBUTES: Tuple[str, ...] = (
+    "position", "name", "vendor_name", "kind", "trimmed_name", "signal", "label", "unit",
+    "unit_sort", "kicad_type", "style", "side", "position_key")
+
+# The KiCube attributes (other than the pins, index and diagnostics) in payload order:
+KICUBE_ATTRIBUTES: Tuple[str, ...] = (
+    "board_name", "ioc_file_name", "mcu_name", "package", "stm32cube_csv_file_name",
+    "cpu_name", "footprint", "nucleo_bindings", "timestamp")
+
+# The FootprintBinding attributes (other than the bindings) in payload order:
+FOOTPRINT_BINDING_ATTRIBUTES: Tuple[str, ...] = (
+    "footprint", "symbol_name", "reference_prefix", "footprint_name", "data_sheet_url",
+    "manufacturer_number", "description")
+
+
+# inputs_hash():
+def inputs_hash(ioc_file_name: str, stm32cube_csv_file_name: str,
+                ioc_text: Optional[str] = None,
+                csv_text: Optional[str] = None) -> Tuple[bytes, bytes, float]:
+    """Return the `.ioc` hash, the `.csv` hash and the `.csv` time stamp of a project.
+
+    If *ioc_text* or *csv_text* is provided, it is used instead of reading the file.  Either
+    file can be an archive member.
+    """
+    from kicube32.archive import text_read
+    if ioc_text is None:
+        ioc_text = text_read(ioc_file_name)[0]
+    csv_timestamp: float
+    if csv_text is None:
+        csv_text, csv_timestamp = text_read(stm32cube_csv_file_name)
+    elif "!/" in stm32cube_csv_file_name:
+        csv_timestamp = text_read(stm32cube_csv_file_name)[1]
+    else:
+        csv_timestamp = os.path.getmtime(stm32cube_csv_file_name)
+    return (hashlib.sha256(ioc_text.encode()).digest(),
+            hashlib.sha256(csv_text.encode()).digest(), csv_timestamp)
+
+
+# snapshot_bytes():
+def snapshot_bytes(kicube: KiCube, footprint_bindings: List[FootprintBinding],
+                   ioc_hash: bytes, csv_hash: bytes) -> bytes:
+    """Return the snapshot of a KiCube and its FootprintBinding's."""
+    # Number every ChipPin, starting with the *kicube* pins:
+    chip_pins: List[ChipPin] = list(kicube.chip_pins)
+    pin_numbers: Dict[int, int] = {id(chip_pin): number
+                                   for number, chip_pin in enumerate(chip_pins)}
+    footprint_binding: FootprintBinding
+    position: str
+    chip_pin: ChipPin
+    for footprint_binding in footprint_bindings:
+        for position, chip_pin in footprint_binding.bindings:
+            if id(chip_pin) not in pin_numbers:
+                pin_numbers[id(chip_pin)] = len(chip_pins)
+                chip_pins.append(chip_pin)
+
+    payload: Tuple[Any, ...] = (
+        tuple([getattr(kicube, attribute_name) for attribute_name in KICUBE_ATTRIBUTES]),
+        len(kicube.chip_pins),
+        tuple([{attribute_name: getattr(chip_pin, attribute_name)
+                for attribute_name in CHIP_PIN_ATTRIBUTES} for chip_pin in chip_pins]),
+        kicube.diagnostics.project,
+        tuple(kicube.diagnostics.counts_table.items()),
+        tuple([(tuple([getattr(footprint_binding, attribute_name)
+                       for attribute_name in FOOTPRINT_BINDING_ATTRIBUTES]),
+                tuple([(position, pin_numbers[id(chip_pin)])
+                       for position, chip_pin in footprint_binding.bindings]))
+               for footprint_binding in footprint_bindings]))
+    payload_bytes: bytes = marshal.dumps(payload, marshal.version)
+    return HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, marshal.version, len(payload_bytes),
+                       ioc_hash, csv_hash, hashlib.sha256(payload_bytes).digest()) + payload_bytes
+
+
+# snapshot_write():
+def snapshot_write(snapshot_file_name: str, kicube: KiCube,
+                   footprint_bindings: List[FootprintBinding], ioc_hash: bytes,
+                   csv_hash: bytes) -> None:
+    """Write the snapshot of a KiCube and its FootprintBinding's to a file.
+
+    *ioc_hash* and *csv_hash* come from *inputs_hash*().  The snapshot is written to a
+    temporary file that then replaces *snapshot_file_name*.
+    """
+    temporary_file_name: str = f"{snapshot_file_name}.{os.getpid()}.tmp"
+    snapshot_file: IO[Any]
+    with open(temporary_file_name, "wb") as snapshot_file:
+        snapshot_file.write(snapshot_bytes(kicube, footprint_bindings, ioc_hash, csv_hash))
+    os.replace(temporary_file_name, snapshot_file_name)
+
+
+# snapshot_load():
+def snapshot_load(snapshot: bytes, ioc_hash: Optional[bytes], csv_hash: Optional[bytes],
+                  timestamp: Optional[float] = None
+                  ) -> Optional[Tuple[KiCube, List[FootprintBinding]]]:
+    """Return the KiCube and FootprintBinding's of a snapshot, or None if it is not usable.
+
+    None is returned if the snapshot is from another snapshot or `marshal` version, is
+    truncated or corrupted, or was not written from the inputs with *ioc_hash* and *csv_hash*.
+    If both hashes are None, the inputs are not checked; this loads the previous state of a
+    project (e.g. for *kicube32.incremental*.)  If *timestamp* is given, it replaces the
+    stored `.csv` time stamp.
+    """
+    if len(snapshot) < HEADER.size:
+        return None
+    magic: bytes
+    snapshot_version: int
+    marshal_version: int
+    payload_size: int
+    snapshot_ioc_hash: bytes
+    snapshot_csv_hash: bytes
+    payload_digest: bytes
+    (magic, snapshot_version, marshal_version, payload_size,
+     snapshot_ioc_hash, snapshot_csv_hash, payload_digest) = HEADER.unpack_from(snapshot, 0)
+    if (magic != SNAPSHOT_MAGIC or snapshot_version != SNAPSHOT_VERSION or
+            marshal_version != marshal.version or
+            len(snapshot) != HEADER.size + payload_size or
+            (ioc_hash is not None and snapshot_ioc_hash != ioc_hash) or
+            (csv_hash is not None and snapshot_csv_hash != csv_hash)):
+        return None
+    payload_bytes: bytes = snapshot[HEADER.size:]
+    if hashlib.sha256(payload_bytes).digest() != payload_digest:
+        return None
+    try:
+        return payload_decode(marshal.loads(payload_bytes), timestamp)
+    except (EOFError, IndexError, KeyError, TypeError, ValueError):
+        # The payload was written by a buggy or incompatible writer:
+        return None
+
+
+# payload_decode():
+def payload_decode(payload: Tuple[Any, ...], timestamp: Optional[float]
+                   ) -> Tuple[KiCube, List[FootprintBinding]]:
+    """Return the KiCube and FootprintBinding's of an unmarshaled snapshot payload."""
+    (kicube_values, kicube_pins_count, chip_pins_values, project,
+     diagnostics_items, footprint_bindings_values) = payload
+
+    # Recreate the ChipPin's without re-classifying them.  Each unmarshaled attribute
+    # dictionary becomes the *__dict__* of its ChipPin, which bypasses the set once check of
+    # *ChipPin.__setattr__*() and is the fastest way to create many objects:
+    chip_pins: List[ChipPin] = []
+    chip_pin_new: Any = ChipPin.__new__
+    object_setattr: Any = object.__setattr__
+    chip_pin_dictionary: Dict[str, Any]
+    for chip_pin_dictionary in chip_pins_values:
+        chip_pin: ChipPin = chip_pin_new(ChipPin)
+        object_setattr(chip_pin, "__dict__", chip_pin_dictionary)
+        chip_pins.append(chip_pin)
+
+    # Recreate the KiCube:
+    diagnostics: Diagnostics = Diagnostics(project)
+    diagnostics.counts_table = dict(diagnostics_items)
+    kicube: KiCube = KiCube.__new__(KiCube)
+    kicube.__dict__.update(zip(KICUBE_ATTRIBUTES, kicube_values))
+    kicube.nucleo_bindings = list(kicube.nucleo_bindings)
+    kicube.chip_pins = chip_pins[:kicube_pins_count]
+    kicube.chip_pin_index = ChipPinIndex(kicube.chip_pins, lazy=True)
+    kicube.diagnostics = diagnostics
+    if timestamp is not None:
+        kicube.timestamp = timestamp
+
+    # Recreate the FootprintBinding's.  The bindings are already in kipart unit order:
+    footprint_bindings: List[FootprintBinding] = []
+    footprint_binding_values: Tuple[Any, ...]
+    binding_values: Tuple[Tuple[str, int], ...]
+    for footprint_binding_values, binding_values in footprint_bindings_values:
+        footprint_binding: FootprintBinding = FootprintBinding.__new__(FootprintBinding)
+        footprint_binding.__dict__.update(zip(FOOTPRINT_BINDING_ATTRIBUTES,
+                                              footprint_binding_values))
+        footprint_binding.bindings = [(position, chip_pins[pin_number])
+                                      for position, pin_number in binding_values]
+        footprint_bindings.append(footprint_binding)
+    return kicube, footprint_bindings
+
+
+# snapshot_read():
+def snapshot_read(snapshot_file_name: str, ioc_file_name: str, stm32cube_csv_file_name: str
+                  ) -> Optional[Tuple[KiCube, List[FootprintBinding]]]:
+    """Return the KiCube and FootprintBinding's of a snapshot file if it is still current.
+
+    None is returned if there is no snapshot file or if it does not match the current
+    *ioc_file_name* and *stm32cube_csv_file_name* contents (see *snapshot_load*().)
+    """
+    if not os.path.isfile(snapshot_file_name):
+        return None
+    snapshot_file: IO[Any]
+    with open(snapshot_file_name, "rb") as snapshot_file:
+        snapshot: bytes = snapshot_file.read()
+    ioc_hash: bytes
+    csv_hash: bytes
+    timestamp: float
+    ioc_hash, csv_hash, timestamp = inputs_hash(ioc_file_name, stm32cube_csv_file_name)
+    return snapshot_load(snapshot, ioc_hash, csv_hash, timestamp)
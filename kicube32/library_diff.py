@@ -0,0 +1,192 @@
+# This file is licensed using the "MIT License" below:
+#
+# ##################################################################################################
+#
+# MIT License
+#
+# Copyright 2019-2020 Home Brew Robotics Club
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies
+# or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# ##################################################################################################
+# <======================================= 100 characters =======================================> #
+
+
+"""library_diff: Show the symbol and pin level differences between two schematic libraries.
+
+Usage: kicube32 lib-diff [--quiet] OLD.lib NEW.lib
+
+Both `.lib` files are indexed by symbol name with a hash of each symbol's text, without
+parsing the symbols.  Only the symbols whose hashes differ are turned into *SchematicSymbol*
+objects and compared pin by pin (number, name, electrical type and unit.)  Symbols that only
+differ in white space are treated as unchanged.  The output lines are:
+
+    + SYMBOL                  (added)
+    - SYMBOL                  (removed)
+    ~ SYMBOL                  (changed), followed by one line per changed pin:
+        + NUMBER: NAME TYPE unit UNIT
+        - NUMBER: NAME TYPE unit UNIT
+        ~ NUMBER: NAME TYPE unit UNIT => NAME TYPE unit UNIT
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import argparse
+import hashlib
+
+from kicube32.schematic_library import SchematicSymbol
+from kicube32.symbol_index import ELECTRICAL_TYPES
+
+# A symbol index entry is (hash, start offset, end offset) within the library text:
+SymbolEntry = Tuple[bytes, int, int]
+
+
+# library_symbols_index():
+def library_symbols_index(text: str) -> Dict[str, SymbolEntry]:
+    """Return a table mapping each symbol name in a `.lib` text to its SymbolEntry."""
+    # Plain string searches are several times faster than a regular expression here:
+    symbols_table: Dict[str, SymbolEntry] = {}
+    newline: int = -1 if text.startswith("DEF ") else text.find("\nDEF ")
+    start: int = newline + 1 if newline >= 0 or text.startswith("DEF ") else -1
+    while start >= 0:
+        def_end: int = text.find("\n", start)
+        end: int = text.find("\nENDDEF", start)
+        if def_end < 0 or end < 0:
+            break
+        line_end: int = text.find("\n", end + 1)
+        end = len(text) if line_end < 0 else line_end
+        # The name is the first field after 'DEF', however many spaces separate them:
+        symbols_table[text[start:def_end].split()[1]] = (
+            hashlib.blake2b(text[start:end].encode(), digest_size=16).digest(), start, end)
+        newline = text.find("\nDEF ", end)
+        start = newline + 1 if newline >= 0 else -1
+    return symbols_table
+
+
+# symbol_parse():
+def symbol_parse(text: str, symbol_entry: SymbolEntry) -> SchematicSymbol:
+    """Return the SchematicSymbol for a SymbolEntry of a `.lib` text."""
+    return SchematicSymbol(text[symbol_entry[1]:symbol_entry[2]].split('\n'))
+
+
+# pin_format():
+def pin_format(pin: Tuple[str, str, int]) -> str:
+    """Return a (name, type letter, unit) pin as text."""
+    return f"{pin[0]} {ELECTRICAL_TYPES.get(pin[1], pin[1])} unit {pin[2]}"
+
+
+# symbol_pins_diff():
+def symbol_pins_diff(old_symbol: SchematicSymbol, new_symbol: SchematicSymbol) -> List[str]:
+    """Return the pin differences between two versions of a symbol.
+
+    Pins are matched by pin number.  Stacked pins (several pins with the same number) are
+    matched in the order they occur.
+    """
+    pins_tables: List[Dict[str, Tuple[str, str, int]]] = []
+    symbol: SchematicSymbol
+    for symbol in (old_symbol, new_symbol):
+        pins_table: Dict[str, Tuple[str, str, int]] = {}
+        number: str
+        name: str
+        type_letter: str
+        unit: int
+        for number, name, type_letter, unit in symbol.pins():
+            pin_key: str = number
+            index: int = 1
+            while pin_key in pins_table:
+                index += 1
+                pin_key = f"{number}#{index}"
+            pins_table[pin_key] = (name, type_letter, unit)
+        pins_tables.append(pins_table)
+    old_pins: Dict[str, Tuple[str, str, int]] = pins_tables[0]
+    new_pins: Dict[str, Tuple[str, str, int]] = pins_tables[1]
+
+    differences: List[str] = []
+    key: str
+    for key in sorted(set(old_pins.keys()) | set(new_pins.keys()),
+                      key=lambda key: (len(key), key)):
+        old_pin: Optional[Tuple[str, str, int]] = old_pins.get(key)
+        new_pin: Optional[Tuple[str, str, int]] = new_pins.get(key)
+        if old_pin is None and new_pin is not None:
+            differences.append(f"    + {key}: {pin_format(new_pin)}")
+        elif new_pin is None and old_pin is not None:
+            differences.append(f"    - {key}: {pin_format(old_pin)}")
+        elif old_pin is not None and new_pin is not None and old_pin != new_pin:
+            differences.append(f"    ~ {key}: {pin_format(old_pin)} => {pin_format(new_pin)}")
+    return differences
+
+
+# library_diff():
+def library_diff(old_text: str, new_text: str) -> List[str]:
+    """Return the symbol and pin differences between two `.lib` texts."""
+    old_symbols: Dict[str, SymbolEntry] = library_symbols_index(old_text)
+    new_symbols: Dict[str, SymbolEntry] = library_symbols_index(new_text)
+    differences: List[str] = []
+    name: str
+    for name in sorted(set(old_symbols.keys()) | set(new_symbols.keys())):
+        old_entry: Optional[SymbolEntry] = old_symbols.get(name)
+        new_entry: Optional[SymbolEntry] = new_symbols.get(name)
+        if old_entry is None:
+            differences.append(f"+ {name}")
+        elif new_entry is None:
+            differences.append(f"- {name}")
+        elif old_entry[0] != new_entry[0]:
+            # Only the symbols with different hashes are parsed:
+            old_symbol: SchematicSymbol = symbol_parse(old_text, old_entry)
+            new_symbol: SchematicSymbol = symbol_parse(new_text, new_entry)
+            if old_symbol.body_hash() != new_symbol.body_hash():
+                pin_differences: List[str] = symbol_pins_diff(old_symbol, new_symbol)
+                differences.append(f"~ {name}" if len(pin_differences) > 0
+                                   else f"~ {name} (no pin changes)")
+                differences.extend(pin_differences)
+    return differences
+
+
+# library_diff_main():
+def library_diff_main(arguments: List[str]) -> int:
+    """Show the differences between two schematic libraries."""
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="kicube32 lib-diff",
+        description="Show the symbol and pin differences between two KiCad .lib files.")
+    parser.add_argument("old_lib_file_name", metavar="OLD.lib", help="Old .lib file")
+    parser.add_argument("new_lib_file_name", metavar="NEW.lib", help="New .lib file")
+    parser.add_argument("--quiet", action="store_true",
+                        help="Only set the exit code (1 if the libraries differ)")
+    parsed_arguments: argparse.Namespace = parser.parse_args(arguments)
+
+    # The files can be archive members (e.g. 'rev3.zip!/f767zi.lib'):
+    from kicube32.archive import text_read
+    texts: List[str] = []
+    lib_file_name: str
+    for lib_file_name in (parsed_arguments.old_lib_file_name,
+                          parsed_arguments.new_lib_file_name):
+        if not lib_file_name.endswith(".lib"):
+            print(f"Library file name '{lib_file_name}' does not end in '.lib'.")
+            return 2
+        try:
+            texts.append(text_read(lib_file_name)[0])
+        except (OSError, KeyError) as error:
+            print(f"Unable to read '{lib_file_name}': {error}")
+            return 2
+
+    differences: List[str] = library_diff(texts[0], texts[1])
+    if not parsed_arguments.quiet:
+        difference: str
+        for difference in differences:
+            print(difference)
+    return 0 if len(differences) == 0 else 1
@@ -0,0 +1,209 @@
+# This file is licensed using the "MIT License" below:
+#
+# ##################################################################################################
+#
+# MIT License
+#
+# Copyright 2019-2020 Home Brew Robotics Club
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies
+# or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# ##################################################################################################
+# <======================================= 100 characters =======================================> #
+
+
+"""library_journal: Insert symbols into a shared schematic library from concurrent processes.
+
+Usage: kicube32 lib-insert [--fixup] [--verbose] LIBRARY.lib SYMBOLS.lib ...
+
+Reading a `.lib` file, inserting a symbol and writing it back is a read-modify-write, so two
+processes updating the same library at once lose one of the updates.  Instead, each insert is
+appended to a journal file (`LIBRARY.lib.journal`) and then committed:
+
+1. The symbols are appended to the journal while holding an exclusive lock on the journal.
+   This is short, so generators only serialize on the append.
+2. The committer takes the library lock (`LIBRARY.lib.lock`), reads every journaled symbol
+   (including the ones appended by other processes), inserts them all into the library, and
+   writes the library once.  The library write replaces the file atomically.
+3. The committed prefix of the journal is then removed, leaving anything appended meanwhile.
+
+A process that was waiting for the library lock usually finds that its symbols were already
+committed by the previous holder and has nothing left to do, so concurrent inserts are
+coalesced into a single rewrite.  If a committer dies before step 3, the journaled symbols are
+simply inserted again by the next commit.  The locks are `fcntl.flock` locks, so this is
+for POSIX systems.
+"""
+
+from typing import Any, Dict, IO, List, Text
+
+import argparse
+import fcntl
+import os
+
+from kicube32.schematic_library import SchematicLibrary, SchematicSymbol, schematic_library_load
+
+
+# journal_append():
+def journal_append(journal_file_name: str, symbols: List[SchematicSymbol]) -> None:
+    """Append symbols to a journal file in one locked write."""
+    text: str = "".join(['\n'.join(symbol.lines) + '\n' for symbol in symbols])
+    journal_file: IO[Any]
+    with open(journal_file_name, "a") as journal_file:
+        fcntl.flock(journal_file, fcntl.LOCK_EX)
+        journal_file.write(text)
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+        # Closing *journal_file* releases the lock.
+
+
+# journal_read():
+def journal_read(journal_file_name: str) -> str:
+    """Return the contents of a journal file, which is empty if there is no journal."""
+    if not os.path.isfile(journal_file_name):
+        return ""
+    journal_file: IO[Any]
+    with open(journal_file_name, "r") as journal_file:
+        fcntl.flock(journal_file, fcntl.LOCK_SH)
+        return journal_file.read()
+
+
+# journal_symbols():
+def journal_symbols(journal_text: str) -> Dict[str, SchematicSymbol]:
+    """Return the symbols of a journal, where later entries for a name replace earlier ones.
+
+    A trailing symbol without an `ENDDEF` line (e.g. from an appender that died mid-write) is
+    ignored.
+    """
+    symbols_table: Dict[str, SchematicSymbol] = {}
+    lines: List[str] = journal_text.split('\n')
+    def_line_index: int = -1
+    line_index: int
+    line: str
+    for line_index, line in enumerate(lines):
+        if line.startswith("DEF "):
+            def_line_index = line_index
+        elif line.startswith("ENDDEF") and def_line_index >= 0:
+            symbol: SchematicSymbol = SchematicSymbol(lines[def_line_index:line_index + 1])
+            symbols_table[symbol.name] = symbol
+            def_line_index = -1
+    return symbols_table
+
+
+# journal_discard():
+def journal_discard(journal_file_name: str, committed_text: str) -> bool:
+    """Remove the committed prefix of a journal file, keeping anything appended since.
+
+    If the journal no longer starts with *committed_text* (someone other than an appender
+    rewrote it), it is left alone and False is returned.  Nothing is lost that way; the next
+    commit just inserts the already committed symbols again.
+    """
+    journal_file: IO[Any]
+    with open(journal_file_name, "r+") as journal_file:
+        fcntl.flock(journal_file, fcntl.LOCK_EX)
+        text: str = journal_file.read()
+        if not text.startswith(committed_text):
+            return False
+        journal_file.seek(0)
+        journal_file.write(text[len(committed_text):])
+        journal_file.truncate()
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+    return True
+
+
+# journal_commit():
+def journal_commit(lib_file_name: str, tracing: Text = "") -> int:
+    """Insert all journaled symbols into a library with one rewrite.
+
+    The number of symbols written by this call is returned; 0 means that some other process
+    already committed everything.
+    """
+    journal_file_name: str = lib_file_name + ".journal"
+    lock_file: IO[Any]
+    with open(lib_file_name + ".lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        journal_text: str = journal_read(journal_file_name)
+        if journal_text == "":
+            return 0
+
+        # Later journal entries for the same symbol name replace earlier ones:
+        symbols_table: Dict[str, SchematicSymbol] = journal_symbols(journal_text)
+        schematic_library: SchematicLibrary = (schematic_library_load(lib_file_name)
+                                               if os.path.isfile(lib_file_name)
+                                               else SchematicLibrary())
+        symbol: SchematicSymbol
+        for symbol in symbols_table.values():
+            schematic_library.insert(symbol)
+        schematic_library.write(lib_file_name)
+        if not journal_discard(journal_file_name, journal_text):
+            print(f"Journal '{journal_file_name}' was rewritten during a commit; "
+                  "its symbols will be inserted again by the next commit.")
+        if tracing:
+            print(f"{tracing}Committed {len(symbols_table)} symbols to '{lib_file_name}'")
+        return len(symbols_table)
+
+
+# library_insert():
+def library_insert(lib_file_name: str, symbols: List[SchematicSymbol],
+                   tracing: Text = "") -> int:
+    """Insert symbols into a library that other processes may be updating at the same time.
+
+    Returns the number of symbols written by this process (see *journal_commit*.)
+    """
+    journal_append(lib_file_name + ".journal", symbols)
+    return journal_commit(lib_file_name, tracing=tracing)
+
+
+# library_insert_main():
+def library_insert_main(arguments: List[str]) -> int:
+    """Insert the symbols of some `.lib` files into a shared library."""
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="kicube32 lib-insert",
+        description="Safely insert symbols into a .lib file shared by parallel generators.")
+    parser.add_argument("lib_file_name", metavar="LIBRARY.lib", help="Shared .lib file")
+    parser.add_argument("symbols_lib_file_names", metavar="SYMBOLS.lib", nargs="+",
+                        help=".lib files (e.g. from kipart) whose symbols are inserted")
+    parser.add_argument("--fixup", action="store_true",
+                        help="Apply the kicube32 symbol fixups before inserting")
+    parser.add_argument("--verbose", action="store_true", help="Show each commit")
+    parsed_arguments: argparse.Namespace = parser.parse_args(arguments)
+    tracing: Text = " " if parsed_arguments.verbose else ""
+
+    lib_file_name: str = parsed_arguments.lib_file_name
+    symbols_lib_file_names: List[str] = parsed_arguments.symbols_lib_file_names
+    if not all([file_name.endswith(".lib")
+                for file_name in [lib_file_name] + symbols_lib_file_names]):
+        print("All library file names must end in '.lib'.")
+        return 1
+
+    symbols: List[SchematicSymbol] = []
+    symbols_lib_file_name: str
+    for symbols_lib_file_name in symbols_lib_file_names:
+        try:
+            symbols_library: SchematicLibrary = schematic_library_load(symbols_lib_file_name)
+        except (OSError, KeyError) as error:
+            print(f"Unable to read '{symbols_lib_file_name}': {error}")
+            return 1
+        if parsed_arguments.fixup:
+            symbols_library.fixup()
+        symbols.extend(symbols_library.symbols_table.values())
+    if len(symbols) == 0:
+        print("There are no symbols to insert.")
+        return 1
+    library_insert(lib_file_name, symbols, tracing=tracing)
+    return 0
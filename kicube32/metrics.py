@@ -0,0 +1,286 @@
+# This file is licensed using the "MIT License" below:
+#
+# ##################################################################################################
+#
+# MIT License
+#
+# Copyright 2019-2020 Home Brew Robotics Club
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies
+# or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# ##################################################################################################
+# <======================================= 100 characters =======================================> #
+
+
+"""metrics: Counters and latency histograms for kicube32 and kidocgen runs.
+
+Usage: kicube32 BASE.ioc BASE.csv KIPART.csv --metrics FILE.prom|FILE.json
+       kicube32 batch --metrics FILE.prom|FILE.json [--metrics-interval SECONDS] ...
+       kidocgen CSVS_DIR FILE.dcm --metrics FILE.prom|FILE.json
+
+A *Metrics* object keeps labeled counters (projects processed, pins classified per kind and
+MCU family, unknown signals, cache hits and misses, bytes read and written) and per-stage
+latency histograms.  It is written out once at exit and, in long running modes, every
+*interval* seconds.  A file name ending in `.json` gets a JSON snapshot; anything else gets the
+Prometheus text exposition format (e.g. for the node exporter textfile collector.)  Each write
+goes to a temporary file that then replaces the metrics file, so a scraper never sees a
+partially written file.
+"""
+
+from typing import Any, Dict, IO, Iterator, List, Optional, Set, Tuple
+
+import contextlib
+import json
+import os
+import time
+
+# The help text and type of each metric, in output order:
+METRIC_DESCRIPTIONS: Dict[str, Tuple[str, str]] = {
+    "kicube32_projects_total": ("counter", "Projects processed, by result"),
+    "kicube32_pins_classified_total": ("counter", "Pins classified, by kind and MCU family"),
+    "kicube32_unknown_signals_total": ("counter", "Unrecognized signals or names reported"),
+    "kicube32_cache_hits_total": ("counter", "Cache lookups that hit, by cache"),
+    "kicube32_cache_misses_total": ("counter", "Cache lookups that missed, by cache"),
+    "kicube32_read_bytes_total": ("counter", "Bytes of input read"),
+    "kicube32_written_bytes_total": ("counter", "Bytes of output written"),
+    "kicube32_stage_seconds": ("histogram", "Latency of each processing stage"),
+}
+
+# The upper bounds (in seconds) of the latency histogram buckets:
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# The Diagnostics codes that count as an unknown signal:
+UNKNOWN_SIGNAL_CODES: Tuple[str, ...] = (
+    "unknown-io-name", "unrecognized-signal", "unhandled-io-signal", "unhandled-usb-signal")
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+# Histogram:
+class Histogram:
+    """Represents the bucket counts, sum and count of one labeled histogram."""
+
+    # Histogram.__init__():
+    def __init__(self) -> None:
+        """Initialize an empty Histogram."""
+        # histogram: Histogram = self
+        self.bucket_counts: List[int] = [0] * len(LATENCY_BUCKETS)
+        self.count: int = 0
+        self.sum: float = 0.0
+
+    # Histogram.observe():
+    def observe(self, value: float) -> None:
+        """Add one value to a Histogram."""
+        histogram: Histogram = self
+        histogram.count += 1
+        histogram.sum += value
+        index: int
+        bound: float
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                histogram.bucket_counts[index] += 1
+                break
+
+
+# Metrics:
+class Metrics:
+    """Collects counters and histograms and writes them to a metrics file."""
+
+    # Metrics.__init__():
+    def __init__(self, file_name: str = "", interval: float = 0.0) -> None:
+        """Initialize a Metrics collector.
+
+        The arguments are:
+        * *file_name* (str): The metrics file.  Empty means that *write*() does nothing.
+        * *interval* (float): The number of seconds between *periodic_write*() writes.
+          0 disables the periodic writes.
+        """
+        # metrics: Metrics = self
+        self.file_name: str = file_name
+        self.interval: float = interval
+        self.counters_table: Dict[Tuple[str, Labels], float] = {}
+        self.histograms_table: Dict[Tuple[str, Labels], Histogram] = {}
+        self.start_time: float = time.time()
+        self.write_time: float = time.monotonic()
+
+    # Metrics.count():
+    def count(self, name: str, amount: float = 1, **labels: str) -> None:
+        """Add an amount to a labeled counter."""
+        metrics: Metrics = self
+        assert name in METRIC_DESCRIPTIONS, f"Unknown metric '{name}'"
+        key: Tuple[str, Labels] = (name, tuple(sorted(labels.items())))
+        counters_table: Dict[Tuple[str, Labels], float] = metrics.counters_table
+        counters_table[key] = counters_table.get(key, 0) + amount
+
+    # Metrics.observe():
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """Add a value to a labeled histogram."""
+        metrics: Metrics = self
+        assert name in METRIC_DESCRIPTIONS, f"Unknown metric '{name}'"
+        key: Tuple[str, Labels] = (name, tuple(sorted(labels.items())))
+        histograms_table: Dict[Tuple[str, Labels], Histogram] = metrics.histograms_table
+        if key not in histograms_table:
+            histograms_table[key] = Histogram()
+        histograms_table[key].observe(value)
+
+    # Metrics.stage():
+    @contextlib.contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        """Time the body of a `with` statement as one processing stage."""
+        metrics: Metrics = self
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            metrics.observe("kicube32_stage_seconds", time.perf_counter() - start, stage=stage)
+
+    # Metrics.file_read():
+    def file_read(self, file_name: str) -> None:
+        """Count the size of an input file as bytes read."""
+        metrics: Metrics = self
+        if os.path.isfile(file_name):
+            metrics.count("kicube32_read_bytes_total", os.path.getsize(file_name))
+
+    # Metrics.file_written():
+    def file_written(self, file_name: str) -> None:
+        """Count the size of an output file as bytes written."""
+        metrics: Metrics = self
+        if os.path.isfile(file_name):
+            metrics.count("kicube32_written_bytes_total", os.path.getsize(file_name))
+
+    # Metrics.kicube_record():
+    def kicube_record(self, kicube: Any, chip_pins: Optional[List[Any]] = None) -> None:
+        """Count the classified pins and unknown signals of a freshly classified KiCube.
+
+        If *chip_pins* is given, only those pins (e.g. the ones an incremental update
+        reclassified) and their unknown signals are counted.
+        """
+        metrics: Metrics = self
+        family: str = kicube.mcu_name[:7] if kicube.mcu_name else kicube.cpu_name[:2]
+        if chip_pins is None:
+            chip_pins = kicube.chip_pins
+        kinds_table: Dict[str, int] = {}
+        chip_pin: Any
+        for chip_pin in chip_pins:
+            kinds_table[chip_pin.kind] = kinds_table.get(chip_pin.kind, 0) + 1
+        kind: str
+        pins_count: int
+        for kind, pins_count in kinds_table.items():
+            metrics.count("kicube32_pins_classified_total", pins_count, kind=kind, family=family)
+
+        # Count every occurrence, since one diagnostic key can be reported many times:
+        positions: Optional[Set[str]] = (None if chip_pins is kicube.chip_pins else
+                                         {chip_pin.position for chip_pin in chip_pins})
+        unknown_count: int = sum([count
+                                  for key, count in kicube.diagnostics.counts_table.items()
+                                  if key[1] in UNKNOWN_SIGNAL_CODES and
+                                  (positions is None or key[3] in positions)])
+        metrics.count("kicube32_unknown_signals_total", unknown_count, family=family)
+
+    # Metrics.prometheus_text():
+    def prometheus_text(self) -> str:
+        """Return the metrics in the Prometheus text exposition format."""
+        metrics: Metrics = self
+        lines: List[str] = []
+        name: str
+        metric_type: str
+        help_text: str
+        for name, (metric_type, help_text) in METRIC_DESCRIPTIONS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            labels: Labels
+            value: float
+            for (counter_name, labels), value in sorted(metrics.counters_table.items()):
+                if counter_name == name:
+                    lines.append(f"{name}{labels_format(labels)} {value:g}")
+            histogram: Histogram
+            for (histogram_name, labels), histogram in sorted(
+                    metrics.histograms_table.items(), key=lambda item: item[0]):
+                if histogram_name == name:
+                    cumulative_count: int = 0
+                    bound: float
+                    bucket_count: int
+                    for bound, bucket_count in zip(LATENCY_BUCKETS, histogram.bucket_counts):
+                        cumulative_count += bucket_count
+                        bucket_labels: Labels = labels + (("le", f"{bound:g}"),)
+                        lines.append(f"{name}_bucket{labels_format(bucket_labels)} "
+                                     f"{cumulative_count}")
+                    lines.append(f"{name}_bucket{labels_format(labels + (('le', '+Inf'),))} "
+                                 f"{histogram.count}")
+                    lines.append(f"{name}_sum{labels_format(labels)} {histogram.sum:.6f}")
+                    lines.append(f"{name}_count{labels_format(labels)} {histogram.count}")
+        lines.append("")
+        return '\n'.join(lines)
+
+    # Metrics.json_text():
+    def json_text(self) -> str:
+        """Return the metrics as JSON text."""
+        metrics: Metrics = self
+        counters: List[Dict[str, Any]] = []
+        name: str
+        labels: Labels
+        value: float
+        for (name, labels), value in sorted(metrics.counters_table.items()):
+            counters.append({"name": name, "labels": dict(labels), "value": value})
+        histograms: List[Dict[str, Any]] = []
+        histogram: Histogram
+        for (name, labels), histogram in sorted(metrics.histograms_table.items(),
+                                                key=lambda item: item[0]):
+            histograms.append({"name": name, "labels": dict(labels),
+                               "buckets": list(LATENCY_BUCKETS),
+                               "bucket_counts": histogram.bucket_counts,
+                               "count": histogram.count, "sum": histogram.sum})
+        return json.dumps({"start_time": metrics.start_time, "time": time.time(),
+                           "counters": counters, "histograms": histograms}, indent=2)
+
+    # Metrics.write():
+    def write(self) -> None:
+        """Write the metrics to the metrics file, if there is one."""
+        metrics: Metrics = self
+        file_name: str = metrics.file_name
+        if file_name:
+            text: str = (metrics.json_text() if file_name.endswith(".json")
+                         else metrics.prometheus_text())
+            temporary_file_name: str = f"{file_name}.{os.getpid()}.tmp"
+            metrics_file: IO[Any]
+            with open(temporary_file_name, "w") as metrics_file:
+                metrics_file.write(text)
+            os.replace(temporary_file_name, file_name)
+            metrics.write_time = time.monotonic()
+
+    # Metrics.periodic_write():
+    def periodic_write(self) -> None:
+        """Write the metrics file if at least *interval* seconds passed since the last write."""
+        metrics: Metrics = self
+        if metrics.interval > 0 and time.monotonic() - metrics.write_time >= metrics.interval:
+            metrics.write()
+
+
+# labels_format():
+def labels_format(labels: Labels) -> str:
+    """Return labels in the Prometheus `{name="value",...}` form."""
+    if len(labels) == 0:
+        return ""
+    escaped_labels: List[str] = []
+    name: str
+    value: str
+    for name, value in labels:
+        escaped_value: str = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped_labels.append(f'{name}="{escaped_value}"')
+    return "{" + ",".join(escaped_labels) + "}"
@@ -0,0 +1,246 @@
+# This file is licensed using the "MIT License" below:
+#
+# ##################################################################################################
+#
+# MIT License
+#
+# Copyright 2019-2020 Home Brew Robotics Club
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies
+# or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# ##################################################################################################
+# <======================================= 100 characters =======================================> #
+
+
+"""pin_database: A cross-project SQLite database of kicube32 pin assignments.
+
+Usage: kicube32 BASE.ioc BASE.csv KIPART.csv --pins-db PINS.db [--project NAME]
+       kicube32 pins-query PINS.db [--pin P] [--signal S] [--label L] [--footprint F]
+       kicube32 pins-query PINS.db --connector-usage N [--footprint F]
+
+Each kicube32 run replaces (i.e. upserts) the pins recorded for its (project, MCU, board,
+footprint) key.  Upserts are not committed until *PinDatabase.commit*() is called, so batch
+runs can record many projects in one transaction.
+"""
+
+from typing import Any, List, Optional, Text, Tuple
+
+import argparse
+import os
+import sqlite3
+
+from kicube32.kicube32 import ChipPin, FootprintBinding, KiCube
+
+# The SQLite `application_id` that marks a file as a pin database ('KCPD'):
+APPLICATION_ID: int = 0x4B435044
+
+# Bump *SCHEMA_VERSION* whenever the tables below change.  The recorded pins can not be
+# regenerated, so databases with another schema version are refused rather than rebuilt:
+SCHEMA_VERSION: int = 1
+SCHEMA: str = """
+CREATE TABLE designs (
+    id INTEGER PRIMARY KEY,
+    project TEXT NOT NULL,
+    mcu TEXT NOT NULL,
+    board TEXT NOT NULL,
+    footprint TEXT NOT NULL,
+    UNIQUE (project, mcu, board, footprint)
+);
+CREATE TABLE pins (
+    design_id INTEGER NOT NULL REFERENCES designs(id) ON DELETE CASCADE,
+    position TEXT NOT NULL,
+    name TEXT NOT NULL,
+    signal TEXT NOT NULL,
+    label TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    kicad_type TEXT NOT NULL,
+    unit TEXT NOT NULL
+);
+CREATE INDEX pins_design_id ON pins(design_id);
+CREATE INDEX pins_name_signal ON pins(name, signal);
+CREATE INDEX pins_signal ON pins(signal);
+CREATE INDEX pins_label ON pins(label);
+CREATE INDEX pins_position ON pins(position, design_id);
+"""
+
+
+# PinDatabase:
+class PinDatabase:
+    """Represents an SQLite database of pin assignments from many kicube32 runs."""
+
+    # PinDatabase.__init__():
+    def __init__(self, database_file_name: str) -> None:
+        """Open (or create) a PinDatabase.
+
+        A ValueError is raised if *database_file_name* is neither empty nor a pin database
+        with the current schema.  Such files are never modified.
+        """
+        connection: sqlite3.Connection = sqlite3.connect(database_file_name)
+        try:
+            application_id: int = connection.execute("PRAGMA application_id").fetchone()[0]
+            schema_version: int = connection.execute("PRAGMA user_version").fetchone()[0]
+            tables_count: int = connection.execute(
+                "SELECT count(*) FROM sqlite_master").fetchone()[0]
+        except sqlite3.DatabaseError as error:
+            connection.close()
+            raise ValueError(f"'{database_file_name}' is not a pin database ({error})")
+        if application_id == 0 and tables_count == 0:
+            # Fill in the new empty database:
+            connection.executescript(SCHEMA)
+            connection.execute(f"PRAGMA application_id = {APPLICATION_ID}")
+            connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            connection.commit()
+        elif application_id != APPLICATION_ID:
+            connection.close()
+            raise ValueError(f"'{database_file_name}' is not a pin database; "
+                             "delete it or use a different file name")
+        elif schema_version != SCHEMA_VERSION:
+            connection.close()
+            raise ValueError(f"Pin database '{database_file_name}' has schema version "
+                             f"{schema_version} (expected {SCHEMA_VERSION})")
+        connection.execute("PRAGMA foreign_keys = ON")
+
+        # pin_database: PinDatabase = self
+        self.connection: sqlite3.Connection = connection
+        self.database_file_name: str = database_file_name
+
+    # PinDatabase.close():
+    def close(self) -> None:
+        """Commit any pending upserts and close a PinDatabase."""
+        pin_database: PinDatabase = self
+        pin_database.commit()
+        pin_database.connection.close()
+
+    # PinDatabase.commit():
+    def commit(self) -> None:
+        """Commit all pending upserts in one transaction."""
+        pin_database: PinDatabase = self
+        pin_database.connection.commit()
+
+    # PinDatabase.kicube_upsert():
+    def kicube_upsert(self, project: str, kicube: KiCube,
+                      footprint_binding: FootprintBinding, tracing: Text = "") -> None:
+        """Replace the pins recorded for a project footprint with those of a FootprintBinding.
+
+        The upsert is not committed; call *PinDatabase.commit*() to do that.
+        """
+        pin_database: PinDatabase = self
+        connection: sqlite3.Connection = pin_database.connection
+        key: Tuple[str, str, str, str] = (project, kicube.mcu_name, kicube.board_name,
+                                          footprint_binding.footprint)
+        connection.execute("DELETE FROM designs "
+                           "WHERE project = ? AND mcu = ? AND board = ? AND footprint = ?", key)
+        design_id: Optional[int] = connection.execute(
+            "INSERT INTO designs (project, mcu, board, footprint) VALUES (?, ?, ?, ?)",
+            key).lastrowid
+        rows: List[Tuple[Any, ...]] = []
+        position: str
+        chip_pin: ChipPin
+        for position, chip_pin in footprint_binding.bindings:
+            rows.append((design_id, position, chip_pin.trimmed_name, chip_pin.signal,
+                         chip_pin.label, chip_pin.kind, chip_pin.kicad_type, chip_pin.unit))
+        connection.executemany(
+            "INSERT INTO pins (design_id, position, name, signal, label, kind, kicad_type, "
+            "unit) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        if tracing:
+            print(f"{tracing}Recorded {len(rows)} pins for {key}")
+
+    # PinDatabase.pins_query():
+    def pins_query(self, name: str = "", signal: str = "", label: str = "",
+                   footprint: str = "") -> List[Tuple[Any, ...]]:
+        """Return the recorded pins that match all of the non-empty GLOB patterns.
+
+        Each returned row is (project, mcu, board, footprint, position, name, signal, label).
+        """
+        pin_database: PinDatabase = self
+        conditions: List[str] = []
+        values: List[str] = []
+        if name:
+            conditions.append("pins.name GLOB ?")
+            values.append(name)
+        if signal:
+            conditions.append("pins.signal GLOB ?")
+            values.append(signal)
+        if label:
+            conditions.append("pins.label GLOB ?")
+            values.append(label)
+        if footprint:
+            conditions.append("designs.footprint GLOB ?")
+            values.append(footprint)
+        where: str = "WHERE " + " AND ".join(conditions) if conditions else ""
+        query: str = ("SELECT designs.project, designs.mcu, designs.board, designs.footprint, "
+                      "pins.position, pins.name, pins.signal, pins.label FROM pins "
+                      "JOIN designs ON pins.design_id = designs.id "
+                      f"{where} ORDER BY designs.project, pins.name")
+        return pin_database.connection.execute(query, values).fetchall()
+
+    # PinDatabase.connector_usage_query():
+    def connector_usage_query(self, minimum_designs: int,
+                              footprint: str = "NUCLEO*") -> List[Tuple[Any, ...]]:
+        """Return the footprint positions used (i.e. with a signal) by > minimum designs.
+
+        Each returned row is (footprint, position, designs count), most used first.
+        """
+        pin_database: PinDatabase = self
+        query: str = ("SELECT designs.footprint, pins.position, COUNT(DISTINCT designs.id) "
+                      "AS designs_count FROM pins "
+                      "JOIN designs ON pins.design_id = designs.id "
+                      "WHERE pins.signal != '' AND designs.footprint GLOB ? "
+                      "GROUP BY designs.footprint, pins.position HAVING designs_count > ? "
+                      "ORDER BY designs_count DESC, designs.footprint, pins.position")
+        return pin_database.connection.execute(query, (footprint, minimum_designs)).fetchall()
+
+
+# pins_query_main():
+def pins_query_main(arguments: List[str]) -> int:
+    """Query a PinDatabase."""
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="kicube32 pins-query", description="Search recorded kicube32 pin assignments.")
+    parser.add_argument("database_file_name", metavar="PINS.db", help="Pin database file")
+    parser.add_argument("--pin", default="", help="Pin name pattern (e.g. 'PA5')")
+    parser.add_argument("--signal", default="", help="Signal pattern (e.g. 'SPI1_SCK')")
+    parser.add_argument("--label", default="", help="User label pattern")
+    parser.add_argument("--footprint", default="", help="Footprint pattern (e.g. 'NUCLEO144')")
+    parser.add_argument("--connector-usage", type=int, default=-1, metavar="N",
+                        help="List the connector pins used by more than N designs")
+    parsed_arguments: argparse.Namespace = parser.parse_args(arguments)
+    if not os.path.isfile(parsed_arguments.database_file_name):
+        print(f"Pin database '{parsed_arguments.database_file_name}' does not exist")
+        return 1
+
+    try:
+        pin_database: PinDatabase = PinDatabase(parsed_arguments.database_file_name)
+    except ValueError as error:
+        print(error)
+        return 1
+    rows: List[Tuple[Any, ...]]
+    row: Tuple[Any, ...]
+    if parsed_arguments.connector_usage >= 0:
+        rows = pin_database.connector_usage_query(parsed_arguments.connector_usage,
+                                                  parsed_arguments.footprint or "NUCLEO*")
+        for row in rows:
+            print(f"{row[0]:12} {row[1]:>6} {row[2]} designs")
+    else:
+        rows = pin_database.pins_query(parsed_arguments.pin, parsed_arguments.signal,
+                                       parsed_arguments.label, parsed_arguments.footprint)
+        for row in rows:
+            project, mcu, board, footprint, position, name, signal, label = row
+            print(f"{project:20} {mcu:14} {board:16} {footprint:10} {position:>6} "
+                  f"{name:6} {signal:20} {label}")
+    pin_database.close()
+    return 0 if len(rows) > 0 else 1
@@ -0,0 +1,465 @@
+# This file is licensed using the "MIT License" below:
+#
+# ##################################################################################################
+#
+# MIT License
+#
+# Copyright 2019-2020 Home Brew Robotics Club
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies
+# or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# ##################################################################################################
+# <======================================= 100 characters =======================================> #
+
+
+"""pinmux_solver: Check whether a set of peripherals fits on the connector pins of a Nucleo board.
+
+Usage: kicube32 pinmux CUBEMX_MCU_DIR BOARD|all REQUEST ... [--connector CN] [--exclude PINS]
+                       [--exclude-leds] [--mcu MCU] [--cubemx-cache INDEX.bin]
+
+Each REQUEST is KIND[:COUNT] (e.g. 'UART:3', 'SPI:2', 'CAN'), where KIND is one of the keys
+of KIND_PERIPHERALS.  The connector pins come from the Nucleo binding tables in *KiCube* and
+the signals that each pin can carry come from the STM32CubeMX index (see `cubemx_index`.)
+
+The search picks peripheral instances one request slot at a time (most constrained request
+first.)  The signals of the chosen instances are kept in a maximum bipartite matching against
+the allowed pins, so adding an instance is one augmenting path search per signal.  After each
+choice, every remaining request is checked to still have enough individually addable instances
+and the branch is pruned if not.  When there is no assignment, the deepest conflict found is
+reported: either a request without enough instances, or a set of signals that compete for
+fewer pins than there are signals.
+"""
+
+from typing import Dict, List, Optional, Set, Text, Tuple
+
+import argparse
+import re
+
+from kicube32.kicube32 import KiCube, NUCLEO144_MCUS, NUCLEO64_CPU_MAPPING
+from kicube32.cubemx_index import CubeMXIndex, cubemx_index_open
+
+# The peripherals that can satisfy each request kind and the signals that each one needs:
+KIND_PERIPHERALS: Dict[str, Tuple[str, ...]] = {
+    "CAN": ("CAN", "FDCAN"),
+    "I2C": ("I2C",),
+    "LPUART": ("LPUART",),
+    "SPI": ("SPI",),
+    "UART": ("USART", "UART", "LPUART"),
+    "USART": ("USART",),
+}
+PERIPHERAL_FUNCTIONS: Dict[str, Tuple[str, ...]] = {
+    "CAN": ("RX", "TX"),
+    "FDCAN": ("RX", "TX"),
+    "I2C": ("SCL", "SDA"),
+    "LPUART": ("TX", "RX"),
+    "SPI": ("SCK", "MISO", "MOSI"),
+    "UART": ("TX", "RX"),
+    "USART": ("TX", "RX"),
+}
+
+# The pins wired to the user LED's on each Nucleo board family:
+NUCLEO_LED_PINS: Dict[str, List[str]] = {
+    "NUCLEO144": ["PB0", "PB7", "PB14"],
+    "NUCLEO64": ["PA5"],
+}
+
+# An instance is (name, signals) (e.g. ("USART3", ["USART3_TX", "USART3_RX"])):
+PinmuxInstance = Tuple[str, List[str]]
+
+
+# nucleo_pins_get():
+def nucleo_pins_get(cpu_name: str) -> Tuple[str, Dict[str, int]]:
+    """Return the footprint and a pin name to connector position table of a Nucleo board.
+
+    The footprint is "" if *cpu_name* (e.g. "F767ZI") is not on a known Nucleo board.
+    """
+    footprint: str = ""
+    bindings: List[Tuple[int, str]] = KiCube.nucleo144_bindings_generate(cpu_name)
+    if len(bindings) > 0:
+        footprint = "NUCLEO144"
+    else:
+        # Prefer the GPIO side of the solder bridge selectable pins:
+        bindings = KiCube.nucleo64_bindings_generate(cpu_name, ["PC0", "PC1", "PH3"])
+        if len(bindings) > 0:
+            footprint = "NUCLEO64"
+    pin_positions: Dict[str, int] = {}
+    position: int
+    name: str
+    for position, name in bindings:
+        pin_name: str = name.split(":")[0]
+        if re.match(r"P[A-K]\d+$", pin_name):
+            pin_positions[pin_name] = position
+    return footprint, pin_positions
+
+
+# PinmuxSolver:
+class PinmuxSolver:
+    """Searches for peripheral instances whose signals fit on a set of allowed pins."""
+
+    # PinmuxSolver.__init__():
+    def __init__(self, signal_pins: Dict[str, List[str]], allowed_pins: List[str]) -> None:
+        """Initialize a PinmuxSolver.
+
+        The arguments are:
+        * *signal_pins*: A table of the pins that each signal of the MCU can be routed to.
+        * *allowed_pins*: The pins that may be used.
+        """
+        allowed: Set[str] = set(allowed_pins)
+        signal_candidates: Dict[str, List[str]] = {}
+        signal: str
+        pins: List[str]
+        for signal, pins in signal_pins.items():
+            candidates: List[str] = [pin for pin in pins if pin in allowed]
+            if len(candidates) > 0:
+                signal_candidates[signal] = candidates
+
+        self.conflict: str = ""
+        self.conflict_depth: int = -1
+        self.instances_table: Dict[str, List[PinmuxInstance]] = {}
+        self.pin_signals: Dict[str, str] = {}
+        self.signal_candidates: Dict[str, List[str]] = signal_candidates
+        self.signal_pins: Dict[str, str] = {}
+
+    # PinmuxSolver.augment():
+    def augment(self, signal: str, visited_pins: Set[str], visited_signals: Set[str]) -> bool:
+        """Try to route *signal* to a pin, moving other signals along an augmenting path."""
+        pinmux_solver: PinmuxSolver = self
+        pin_signals: Dict[str, str] = pinmux_solver.pin_signals
+        visited_signals.add(signal)
+        pin: str
+        for pin in pinmux_solver.signal_candidates[signal]:
+            if pin not in visited_pins:
+                visited_pins.add(pin)
+                if (pin not in pin_signals or
+                        pinmux_solver.augment(pin_signals[pin], visited_pins, visited_signals)):
+                    pin_signals[pin] = signal
+                    pinmux_solver.signal_pins[signal] = pin
+                    return True
+        return False
+
+    # PinmuxSolver.instance_add():
+    def instance_add(self, instance: PinmuxInstance, chosen: List[str]) -> bool:
+        """Add the signals of an instance to the matching, recording a conflict on failure.
+
+        The matching is left partially updated on failure; the caller restores it.
+        """
+        pinmux_solver: PinmuxSolver = self
+        name: str
+        signals: List[str]
+        name, signals = instance
+        signal: str
+        for signal in signals:
+            visited_pins: Set[str] = set()
+            visited_signals: Set[str] = set()
+            if not pinmux_solver.augment(signal, visited_pins, visited_signals):
+                # The visited signals can only reach the visited pins, which are one too few:
+                pinmux_solver.conflict_record(
+                    len(chosen),
+                    f"{name} does not fit with {', '.join(chosen) or 'nothing'}: signals "
+                    f"{', '.join(sorted(visited_signals))} compete for "
+                    f"{len(visited_pins)} pin(s) {', '.join(sorted(visited_pins))}")
+                return False
+        return True
+
+    # PinmuxSolver.conflict_record():
+    def conflict_record(self, depth: int, conflict: str) -> None:
+        """Remember *conflict* if it was found deeper in the search than the previous one."""
+        pinmux_solver: PinmuxSolver = self
+        if depth > pinmux_solver.conflict_depth:
+            pinmux_solver.conflict_depth = depth
+            pinmux_solver.conflict = conflict
+
+    # PinmuxSolver.instances_find():
+    def instances_find(self, kind: str) -> List[PinmuxInstance]:
+        """Return the instances of a request kind that fit on the allowed pins on their own."""
+        pinmux_solver: PinmuxSolver = self
+        instances_table: Dict[str, List[PinmuxInstance]] = pinmux_solver.instances_table
+        if kind in instances_table:
+            return instances_table[kind]
+
+        peripherals: Tuple[str, ...] = KIND_PERIPHERALS[kind]
+        numbers_table: Dict[Tuple[str, int], bool] = {}
+        signal: str
+        for signal in pinmux_solver.signal_candidates.keys():
+            match: Optional[re.Match] = re.match(r"(I2C|[A-Z]+)(\d+)_", signal)
+            if match is not None and match.group(1) in peripherals:
+                numbers_table[(match.group(1), int(match.group(2)))] = True
+
+        instances: List[PinmuxInstance] = []
+        peripheral: str
+        number: int
+        for peripheral, number in sorted(numbers_table.keys(),
+                                         key=lambda item: (peripherals.index(item[0]), item[1])):
+            signals: List[str] = [f"{peripheral}{number}_{function}"
+                                  for function in PERIPHERAL_FUNCTIONS[peripheral]]
+            if all(signal in pinmux_solver.signal_candidates for signal in signals):
+                instance: PinmuxInstance = (f"{peripheral}{number}", signals)
+                saved: Tuple[Dict[str, str], Dict[str, str]] = pinmux_solver.matching_save()
+                if pinmux_solver.instance_add(instance, []):
+                    instances.append(instance)
+                pinmux_solver.matching_restore(saved)
+        instances_table[kind] = instances
+        return instances
+
+    # PinmuxSolver.matching_restore():
+    def matching_restore(self, saved: Tuple[Dict[str, str], Dict[str, str]]) -> None:
+        """Restore a matching returned by *matching_save*."""
+        pinmux_solver: PinmuxSolver = self
+        pinmux_solver.pin_signals = dict(saved[0])
+        pinmux_solver.signal_pins = dict(saved[1])
+
+    # PinmuxSolver.matching_save():
+    def matching_save(self) -> Tuple[Dict[str, str], Dict[str, str]]:
+        """Return a copy of the current matching."""
+        pinmux_solver: PinmuxSolver = self
+        return dict(pinmux_solver.pin_signals), dict(pinmux_solver.signal_pins)
+
+    # PinmuxSolver.slots_fill():
+    def slots_fill(self, slots: List[str], slot_index: int, first: int,
+                   chosen: List[str]) -> bool:
+        """Fill the request slots from *slot_index* onward, returning True on success.
+
+        The arguments are:
+        * *slots*: The request kinds, one per instance, with equal kinds adjacent.
+        * *slot_index*: The first slot to fill.
+        * *first*: The first instance index to try (instances of a kind are chosen in order.)
+        * *chosen*: The names of the instances chosen so far (updated on success.)
+        """
+        pinmux_solver: PinmuxSolver = self
+        if slot_index >= len(slots):
+            return True
+        kind: str = slots[slot_index]
+        instances: List[PinmuxInstance] = pinmux_solver.instances_find(kind)
+        index: int
+        for index in range(first, len(instances)):
+            instance: PinmuxInstance = instances[index]
+            if instance[0] in chosen:
+                continue
+            saved: Tuple[Dict[str, str], Dict[str, str]] = pinmux_solver.matching_save()
+            if pinmux_solver.instance_add(instance, chosen):
+                chosen.append(instance[0])
+                next_index: int = slot_index + 1
+                next_first: int = (index + 1
+                                   if next_index < len(slots) and slots[next_index] == kind
+                                   else 0)
+                if (pinmux_solver.remaining_check(slots, next_index, chosen) and
+                        pinmux_solver.slots_fill(slots, next_index, next_first, chosen)):
+                    return True
+                chosen.pop()
+            pinmux_solver.matching_restore(saved)
+        return False
+
+    # PinmuxSolver.remaining_check():
+    def remaining_check(self, slots: List[str], slot_index: int, chosen: List[str]) -> bool:
+        """Return False if some unfilled request no longer has enough addable instances."""
+        pinmux_solver: PinmuxSolver = self
+        needed_table: Dict[str, int] = {}
+        kind: str
+        for kind in slots[slot_index:]:
+            needed_table[kind] = needed_table.get(kind, 0) + 1
+        needed: int
+        for kind, needed in needed_table.items():
+            addable: List[str] = []
+            instance: PinmuxInstance
+            for instance in pinmux_solver.instances_find(kind):
+                if instance[0] not in chosen:
+                    saved: Tuple[Dict[str, str], Dict[str, str]] = pinmux_solver.matching_save()
+                    if pinmux_solver.instance_add(instance, chosen):
+                        addable.append(instance[0])
+                    pinmux_solver.matching_restore(saved)
+                    if len(addable) >= needed:
+                        break
+            if len(addable) < needed:
+                pinmux_solver.conflict_record(
+                    len(chosen), f"{kind}: {needed} more needed after "
+                    f"{', '.join(chosen)}, but only {len(addable)} fit "
+                    f"({', '.join(addable) or 'none'})")
+                return False
+        return True
+
+    # PinmuxSolver.solve():
+    def solve(self, requests: List[Tuple[str, int]]) -> Optional[Dict[str, str]]:
+        """Return a signal to pin table satisfying *requests* or None.
+
+        *requests* is a list of (kind, count) pairs.  When None is returned, the conflict
+        that stopped the search is in the *conflict* attribute.
+        """
+        pinmux_solver: PinmuxSolver = self
+        pinmux_solver.conflict = ""
+        pinmux_solver.conflict_depth = -1
+        pinmux_solver.pin_signals = {}
+        pinmux_solver.signal_pins = {}
+
+        # Put the most constrained request kinds first:
+        counts_table: Dict[str, int] = {}
+        kind: str
+        count: int
+        for kind, count in requests:
+            counts_table[kind] = counts_table.get(kind, 0) + count
+        for kind, count in counts_table.items():
+            instances: List[PinmuxInstance] = pinmux_solver.instances_find(kind)
+            if len(instances) < count:
+                pinmux_solver.conflict = (
+                    f"{kind}: {count} requested, but only {len(instances)} fit on the allowed "
+                    f"pins ({', '.join(instance[0] for instance in instances) or 'none'})")
+                return None
+        kinds: List[str] = sorted(
+            counts_table.keys(),
+            key=lambda kind: (len(pinmux_solver.instances_find(kind)) - counts_table[kind],
+                              kind))
+        slots: List[str] = [kind for kind in kinds for _ in range(counts_table[kind])]
+
+        chosen: List[str] = []
+        if not pinmux_solver.slots_fill(slots, 0, 0, chosen):
+            return None
+        return {signal: pin for signal, pin in sorted(pinmux_solver.signal_pins.items())}
+
+
+# requests_parse():
+def requests_parse(texts: List[str]) -> List[Tuple[str, int]]:
+    """Parse 'KIND[:COUNT]' requests into (kind, count) pairs or raise ValueError."""
+    requests: List[Tuple[str, int]] = []
+    text: str
+    for text in texts:
+        kind: str = text.split(":")[0].upper()
+        count_text: str = text.split(":")[1] if ":" in text else "1"
+        if kind not in KIND_PERIPHERALS or not count_text.isdigit():
+            raise ValueError(f"Bad request '{text}' (expected KIND[:COUNT] where KIND is "
+                             f"one of {', '.join(sorted(KIND_PERIPHERALS.keys()))})")
+        requests.append((kind, int(count_text)))
+    return requests
+
+
+# board_solve():
+def board_solve(cubemx_index: CubeMXIndex, cpu_name: str, mcu_name: str,
+                requests: List[Tuple[str, int]], connectors: List[str], excludes: List[str],
+                exclude_leds: bool, tracing: Text = "") -> Tuple[str, str, Dict[str, str]]:
+    """Solve the requests on one Nucleo board.
+
+    The result is (status, conflict, assignment) where status is "feasible", "infeasible" or
+    "skipped" (no board or MCU data), and the assignment is a signal to connector pin table
+    (e.g. {"USART3_TX": "PD8 CN12-10"}.)
+    """
+    footprint: str
+    pin_positions: Dict[str, int]
+    footprint, pin_positions = nucleo_pins_get(cpu_name)
+    if footprint == "":
+        return "skipped", f"'{cpu_name}' is not on a known Nucleo board", {}
+    if mcu_name == "":
+        mcu_names: List[str] = [name for name in cubemx_index.mcu_names()
+                                if name.startswith(f"STM32{cpu_name}")]
+        mcu_name = mcu_names[0] if len(mcu_names) > 0 else f"STM32{cpu_name}"
+    signal_pins: Dict[str, List[str]] = cubemx_index.signal_pins(mcu_name)
+    if len(signal_pins) == 0:
+        return "skipped", f"MCU '{mcu_name}' is not in the CubeMX index", {}
+
+    excluded: Set[str] = set(excludes)
+    if exclude_leds:
+        excluded |= set(NUCLEO_LED_PINS[footprint])
+    allowed_pins: List[str] = [
+        pin for pin, position in pin_positions.items()
+        if pin not in excluded and (len(connectors) == 0 or f"CN{position // 100}" in connectors)]
+    if tracing:
+        print(f"{tracing}{mcu_name}: {len(allowed_pins)} allowed pins")
+
+    pinmux_solver: PinmuxSolver = PinmuxSolver(signal_pins, allowed_pins)
+    assignment: Optional[Dict[str, str]] = pinmux_solver.solve(requests)
+    if assignment is None:
+        return "infeasible", pinmux_solver.conflict, {}
+    connector_pins: Dict[str, str] = {}
+    signal: str
+    pin: str
+    for signal, pin in assignment.items():
+        position: int = pin_positions[pin]
+        connector_pins[signal] = f"{pin} CN{position // 100}-{position % 100}"
+    return "feasible", "", connector_pins
+
+
+# pinmux_main():
+def pinmux_main(arguments: List[str]) -> int:
+    """Check whether peripherals fit on Nucleo connector pins and show an assignment."""
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="kicube32 pinmux",
+        description="Find a pin assignment for peripherals on Nucleo connector pins.")
+    parser.add_argument("mcu_directory", metavar="CUBEMX_MCU_DIR",
+                        help="STM32CubeMX 'db/mcu' directory")
+    parser.add_argument("board", metavar="BOARD",
+                        help="Nucleo board (e.g. 'NUCLEO-F767ZI') or 'all' for every board")
+    parser.add_argument("requests", metavar="REQUEST", nargs="+",
+                        help="KIND[:COUNT] (e.g. 'UART:3', 'SPI:2', 'CAN')")
+    parser.add_argument("--connector", action="append", default=[], metavar="CN",
+                        help="Only use pins on this connector (e.g. 'CN11'); may be repeated")
+    parser.add_argument("--exclude", action="append", default=[], metavar="PINS",
+                        help="Comma separated pins to avoid (e.g. 'PB0,PB7')")
+    parser.add_argument("--exclude-leds", action="store_true",
+                        help="Avoid the pins wired to the user LED's")
+    parser.add_argument("--mcu", default="",
+                        help="MCU name for a single board (default: from the index)")
+    parser.add_argument("--cubemx-cache", default="", metavar="INDEX.bin",
+                        help="Index file (default: in ~/.cache/kicube32)")
+    parsed_arguments: argparse.Namespace = parser.parse_args(arguments)
+
+    requests: List[Tuple[str, int]]
+    try:
+        requests = requests_parse(parsed_arguments.requests)
+    except ValueError as value_error:
+        print(value_error)
+        return 1
+    excludes: List[str] = [pin for text in parsed_arguments.exclude
+                           for pin in text.split(",") if pin]
+    cpu_names: List[str]
+    board: str = parsed_arguments.board
+    if board == "all" and parsed_arguments.mcu:
+        # Every board has a different MCU, so one MCU name can not apply to all of them:
+        print("--mcu can only be used with a single board, not 'all'")
+        return 1
+    elif board == "all":
+        cpu_names = NUCLEO144_MCUS + sorted(NUCLEO64_CPU_MAPPING.keys())
+    elif board.startswith("NUCLEO-"):
+        cpu_names = [board[7:]]
+    else:
+        print(f"Board '{board}' does not start with 'NUCLEO-'")
+        return 1
+
+    try:
+        cubemx_index: CubeMXIndex = cubemx_index_open(parsed_arguments.mcu_directory,
+                                                      parsed_arguments.cubemx_cache)
+    except OSError as error:
+        print(error)
+        return 1
+    feasible_count: int = 0
+    cpu_name: str
+    for cpu_name in cpu_names:
+        status: str
+        conflict: str
+        assignment: Dict[str, str]
+        status, conflict, assignment = board_solve(cubemx_index, cpu_name, parsed_arguments.mcu,
+                                                   requests, parsed_arguments.connector,
+                                                   excludes, parsed_arguments.exclude_leds)
+        if conflict:
+            print(f"NUCLEO-{cpu_name}: {status}: {conflict}")
+        else:
+            feasible_count += 1
+            print(f"NUCLEO-{cpu_name}: feasible")
+            if board != "all":
+                signal: str
+                connector_pin: str
+                for signal, connector_pin in assignment.items():
+                    print(f"  {signal:16} {connector_pin}")
+    cubemx_index.close()
+    return 0 if feasible_count > 0 else 1
@@ -0,0 +1,398 @@
+# This file is licensed using the "MIT License" below:
+#
+# ##################################################################################################
+#
+# MIT License
+#
+# Copyright 2019-2020 Home Brew Robotics Club
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies
+# or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# ##################################################################################################
+# <======================================= 100 characters =======================================> #
+
+
+"""regression_check: Check that reused snapshots and incremental updates match full regeneration.
+
+Usage: python -m kicube32.regression_check [--keep DIRECTORY] [--verbose]
+
+The `--snapshot` and `--incremental` shortcuts of `kicube32` (see `kicube32.kicube_snapshot` and
+`kicube32.incremental`) must produce exactly what a full regeneration produces, and that is
+easy to break without noticing.  This check builds two synthetic projects, a NUCLEO-F767ZI
+board (written for both the NUCLEO144 and the LQFP144 footprints) and a bare STM32F401RETx
+LQFP64 chip, and for each of them:
+
+1. Loads the freshly written snapshot and checks that it round trips: the same pins, the same
+   kipart rows for every footprint and the same diagnostics.
+2. Reruns `kicube32` unchanged, which must reuse the snapshot and leave the outputs alone.
+3. Applies a label change, kind changes into and out of the "MonoIO" unit and a `_label`
+   (active low) change to the `.csv` file one at a time.  After each one, the `--snapshot
+   --incremental` run must take the incremental path and its kipart files and JSON
+   diagnostics must be identical to those of a full regeneration of the same inputs in a
+   separate directory, and the snapshot it wrote must round trip as in step 1.
+
+The `kicube32` runs are separate processes that go through the same command line as users do.
+The exit code is 0 if every check passes.  With `--keep`, the projects are built in
+DIRECTORY (which must not exist yet) and left there for inspection.
+"""
+
+from typing import Any, Dict, IO, List, Optional, Text, Tuple
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from kicube32.kicube32 import FootprintBinding, IOC, KiCube
+from kicube32.kicube_snapshot import snapshot_load
+
+# A `.csv` row is (kind, signal, label) by pin name, and a project is (base name, `.ioc`
+# lines, pin names in position order, footprints after the default one):
+Row = Tuple[str, str, str]
+Project = Tuple[str, List[str], List[str], List[str]]
+
+# The signals that are cycled through the I/O pins, including one that is not recognized:
+SIGNALS: Tuple[str, ...] = ("", "GPIO_Output", "USART3_TX", "SPI1_SCK", "ADC1_IN3", "TIM2_CH1",
+                            "I2C1_SDA", "GPIO_Input", "FOO_BAR", "", "GPIO_EXTI13")
+
+
+# gpio_names():
+def gpio_names(ports: str, count: int) -> List[str]:
+    """Return the GPIO pin names (e.g. 'PA0') of some ports with *count* pins each."""
+    return [f"P{port}{number}" for port in ports for number in range(count)]
+
+
+# projects_build():
+def projects_build() -> List[Project]:
+    """Return the synthetic projects."""
+    nucleo144_names: List[str] = (
+        gpio_names("ABCDEFG", 16) +
+        ["VDD"] * 10 + ["VSS"] * 10 + ["VBAT", "VDDA", "VSSA", "VREF+", "NRST", "BOOT0"])
+    nucleo144_ioc_lines: List[str] = [
+        "Mcu.Name=STM32F767ZITx", "Mcu.Package=LQFP144", "board=NUCLEO-F767ZI"]
+    bare_names: List[str] = (gpio_names("ABC", 16) + ["PD2", "PH0", "PH1"] +
+                             ["VDD"] * 4 + ["VSS"] * 3 + ["VBAT", "VDDA", "VSSA", "VCAP1",
+                                                          "NRST", "BOOT0"])
+    bare_ioc_lines: List[str] = ["Mcu.Name=STM32F401RETx", "Mcu.Package=LQFP64"]
+    return [("nucleo144", nucleo144_ioc_lines, nucleo144_names, ["LQFP144"]),
+            ("bare", bare_ioc_lines, bare_names, [])]
+
+
+# rows_build():
+def rows_build(names: List[str]) -> List[Row]:
+    """Return the initial `.csv` rows of the pins of a project."""
+    rows: List[Row] = []
+    index: int
+    name: str
+    for index, name in enumerate(names):
+        kind: str = "I/O"
+        signal: str = ""
+        label: str = ""
+        if name in ("NRST",):
+            kind = "Reset"
+        elif name == "BOOT0":
+            kind = "Boot"
+        elif not (name.startswith('P') and name[2:].isdigit()):
+            kind = "Power"
+        elif index % 9 == 4:
+            # "MonoIO" pins go into a unit of their own:
+            kind = "MonoIO"
+        else:
+            signal = SIGNALS[index % len(SIGNALS)]
+            if signal == "GPIO_EXTI13":
+                signal = f"GPIO_EXTI{name[2:]}"
+            label = f"NET{index}" if index % 5 == 0 and signal else ""
+        rows.append((kind, signal, label))
+    return rows
+
+
+# edits_build():
+def edits_build(names: List[str], rows: List[Row]) -> List[Tuple[str, int, Row]]:
+    """Return the (name, row index, new row) `.csv` edits that are applied to a project in turn.
+
+    The pins are picked from the initial *rows* so that every edit changes the kipart rows: a
+    label change renames a pin, the kind changes move a pin into and out of the "MonoIO" unit
+    (the latter has to be re-sorted into its port unit) and a `_label` change makes a pin
+    active low.
+    """
+    signal_indices: List[int] = [index for index, row in enumerate(rows)
+                                 if row[0] == "I/O" and row[1] and not row[2]]
+    mono_index: int = [index for index, row in enumerate(rows) if row[0] == "MonoIO"][0]
+    label_index: int = signal_indices[0]
+    kind_index: int = signal_indices[1]
+    active_low_index: int = signal_indices[-1]
+    return [
+        (f"label change on {names[label_index]}", label_index,
+         rows[label_index][:2] + ("STATUS_LED",)),
+        (f"I/O to MonoIO kind change on {names[kind_index]}", kind_index,
+         ("MonoIO",) + rows[kind_index][1:]),
+        (f"MonoIO to I/O kind change on {names[mono_index]}", mono_index,
+         ("I/O", "GPIO_Output", "")),
+        (f"_label change on {names[active_low_index]}", active_low_index,
+         rows[active_low_index][:2] + ("_CHIP_SELECT",))]
+
+
+# project_write():
+def project_write(directory: str, project: Project, rows: List[Row], step: int) -> None:
+    """Write the `.ioc` and `.csv` files of a project into a directory.
+
+    The `.csv` file time stamp is set *step* seconds after the `.ioc` one, so that each
+    rewrite is newer than the last one and the `.csv` file is never stale.
+    """
+    base_name: str
+    ioc_lines: List[str]
+    names: List[str]
+    base_name, ioc_lines, names, _ = project
+    ioc_file_name: str = os.path.join(directory, base_name + ".ioc")
+    csv_file_name: str = os.path.join(directory, base_name + ".csv")
+    if not os.path.isfile(ioc_file_name):
+        ioc_file: IO[Any]
+        with open(ioc_file_name, "w") as ioc_file:
+            ioc_file.write("\n".join(ioc_lines) + "\n")
+        os.utime(ioc_file_name, (1.0e9, 1.0e9))
+    csv_lines: List[str] = ['"Position","Name","Type","Signal","Label"']
+    position: int
+    name: str
+    row: Row
+    for position, (name, row) in enumerate(zip(names, rows), start=1):
+        csv_lines.append(",".join([f'"{field}"' for field in (str(position), name) + row]))
+    csv_file: IO[Any]
+    with open(csv_file_name, "w") as csv_file:
+        csv_file.write("\n".join(csv_lines) + "\n")
+    os.utime(csv_file_name, (1.0e9 + step, 1.0e9 + step))
+
+
+# kicube32_run():
+def kicube32_run(directory: str, project: Project,
+                 snapshot: bool) -> Tuple[int, str, Dict[str, Any], Dict[str, str]]:
+    """Run `kicube32` on a project in a fresh process.
+
+    The (exit code, JSON diagnostics, metrics, kipart file contents by file name) are returned.
+    """
+    base_name: str = project[0]
+    footprints: List[str] = project[3]
+    arguments: List[str] = [base_name + ".ioc", base_name + ".csv", base_name + ".kipart.csv",
+                            "--json", "--metrics", "metrics.json"]
+    kipart_file_names: List[str] = [base_name + ".kipart.csv"]
+    footprint: str
+    for footprint in footprints:
+        kipart_file_name: str = f"{base_name}.{footprint.lower()}.kipart.csv"
+        arguments.append(f"--footprint={footprint}={kipart_file_name}")
+        kipart_file_names.append(kipart_file_name)
+    if snapshot:
+        arguments.extend(["--snapshot", base_name + ".kicube", "--incremental"])
+
+    # Run from *directory* with this copy of the package first on the module path:
+    package_directory: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environment: Dict[str, str] = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join(
+        [package_directory] + ([environment["PYTHONPATH"]] if "PYTHONPATH" in environment
+                               else []))
+    program: str = "import sys; from kicube32.kicube32 import main; sys.exit(main())"
+    completed: subprocess.CompletedProcess = subprocess.run(
+        [sys.executable, "-c", program] + arguments, cwd=directory, env=environment,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    assert completed.stderr == "", f"kicube32 {' '.join(arguments)} failed:\n{completed.stderr}"
+
+    metrics_file: IO[Any]
+    with open(os.path.join(directory, "metrics.json")) as metrics_file:
+        metrics: Dict[str, Any] = json.load(metrics_file)
+    kipart_texts: Dict[str, str] = {}
+    for kipart_file_name in kipart_file_names:
+        kipart_file: IO[Any]
+        with open(os.path.join(directory, kipart_file_name)) as kipart_file:
+            kipart_texts[kipart_file_name] = kipart_file.read()
+    return completed.returncode, completed.stdout, metrics, kipart_texts
+
+
+# metrics_paths():
+def metrics_paths(metrics: Dict[str, Any]) -> Tuple[bool, bool]:
+    """Return whether a run hit the snapshot and whether it took the incremental path."""
+    snapshot_hit: bool = any([counter["name"] == "kicube32_cache_hits_total" and
+                              counter["labels"].get("cache") == "snapshot"
+                              for counter in metrics["counters"]])
+    incremental: bool = any([histogram["labels"].get("stage") == "incremental-classify"
+                             for histogram in metrics["histograms"]])
+    return snapshot_hit, incremental
+
+
+# snapshot_check():
+def snapshot_check(directory: str, project: Project, failures: List[str]) -> None:
+    """Check that the snapshot of a project reproduces the state it was written from."""
+    base_name: str = project[0]
+    snapshot_file: IO[Any]
+    with open(os.path.join(directory, base_name + ".kicube"), "rb") as snapshot_file:
+        snapshot_data: bytes = snapshot_file.read()
+    loaded: Optional[Tuple[KiCube, List[FootprintBinding]]] = snapshot_load(
+        snapshot_data, None, None)
+    if loaded is None:
+        failures.append(f"{base_name}: the snapshot can not be loaded")
+        return
+    kicube: KiCube = loaded[0]
+    footprint_bindings: List[FootprintBinding] = loaded[1]
+
+    # Classify the same inputs from scratch and compare:
+    ioc_file_name: str = os.path.join(directory, base_name + ".ioc")
+    ioc: IOC = IOC(ioc_file_name)
+    full_kicube: KiCube = KiCube(ioc_file_name, os.path.join(directory, base_name + ".csv"),
+                                 ioc.mcu_name, ioc.board_name, ioc.package)
+    if [vars(chip_pin) for chip_pin in kicube.chip_pins] != [
+      vars(chip_pin) for chip_pin in full_kicube.chip_pins]:
+        failures.append(f"{base_name}: the snapshot pins differ from a full classification")
+    footprint_binding: FootprintBinding
+    for footprint_binding in footprint_bindings:
+        full_binding: Optional[FootprintBinding] = full_kicube.binding_generate(
+            footprint_binding.footprint)
+        if full_binding is None or (footprint_binding.kipart_lines() !=
+                                    full_binding.kipart_lines()):
+            failures.append(f"{base_name}: the snapshot {footprint_binding.footprint} rows "
+                            "differ from a full regeneration")
+    if kicube.diagnostics.counts_table != full_kicube.diagnostics.counts_table:
+        failures.append(f"{base_name}: the snapshot diagnostics differ from a full "
+                        "classification")
+
+
+# project_check():
+def project_check(directory: str, project: Project, tracing: Text = "") -> List[str]:
+    """Run all of the checks on one project and return the failure messages."""
+    base_name: str = project[0]
+    names: List[str] = project[2]
+    incremental_directory: str = os.path.join(directory, base_name, "incremental")
+    full_directory: str = os.path.join(directory, base_name, "full")
+    os.makedirs(incremental_directory)
+    os.makedirs(full_directory)
+    failures: List[str] = []
+
+    # Write the snapshot and check that it round trips:
+    rows: List[Row] = rows_build(names)
+    step: int = 10
+    project_write(incremental_directory, project, rows, step)
+    result: int
+    diagnostics_text: str
+    metrics: Dict[str, Any]
+    kipart_texts: Dict[str, str]
+    result, diagnostics_text, metrics, kipart_texts = kicube32_run(
+        incremental_directory, project, snapshot=True)
+    snapshot_check(incremental_directory, project, failures)
+
+    # An unchanged rerun must reuse the snapshot and reproduce the same outputs:
+    rerun: Tuple[int, str, Dict[str, Any], Dict[str, str]] = kicube32_run(
+        incremental_directory, project, snapshot=True)
+    if not metrics_paths(rerun[2])[0]:
+        failures.append(f"{base_name}: an unchanged rerun did not reuse the snapshot")
+    if (rerun[0], rerun[1], rerun[3]) != (result, diagnostics_text, kipart_texts):
+        failures.append(f"{base_name}: an unchanged rerun changed the outputs")
+
+    # Apply each edit and compare the incremental update with a full regeneration:
+    previous_kipart_texts: Dict[str, str] = kipart_texts
+    edit_name: str
+    edit_index: int
+    edit_row: Row
+    for edit_name, edit_index, edit_row in edits_build(names, rows):
+        if tracing:
+            print(f"{tracing}{base_name}: {edit_name}")
+        rows[edit_index] = edit_row
+        step += 10
+        project_write(incremental_directory, project, rows, step)
+        project_write(full_directory, project, rows, step)
+        incremental_run: Tuple[int, str, Dict[str, Any], Dict[str, str]] = kicube32_run(
+            incremental_directory, project, snapshot=True)
+        full_run: Tuple[int, str, Dict[str, Any], Dict[str, str]] = kicube32_run(
+            full_directory, project, snapshot=False)
+        if not metrics_paths(incremental_run[2])[1]:
+            failures.append(f"{base_name}: the {edit_name} did not take the incremental path")
+        if incremental_run[0] != full_run[0]:
+            failures.append(f"{base_name}: the {edit_name} exit code differs "
+                            f"({incremental_run[0]} incremental, {full_run[0]} full)")
+        if incremental_run[1] != full_run[1]:
+            failures.append(f"{base_name}: the {edit_name} diagnostics differ")
+        kipart_file_name: str
+        for kipart_file_name, kipart_text in full_run[3].items():
+            if incremental_run[3].get(kipart_file_name) != kipart_text:
+                failures.append(f"{base_name}: the {edit_name} output '{kipart_file_name}' "
+                                "differs from a full regeneration")
+        if full_run[3] == previous_kipart_texts:
+            failures.append(f"{base_name}: the {edit_name} did not change any kipart file, "
+                            "so it checks nothing")
+        previous_kipart_texts = full_run[3]
+        snapshot_check(incremental_directory, project, failures)
+
+    # A hand edited kipart file must be rewritten rather than patched.  Mark every pin row
+    # and then undo all of the edits:
+    kipart_file_name = os.path.join(incremental_directory, base_name + ".kipart.csv")
+    kipart_file: IO[Any]
+    with open(kipart_file_name) as kipart_file:
+        kipart_lines: List[str] = kipart_file.readlines()
+    kipart_lines[2:-2] = [line.rstrip("\n") + " edited\n" for line in kipart_lines[2:-2]]
+    with open(kipart_file_name, "w") as kipart_file:
+        kipart_file.writelines(kipart_lines)
+    rows = rows_build(names)
+    step += 10
+    project_write(incremental_directory, project, rows, step)
+    project_write(full_directory, project, rows, step)
+    incremental_run = kicube32_run(incremental_directory, project, snapshot=True)
+    full_run = kicube32_run(full_directory, project, snapshot=False)
+    if incremental_run[3] != full_run[3]:
+        failures.append(f"{base_name}: a hand edited kipart file was patched instead of "
+                        "being rewritten")
+    return failures
+
+
+# regression_check_main():
+def regression_check_main(arguments: List[str]) -> int:
+    """Run the snapshot and incremental regression checks and return 1 if any fails."""
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="python -m kicube32.regression_check",
+        description="Check that snapshots and incremental updates match full regeneration.")
+    parser.add_argument("--keep", default="", metavar="DIRECTORY",
+                        help="Build the projects in DIRECTORY and keep them")
+    parser.add_argument("--verbose", action="store_true", help="Show each check")
+    parsed_arguments: argparse.Namespace = parser.parse_args(arguments)
+    tracing: Text = " " if parsed_arguments.verbose else ""
+
+    temporary_directory: Optional[tempfile.TemporaryDirectory] = None
+    directory: str = parsed_arguments.keep
+    if directory:
+        if os.path.exists(directory):
+            print(f"'{directory}' already exists")
+            return 1
+        os.makedirs(directory)
+    else:
+        temporary_directory = tempfile.TemporaryDirectory(prefix="kicube32-regression-")
+        directory = temporary_directory.name
+
+    failures: List[str] = []
+    try:
+        project: Project
+        for project in projects_build():
+            failures.extend(project_check(directory, project, tracing=tracing))
+    finally:
+        if temporary_directory is not None:
+            temporary_directory.cleanup()
+
+    failure: str
+    for failure in failures:
+        print(failure)
+    print(f"{len(failures)} regression check failures")
+    return 0 if len(failures) == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(regression_check_main(sys.argv[1:]))
@@ -0,0 +1,440 @@
+# This file is licensed using the "MIT License" below:
+#
+# ##################################################################################################
+#
+# MIT License
+#
+# Copyright 2019-2020 Home Brew Robotics Club
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies
+# or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# ##################################################################################################
+# <======================================= 100 characters =======================================> #
+
+"""schematic_library: Read, fix up, merge and write legacy KiCad `.lib` schematic libraries.
+
+Usage: kicube32 lib-merge [--jobs N] OUTPUT.lib INPUT.lib ...
+
+This code is only needed by the library sub-commands (`lib-merge`, `lib-diff`, `lib-index`,
+`lib-insert` ...), so it lives outside of `kicube32.kicube32` to keep the start up of the
+main `kicube32` command fast.  The classes are still available as
+`kicube32.kicube32.SchematicLibrary` and `kicube32.kicube32.SchematicSymbol`, which load this
+module on first use.
+"""
+
+from typing import Any, Dict, IO, List, Optional, Tuple
+
+import argparse
+import concurrent.futures
+import hashlib
+import os
+import stat
+
+
+# SchematicLibaray:
+class SchematicLibrary:
+    """Represents a KiCad schematic symbol library."""
+
+    # SchematicLibrary.__init__():
+    def __init__(self, file_name: str = "", text: Optional[str] = None) -> None:
+        """Initialize SchematicLibary object.
+
+        Args:
+            *library_file_name* (*str*):
+             The `.lib` file to open and read in.  An empty library is
+             created if *library_file_name* is empty.
+            *text* (*Optional*[*str*]):
+             The `.lib` file contents.  If provided, *library_file_name* is not read.
+
+        """
+        # Start with an empty *symbols_table*:
+        # schematic_library SchematicLibrary = self
+        symbols_table: Dict[str, SchematicSymbol] = dict()
+        self.file_name: str = file_name
+        self.symbols_table = symbols_table
+        if file_name == "":
+            return
+
+        # Verify argument types:
+        assert file_name.endswith(".lib")
+        # print("SchematicLibrary.__init__(*, '{0}')".format(file_name))
+
+        # Open *schematic_library_file_name* and break it into *lines*:
+        if text is None:
+            library_file: IO[Any]
+            with open(file_name, "r") as library_file:
+                text = library_file.read()
+        lines: List[str] = text.split('\n')
+
+        # Sweep through *lines* looking for first/last lines a schematic symbol definition:
+        def_line_index: int = -1
+        line: str
+        for line_index, line in enumerate(lines):
+            # print("[{0}]: '{1}'".format(line_index, line))
+            if line.startswith("DEF "):
+                # Found first line of schematic symbol definition:
+                def_line_index = line_index
+            elif line.startswith("ENDDEF"):
+                # Found last line of schematic symbol defintion:
+                assert def_line_index >= 0
+                symbol: SchematicSymbol = SchematicSymbol(lines[def_line_index:line_index + 1])
+                symbol_name: str = symbol.name
+                assert symbol not in symbols_table
+                symbols_table[symbol_name] = symbol
+                def_line_index = -1
+
+    # SchematicLibrary.insert():
+    def insert(self, schematic_symbol: "SchematicSymbol") -> None:
+        """Insert schematic symbol into a library."""
+        assert isinstance(schematic_symbol, SchematicSymbol)
+        schematic_library: SchematicLibrary = self
+        symbols_table: Dict[str, SchematicSymbol] = schematic_library.symbols_table
+        symbol_name: str = schematic_symbol.name
+        symbols_table[symbol_name] = schematic_symbol
+
+    # SchematicLibrary.fixup():
+    def fixup(self) -> None:
+        """Fixup a schematic library."""
+        schematic_library: SchematicLibrary = self
+        symbols_table: Dict[str, SchematicSymbol] = schematic_library.symbols_table
+        symbol: SchematicSymbol
+        for symbol in symbols_table.values():
+            symbol.fixup()
+
+    # SchematicLibrary.lookup():
+    def lookup(self, part_name) -> "SchematicSymbol":
+        """Lookup a schematic symbol by part name."""
+        schematic_library: SchematicLibrary = self
+        symbols_table: Dict[str, SchematicSymbol] = schematic_library.symbols_table
+        assert part_name in symbols_table
+        symbol: SchematicSymbol = symbols_table[part_name]
+        return symbol
+
+    # SchematicLibrary.write():
+    def write(self, lib_file_name: str) -> None:
+        """Write a schematic library out to a file.
+
+        The library is written to a temporary file that then replaces *lib_file_name*, so
+        readers never see a partially written library.
+        """
+        # print("SchematicLibrary.write('{0}')".format(lib_file_name))
+
+        # Create a sorted list of *symbols*:
+        schematic_library: SchematicLibrary = self
+        symbols_table: Dict[str, SchematicSymbol] = schematic_library.symbols_table
+        symbols: List[SchematicSymbol] = list(symbols_table.values())
+        symbol: SchematicSymbol
+        symbols.sort(key=lambda symbol: symbol.name)
+
+        # Open a temporary file next to *lib_file_name*.  A new file gets the mode a plain
+        # open would give it (0o666 less the umask); a replaced file keeps its mode:
+        existing_mode: Optional[int] = None
+        if os.path.exists(lib_file_name):
+            existing_mode = stat.S_IMODE(os.stat(lib_file_name).st_mode)
+        temporary_fd: int
+        temporary_file_name: str
+        while True:
+            temporary_file_name = f"{lib_file_name}.{os.urandom(6).hex()}.tmp"
+            try:
+                temporary_fd = os.open(temporary_file_name,
+                                       os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            except FileExistsError:
+                continue
+            break
+        try:
+            if existing_mode is not None:
+                os.fchmod(temporary_fd, existing_mode)
+            lib_file: IO[Any]
+            with os.fdopen(temporary_fd, "w") as lib_file:
+                # Write out the header:
+                lib_file.write("EESchema-LIBRARY Version 2.3\n")
+                lib_file.write("#encoding utf-8\n")
+
+                # Output all of the *symbols* in sorted order:
+                for symbol in symbols:
+                    symbol.write(lib_file)
+
+                # Terminate the library:
+                lib_file.write("#\n")
+                lib_file.write("#End Library\n")
+            os.replace(temporary_file_name, lib_file_name)
+        except BaseException:
+            if os.path.exists(temporary_file_name):
+                os.remove(temporary_file_name)
+            raise
+
+
+# schematic_library_load():
+def schematic_library_load(file_name: str) -> SchematicLibrary:
+    """Return the SchematicLibrary read from a `.lib` file.
+
+    The file can also be an archive member (e.g. 'libraries.zip!/f767zi.lib'.)
+    """
+    text: Optional[str] = None
+    if "!/" in file_name:
+        from kicube32.archive import text_read
+        text = text_read(file_name)[0]
+    return SchematicLibrary(file_name, text=text)
+
+
+# symbol_ranges_hash():
+def symbol_ranges_hash(file_name: str) -> List[Tuple[str, str, int, int]]:
+    """Return the (name, body hash, first line, end line) of each symbol in a `.lib` file.
+
+    The symbol lines are *lines*[first line:end line] of the file text split at new lines, and
+    the body hash is the *SchematicSymbol.body_hash*() of those lines.  This runs in the
+    *schematic_libraries_merge* worker processes, so that only these small tuples are sent
+    back to the parent rather than whole parsed libraries.
+    """
+    lines: List[str] = library_text_read(file_name).split('\n')
+    symbol_ranges: List[Tuple[str, str, int, int]] = []
+    def_line_index: int = -1
+    line_index: int
+    line: str
+    for line_index, line in enumerate(lines):
+        if line.startswith("DEF "):
+            def_line_index = line_index
+        elif line.startswith("ENDDEF"):
+            assert def_line_index >= 0, f"'{file_name}' line {line_index + 1}: ENDDEF without DEF"
+            first_line_fields: List[str] = lines[def_line_index].split()
+            assert len(first_line_fields) >= 2, f"'{file_name}' line {def_line_index + 1}"
+            symbol_ranges.append((first_line_fields[1],
+                                  lines_hash(lines[def_line_index:line_index + 1]),
+                                  def_line_index, line_index + 1))
+            def_line_index = -1
+    return symbol_ranges
+
+
+# library_text_read():
+def library_text_read(file_name: str) -> str:
+    """Return the text of a `.lib` file or archive member."""
+    if "!/" in file_name:
+        from kicube32.archive import text_read
+        return text_read(file_name)[0]
+    library_file: IO[Any]
+    with open(file_name, "r") as library_file:
+        return library_file.read()
+
+
+# schematic_libraries_merge():
+def schematic_libraries_merge(lib_file_names: List[str],
+                              jobs: int = 0) -> Tuple[SchematicLibrary, List[str]]:
+    """Read several libraries in parallel and merge them into one SchematicLibrary.
+
+    The arguments are:
+    * *lib_file_names* (List[str]): The `.lib` files to merge.  Earlier files take precedence.
+    * *jobs* (int): The number of hashing processes.  0 means use the CPU count.
+    The merged *SchematicLibrary* and a list of conflict messages is returned.  The worker
+    processes only return the symbol names, hashes and line ranges (see
+    *symbol_ranges_hash*()); the parent then re-reads the files that contribute symbols and
+    slices out their lines without parsing them again.
+    """
+    jobs = jobs if jobs > 0 else (os.cpu_count() or 1)
+    jobs = min(jobs, len(lib_file_names))
+    files_symbol_ranges: List[List[Tuple[str, str, int, int]]]
+    if jobs <= 1:
+        files_symbol_ranges = [symbol_ranges_hash(lib_file_name)
+                               for lib_file_name in lib_file_names]
+    else:
+        # Hashing is CPU bound, so use processes rather than threads:
+        executor: concurrent.futures.ProcessPoolExecutor
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            files_symbol_ranges = list(executor.map(symbol_ranges_hash, lib_file_names))
+
+    # Merge in order; the first file with a symbol name wins:
+    winners_table: Dict[str, Tuple[str, int, int, int]] = {}  # name => (hash, file, range)
+    conflicts: List[str] = []
+    file_index: int
+    symbol_ranges: List[Tuple[str, str, int, int]]
+    for file_index, symbol_ranges in enumerate(files_symbol_ranges):
+        symbol_name: str
+        body_hash: str
+        first_line_index: int
+        end_line_index: int
+        for symbol_name, body_hash, first_line_index, end_line_index in symbol_ranges:
+            if symbol_name not in winners_table:
+                winners_table[symbol_name] = (body_hash, file_index,
+                                              first_line_index, end_line_index)
+            elif winners_table[symbol_name][0] != body_hash:
+                conflicts.append(f"Symbol '{symbol_name}' in '{lib_file_names[file_index]}' "
+                                 "differs from the one in "
+                                 f"'{lib_file_names[winners_table[symbol_name][1]]}'")
+
+    # Slice the winning symbols out of the files they came from:
+    merged_library: SchematicLibrary = SchematicLibrary()
+    winning_file_indices: List[int] = sorted({winner[1] for winner in winners_table.values()})
+    for file_index in winning_file_indices:
+        lines: List[str] = library_text_read(lib_file_names[file_index]).split('\n')
+        for symbol_name, body_hash, first_line_index, end_line_index in (
+          files_symbol_ranges[file_index]):
+            if winners_table[symbol_name][1:] == (file_index, first_line_index, end_line_index):
+                merged_library.insert(SchematicSymbol(lines[first_line_index:end_line_index]))
+    return merged_library, conflicts
+
+
+# SchematicSymbol:
+class SchematicSymbol:
+    """Represents a schematic symbol."""
+
+    # SchematicSymbol.__init__():
+    def __init__(self, lines: List[str]) -> None:
+        """Initialize a SchematicSymbol."""
+        first_line: str = lines[0]
+        last_line: str = lines[-1]
+        assert first_line.startswith("DEF"), "first_line='{0}'".format(first_line)
+        assert last_line.startswith("ENDDEF"), "last_line='{0}'".format(last_line)
+        first_line_fields: List[str] = first_line.split()
+        assert len(first_line_fields) >= 2, "first_line='{0}'".format(first_line)
+        name: str = first_line_fields[1]
+
+        # schematic_symbol: SchematicSymbol = self
+        self.lines: List[str] = lines
+        self.name: str = name
+        self.symbol_body: Any = None  # The *SymbolBody* of *lines*; see *body*()
+        # print("second_space_index='{0}'".format(first_line))
+        # print("first_line='{0}'".format(first_line))
+        # print("Created Symbol '{0}'".format(name))
+
+    # SchematicSymbol.body_hash():
+    def body_hash(self) -> str:
+        """Return a hash of the normalized SchematicSymbol lines.
+
+        The lines are normalized by collapsing runs of white space and dropping blank lines,
+        so that symbols that differ only in formatting have the same hash.
+        """
+        schematic_symbol: SchematicSymbol = self
+        return lines_hash(schematic_symbol.lines)
+
+    # SchematicSymbol.body():
+    def body(self) -> Any:
+        """Return the SymbolBody of typed records for a SchematicSymbol.
+
+        The records are only parsed on first use.  The SymbolBody shares *lines* with the
+        SchematicSymbol, so edits made through it show up in *lines* (and hence *write*().)
+        """
+        schematic_symbol: SchematicSymbol = self
+        if schematic_symbol.symbol_body is None:
+            from kicube32.symbol_records import SymbolBody
+            schematic_symbol.symbol_body = SymbolBody(schematic_symbol.lines)
+        return schematic_symbol.symbol_body
+
+    # SchematicSymbol.pins():
+    def pins(self) -> List[Tuple[str, str, str, int]]:
+        """Return the (number, name, electrical type letter, unit) of each symbol pin."""
+        schematic_symbol: SchematicSymbol = self
+        return [(pin.number, pin.name, pin.electrical_type, pin.unit)
+                for pin in schematic_symbol.body().pins()]
+
+    # SchematicSymbol.fixup():
+    def fixup(self) -> None:
+        """Fix up a Sechemtaic symbol."""
+        from kicube32.symbol_records import FieldRecord, RectangleRecord
+        symbol: SchematicSymbol = self
+        symbol_body: Any = symbol.body()
+
+        # Insert the "F2 ..." and "F3 ..." records after the "F1 ..." record:
+        f1_index: int = symbol_body.field_index(1)
+        if f1_index >= 0:
+            f2_record: Any = FieldRecord(2, "", 0, 0, 50, "H", "I", "C", "CNN")
+            f3_record: Any = FieldRecord(3, "", 0, 0, 50, "H", "I", "C", "CNN")
+            symbol_body.record_insert(f1_index + 1, f2_record)
+            symbol_body.record_insert(f1_index + 2, f3_record)
+
+        # Sweep through the records performing minor tweaks:
+        index: int
+        record: Any
+        for index, record in enumerate(symbol_body.records):
+            new_record: Any = record
+            if isinstance(record, FieldRecord):
+                # Change reference label from U to N:
+                if record.number == 0 and record.text == "U":
+                    new_record = new_record._replace(text="N")
+
+                # Force font sizes from 60 down to 50:
+                if (record.size == 60 and record.orientation == "H" and
+                        record.visibility == "V" and record.h_justify == "L" and
+                        record.style == "CNN" and record.name == ""):
+                    new_record = new_record._replace(size=50)
+            elif isinstance(record, RectangleRecord) and record.fill == "N":
+                # Turn on background highlighting for rectangles:
+                new_record = record._replace(fill="f")
+
+            # Update any record that changed:
+            if new_record != record:
+                symbol_body.record_replace(index, new_record)
+
+    # SchematicSymbol.write():
+    def write(self, schematic_library_output_file: IO[Any]) -> None:
+        """Write a SechematicySymbol out to an open file."""
+        schematic_symbol: SchematicSymbol = self
+        schematic_library_output_file.write("#\n")
+        schematic_library_output_file.write("# {0}\n".format(schematic_symbol.name))
+        schematic_library_output_file.write("#\n")
+        schematic_library_output_file.write('\n'.join(schematic_symbol.lines))
+        schematic_library_output_file.write('\n')
+
+
+# lines_hash():
+def lines_hash(lines: List[str]) -> str:
+    """Return a hash of some `.lib` lines, ignoring white space differences and blank lines."""
+    hasher: Any = hashlib.sha256()
+    line: str
+    for line in lines:
+        normalized_line: str = ' '.join(line.split())
+        if normalized_line != "":
+            hasher.update(normalized_line.encode())
+            hasher.update(b'\n')
+    return hasher.hexdigest()
+
+
+# library_merge_main():
+def library_merge_main(arguments: List[str]) -> int:
+    """Merge several schematic libraries into one schematic library."""
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="kicube32 lib-merge", description="Merge KiCad .lib files into one .lib file.")
+    parser.add_argument("output_lib_file_name", metavar="OUTPUT.lib", help="Merged .lib file")
+    parser.add_argument("input_lib_file_names", metavar="INPUT.lib", nargs="+",
+                        help="Input .lib files (earlier files win name collisions)")
+    parser.add_argument("--jobs", type=int, default=0,
+                        help="Number of parallel hashing processes (default: CPU count)")
+    parsed_arguments: argparse.Namespace = parser.parse_args(arguments)
+    output_lib_file_name: str = parsed_arguments.output_lib_file_name
+    input_lib_file_names: List[str] = parsed_arguments.input_lib_file_names
+
+    result: int = 1
+    if not all([lib_file_name.endswith(".lib")
+                for lib_file_name in [output_lib_file_name] + input_lib_file_names]):
+        print("All library file names must end in '.lib'.")
+    else:
+        merged_library: SchematicLibrary
+        conflicts: List[str]
+        try:
+            merged_library, conflicts = schematic_libraries_merge(input_lib_file_names,
+                                                                  parsed_arguments.jobs)
+        except OSError as error:
+            print(error)
+            return result
+        conflict: str
+        for conflict in conflicts:
+            print(conflict)
+        if len(conflicts) == 0:
+            merged_library.write(output_lib_file_name)
+            result = 0
+        else:
+            print(f"'{output_lib_file_name}' was not written.")
+    return result
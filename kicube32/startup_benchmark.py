@@ -0,0 +1,182 @@
+# This file is licensed using the "MIT License" below:
+#
+# ##################################################################################################
+#
+# MIT License
+#
+# Copyright 2019-2020 Home Brew Robotics Club
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies
+# or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# ##################################################################################################
+# <======================================= 100 characters =======================================> #
+
+
+"""startup_benchmark: Fail if the start up of the `kicube32` and `kidocgen` commands regresses.
+
+Usage: python -m kicube32.startup_benchmark [--baseline FILE.json [--record] [--tolerance PCT]]
+                                            [--budget-ms MS] [--runs N]
+
+`kicube32` and `kidocgen` are run many times per build by Makefiles (once per part), so their
+start up time matters more than their run time.  Each console script module is imported in
+*runs* fresh interpreters with `python -X importtime` and the fastest cumulative import time
+is reported.  The benchmark fails if a module that is only needed by the rarely used
+sub-commands (e.g. the schematic library code, `sqlite3` or `concurrent.futures`) gets
+imported by the main path, since that is the usual way that start up time creeps back.
+
+Import times depend heavily on the machine, so there are no built in time limits.  With
+`--baseline FILE.json --record`, the times measured on this machine are saved; later runs with
+`--baseline FILE.json` fail if a script got more than *tolerance* percent slower.  `--budget-ms`
+sets an absolute limit instead.  The package is byte compiled first so that `.py` compilation
+(e.g. with PYTHONDONTWRITEBYTECODE set) is not measured.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import argparse
+import compileall
+import json
+import os
+import subprocess
+import sys
+
+# The console script modules that are measured:
+STARTUP_MODULES: Tuple[str, ...] = ("kicube32.kicube32", "kidocgen.kidocgen")
+
+# The modules that each console script module must not import up front:
+LAZY_MODULES: Dict[str, Tuple[str, ...]] = {
+    "kicube32.kicube32": (
+        "asyncio",
+        "concurrent.futures",
+        "hashlib",
+        "kicube32.batch",
+        "kicube32.cubemx_index",
+        "kicube32.incremental",
+        "kicube32.kicube_snapshot",
+        "kicube32.pin_database",
+        "kicube32.schematic_library",
+        "kicube32.symbol_records",
+        "sqlite3",
+    ),
+    "kidocgen.kidocgen": (
+        "asyncio",
+        "concurrent.futures",
+        "kicube32.kicube32",
+        "kicube32.schematic_library",
+        "sqlite3",
+    ),
+}
+
+
+# import_measure():
+def import_measure(module_name: str) -> Tuple[float, List[str]]:
+    """Return the cumulative import time (in ms) of a module and the modules it imported.
+
+    The module is imported in a fresh interpreter.
+    """
+    program: str = f"import sys, {module_name}; print(' '.join(sorted(sys.modules)))"
+    completed: subprocess.CompletedProcess = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", program],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    import_time: Optional[float] = None
+    line: str
+    for line in completed.stderr.splitlines():
+        # Lines look like 'import time:  self [us] | cumulative | imported package':
+        fields: List[str] = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module_name:
+            import_time = int(fields[1]) / 1000.0
+    assert import_time is not None, f"No import time for '{module_name}'"
+    return import_time, completed.stdout.split()
+
+
+# startup_benchmark_main():
+def startup_benchmark_main(arguments: List[str]) -> int:
+    """Measure the console script start up times and return 1 if any check fails."""
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="python -m kicube32.startup_benchmark",
+        description="Check the import time of the kicube32 and kidocgen console scripts.")
+    parser.add_argument("--baseline", default="", metavar="FILE.json",
+                        help="Compare against (or with --record, save) times from this machine")
+    parser.add_argument("--record", action="store_true",
+                        help="Save the measured times in the --baseline file")
+    parser.add_argument("--tolerance", type=float, default=25.0, metavar="PCT",
+                        help="Allowed slow down from the baseline in percent (default: 25)")
+    parser.add_argument("--budget-ms", type=float, default=0.0, metavar="MS",
+                        help="Absolute start up budget in milliseconds (default: none)")
+    parser.add_argument("--runs", type=int, default=7,
+                        help="Number of interpreters to start per script (default: 7)")
+    parsed_arguments: argparse.Namespace = parser.parse_args(arguments)
+    if parsed_arguments.record and not parsed_arguments.baseline:
+        print("--record requires --baseline")
+        return 1
+    baseline: Dict[str, float] = {}
+    if parsed_arguments.baseline and not parsed_arguments.record:
+        if not os.path.isfile(parsed_arguments.baseline):
+            print(f"No baseline '{parsed_arguments.baseline}'; create it with --record")
+            return 1
+        with open(parsed_arguments.baseline, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+
+    # Byte compile the packages so that only the import itself is measured:
+    package_directory: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    package_name: str
+    for package_name in ("kicube32", "kidocgen"):
+        compileall.compile_dir(os.path.join(package_directory, package_name), quiet=1)
+
+    result: int = 0
+    import_times: Dict[str, float] = {}
+    module_name: str
+    for module_name in STARTUP_MODULES:
+        measurements: List[Tuple[float, List[str]]] = [
+            import_measure(module_name) for run in range(max(1, parsed_arguments.runs))]
+        import_time: float = min([measurement[0] for measurement in measurements])
+        import_times[module_name] = import_time
+        imported_modules: List[str] = measurements[0][1]
+        eager_modules: List[str] = [lazy_module for lazy_module in LAZY_MODULES[module_name]
+                                    if lazy_module in imported_modules]
+
+        # Compare against the absolute *budget* and the *baseline* time, if any:
+        limits: List[str] = []
+        failed: bool = len(eager_modules) > 0
+        budget: float = parsed_arguments.budget_ms
+        if budget > 0.0:
+            limits.append(f"budget {budget:.1f}ms")
+            failed |= import_time > budget
+        baseline_time: Optional[float] = baseline.get(module_name)
+        if baseline_time is not None:
+            limit: float = baseline_time * (1.0 + parsed_arguments.tolerance / 100.0)
+            limits.append(f"baseline {baseline_time:.1f}ms, limit {limit:.1f}ms")
+            failed |= import_time > limit
+        if failed:
+            result = 1
+        print(f"{module_name}: {import_time:.1f}ms" +
+              (f" ({'; '.join(limits)})" if limits else "") +
+              (" FAILED" if failed else " ok"))
+        if len(eager_modules) > 0:
+            print(f"  Imports {eager_modules} at start up; import them where they are used")
+
+    if parsed_arguments.record:
+        with open(parsed_arguments.baseline, "w") as baseline_file:
+            json.dump(import_times, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write("\n")
+        print(f"Saved the start up times in '{parsed_arguments.baseline}'")
+    return result
+
+
+if __name__ == "__main__":
+    sys.exit(startup_benchmark_main(sys.argv[1:]))
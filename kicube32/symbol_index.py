@@ -0,0 +1,361 @@
+# This file is licensed using the "MIT License" below:
+#
+# ##################################################################################################
+#
+# MIT License
+#
+# Copyright 2019-2020 Home Brew Robotics Club
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies
+# or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# ##################################################################################################
+# <======================================= 100 characters =======================================> #
+
+
+"""symbol_index: A persistent search index of the symbols and pins in KiCad schematic libraries.
+
+Usage: kicube32 lib-index INDEX.db INPUT.lib ...  # Add/update libraries in INDEX.db
+       kicube32 lib-query INDEX.db [--symbol S] [--pin P] [--number N] [--type T] [--signal S]
+
+The index is an SQLite database.  A library is only re-read when its modification time or size
+has changed since it was last indexed.  Query values are SQLite GLOB patterns (e.g. 'PA*'), so
+exact values and prefix patterns can use the database indices.  The index is marked with its
+own SQLite `application_id`, and any other database (e.g. a `--pins-db` file) is refused rather
+than modified.
+"""
+
+from typing import Any, Dict, List, Optional, Text, Tuple
+
+import argparse
+import os
+import sqlite3
+
+from kicube32.archive import archive_split, text_read
+from kicube32.schematic_library import SchematicLibrary, SchematicSymbol
+
+# The SQLite `application_id` that marks a file as a symbol index ('KCSI'):
+APPLICATION_ID: int = 0x4B435349
+
+# Bump *SCHEMA_VERSION* whenever the tables below change; old indices are then rebuilt by
+# `lib-index` (the index only holds data derived from the libraries):
+SCHEMA_VERSION: int = 2
+SCHEMA: str = """
+CREATE TABLE libraries (
+    id INTEGER PRIMARY KEY,
+    file_name TEXT UNIQUE NOT NULL,
+    modification_time REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE symbols (
+    id INTEGER PRIMARY KEY,
+    library_id INTEGER NOT NULL REFERENCES libraries(id) ON DELETE CASCADE,
+    name TEXT NOT NULL
+);
+CREATE TABLE pins (
+    symbol_id INTEGER NOT NULL REFERENCES symbols(id) ON DELETE CASCADE,
+    number TEXT NOT NULL,
+    name TEXT NOT NULL,
+    base_name TEXT NOT NULL,
+    signal TEXT NOT NULL,
+    electrical_type TEXT NOT NULL,
+    unit INTEGER NOT NULL
+);
+CREATE INDEX symbols_library_id ON symbols(library_id);
+CREATE INDEX symbols_name ON symbols(name);
+CREATE INDEX pins_symbol_id ON pins(symbol_id);
+CREATE INDEX pins_number ON pins(number);
+CREATE INDEX pins_name ON pins(name);
+CREATE INDEX pins_base_name ON pins(base_name);
+CREATE INDEX pins_signal ON pins(signal);
+CREATE INDEX pins_electrical_type ON pins(electrical_type);
+"""
+
+# Map the KiCad pin electrical type letters to the kipart type names:
+ELECTRICAL_TYPES: Dict[str, str] = {
+    "I": "input",
+    "O": "output",
+    "B": "bidirectional",
+    "T": "tristate",
+    "P": "passive",
+    "U": "unspecified",
+    "W": "power_in",
+    "w": "power_out",
+    "C": "open_collector",
+    "E": "open_emitter",
+    "N": "no_connect",
+}
+
+
+# pin_name_split():
+def pin_name_split(name: str) -> Tuple[str, str]:
+    """Split a kicube32 style pin name into a base name and a signal.
+
+    A name like '~PA5(SPI1_SCK)*' is split into ('PA5', 'SPI1_SCK').  The leading
+    inversion '~' and trailing '*' are dropped.  Names without parentheses return
+    an empty signal.
+    """
+    name = name.lstrip('~').rstrip('*')
+    open_index: int = name.find('(')
+    base_name: str = name
+    signal: str = ""
+    if open_index > 0 and name.endswith(')'):
+        base_name = name[:open_index]
+        signal = name[open_index + 1:-1]
+    return base_name, signal
+
+
+# SymbolIndex:
+class SymbolIndex:
+    """Represents an SQLite index of the symbols and pins in schematic libraries."""
+
+    # SymbolIndex.__init__():
+    def __init__(self, database_file_name: str, create: bool = True) -> None:
+        """Open (or create) a SymbolIndex database.
+
+        If *create* is *False* (e.g. for queries), an empty database or an index with an
+        older schema is not (re)built.  A ValueError is raised if *database_file_name* is
+        not a usable symbol index; other databases are never modified.
+        """
+        connection: sqlite3.Connection = sqlite3.connect(database_file_name)
+        try:
+            application_id: int = connection.execute("PRAGMA application_id").fetchone()[0]
+            schema_version: int = connection.execute("PRAGMA user_version").fetchone()[0]
+            tables_count: int = connection.execute(
+                "SELECT count(*) FROM sqlite_master").fetchone()[0]
+        except sqlite3.DatabaseError as error:
+            connection.close()
+            raise ValueError(f"'{database_file_name}' is not a symbol index ({error})")
+        problem: str = ""
+        if application_id == 0 and tables_count == 0:
+            problem = "is empty"
+        elif application_id != APPLICATION_ID:
+            connection.close()
+            raise ValueError(f"'{database_file_name}' is not a symbol index; "
+                             "delete it or use a different file name")
+        elif schema_version != SCHEMA_VERSION:
+            problem = f"has schema version {schema_version} (expected {SCHEMA_VERSION})"
+        if problem and not create:
+            connection.close()
+            raise ValueError(f"Symbol index '{database_file_name}' {problem}; "
+                             "run 'kicube32 lib-index' to rebuild it")
+        if problem:
+            # Start over with an empty index:
+            table_name: str
+            for table_name in ("pins", "symbols", "libraries"):
+                connection.execute(f"DROP TABLE IF EXISTS {table_name}")
+            connection.executescript(SCHEMA)
+            connection.execute(f"PRAGMA application_id = {APPLICATION_ID}")
+            connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            connection.commit()
+        connection.execute("PRAGMA foreign_keys = ON")
+
+        # symbol_index: SymbolIndex = self
+        self.connection: sqlite3.Connection = connection
+        self.database_file_name: str = database_file_name
+
+    # SymbolIndex.close():
+    def close(self) -> None:
+        """Close a SymbolIndex database."""
+        symbol_index: SymbolIndex = self
+        symbol_index.connection.close()
+
+    # SymbolIndex.library_update():
+    def library_update(self, lib_file_name: str, tracing: Text = "") -> bool:
+        """Add or update one library in the SymbolIndex.
+
+        The library is only read if its modification time or size differ from the
+        indexed values.  *True* is returned if the library was (re)indexed.
+        """
+        symbol_index: SymbolIndex = self
+        connection: sqlite3.Connection = symbol_index.connection
+        lib_file_name = os.path.abspath(lib_file_name)
+        text: Optional[str] = None
+        modification_time: float
+        size: int
+        if "!/" in lib_file_name:
+            # Archive members are read to find their time stamp and size:
+            text, modification_time = text_read(lib_file_name)
+            size = len(text)
+        else:
+            modification_time = os.path.getmtime(lib_file_name)
+            size = os.path.getsize(lib_file_name)
+        row: Optional[Tuple[Any, ...]] = connection.execute(
+            "SELECT id, modification_time, size FROM libraries WHERE file_name = ?",
+            (lib_file_name,)).fetchone()
+        if row is not None and row[1] == modification_time and row[2] == size:
+            if tracing:
+                print(f"{tracing}'{lib_file_name}' is unchanged")
+            return False
+
+        # Read the library before touching the database:
+        schematic_library: SchematicLibrary = SchematicLibrary(lib_file_name, text=text)
+        with connection:
+            if row is not None:
+                connection.execute("DELETE FROM libraries WHERE id = ?", (row[0],))
+            library_id: Optional[int] = connection.execute(
+                "INSERT INTO libraries (file_name, modification_time, size) VALUES (?, ?, ?)",
+                (lib_file_name, modification_time, size)).lastrowid
+            symbol: SchematicSymbol
+            for symbol in schematic_library.symbols_table.values():
+                symbol_id: Optional[int] = connection.execute(
+                    "INSERT INTO symbols (library_id, name) VALUES (?, ?)",
+                    (library_id, symbol.name)).lastrowid
+                connection.executemany(
+                    "INSERT INTO pins (symbol_id, number, name, base_name, signal, "
+                    "electrical_type, unit) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(symbol_id,) + pin for pin in symbol_index.pins_extract(symbol)])
+        if tracing:
+            print(f"{tracing}Indexed {len(schematic_library.symbols_table)} symbols "
+                  f"from '{lib_file_name}'")
+        return True
+
+    # SymbolIndex.pins_extract():
+    def pins_extract(self, symbol: SchematicSymbol) -> List[Tuple[str, str, str, str, str, int]]:
+        """Return the (number, name, base_name, signal, type, unit) of each symbol pin."""
+        pins: List[Tuple[str, str, str, str, str, int]] = []
+        number: str
+        name: str
+        type_letter: str
+        unit: int
+        for number, name, type_letter, unit in symbol.pins():
+            base_name: str
+            signal: str
+            base_name, signal = pin_name_split(name)
+            electrical_type: str = ELECTRICAL_TYPES.get(type_letter, type_letter)
+            pins.append((number, name, base_name, signal, electrical_type, unit))
+        return pins
+
+    # SymbolIndex.prune():
+    def prune(self) -> List[str]:
+        """Remove the libraries whose files (or archives) no longer exist.
+
+        The removed library file names are returned.
+        """
+        symbol_index: SymbolIndex = self
+        connection: sqlite3.Connection = symbol_index.connection
+        pruned_file_names: List[str] = []
+        library_id: int
+        file_name: str
+        for library_id, file_name in connection.execute(
+          "SELECT id, file_name FROM libraries").fetchall():
+            archive_file_name: str = archive_split(file_name)[0]
+            if not os.path.isfile(archive_file_name or file_name):
+                pruned_file_names.append(file_name)
+                with connection:
+                    connection.execute("DELETE FROM libraries WHERE id = ?", (library_id,))
+        return pruned_file_names
+
+    # SymbolIndex.pins_query():
+    def pins_query(self, symbol: str = "", pin: str = "", number: str = "",
+                   electrical_type: str = "", signal: str = "") -> List[Tuple[Any, ...]]:
+        """Return the pins that match all of the non-empty GLOB patterns.
+
+        The *pin* pattern matches either the full pin name or its base name (e.g. 'PA5'.)
+        Each returned row is (library file name, symbol name, number, name, type, unit).
+        """
+        symbol_index: SymbolIndex = self
+        conditions: List[str] = []
+        values: List[str] = []
+        if symbol:
+            conditions.append("symbols.name GLOB ?")
+            values.append(symbol)
+        if pin:
+            conditions.append("(pins.base_name GLOB ? OR pins.name GLOB ?)")
+            values.extend([pin, pin])
+        if number:
+            conditions.append("pins.number GLOB ?")
+            values.append(number)
+        if electrical_type:
+            conditions.append("pins.electrical_type GLOB ?")
+            values.append(electrical_type)
+        if signal:
+            conditions.append("pins.signal GLOB ?")
+            values.append(signal)
+        where: str = "WHERE " + " AND ".join(conditions) if conditions else ""
+        query: str = ("SELECT libraries.file_name, symbols.name, pins.number, pins.name, "
+                      "pins.electrical_type, pins.unit FROM pins "
+                      "JOIN symbols ON pins.symbol_id = symbols.id "
+                      "JOIN libraries ON symbols.library_id = libraries.id "
+                      f"{where} ORDER BY symbols.name, pins.unit, pins.number")
+        return symbol_index.connection.execute(query, values).fetchall()
+
+
+# library_index_main():
+def library_index_main(arguments: List[str]) -> int:
+    """Add or update schematic libraries in a SymbolIndex database."""
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="kicube32 lib-index", description="Index the symbols and pins of KiCad .lib files.")
+    parser.add_argument("database_file_name", metavar="INDEX.db", help="Index database file")
+    parser.add_argument("lib_file_names", metavar="INPUT.lib", nargs="*",
+                        help="Libraries to add or update")
+    parser.add_argument("--verbose", action="store_true", help="Show each library indexed")
+    parsed_arguments: argparse.Namespace = parser.parse_args(arguments)
+    tracing: Text = " " if parsed_arguments.verbose else ""
+
+    try:
+        symbol_index: SymbolIndex = SymbolIndex(parsed_arguments.database_file_name)
+    except ValueError as error:
+        print(error)
+        return 1
+    pruned_file_name: str
+    for pruned_file_name in symbol_index.prune():
+        print(f"Removed '{pruned_file_name}' from index")
+    result: int = 0
+    lib_file_name: str
+    for lib_file_name in parsed_arguments.lib_file_names:
+        try:
+            symbol_index.library_update(lib_file_name, tracing=tracing)
+        except (OSError, KeyError) as error:
+            print(f"Unable to read '{lib_file_name}': {error}")
+            result = 1
+    symbol_index.close()
+    return result
+
+
+# library_query_main():
+def library_query_main(arguments: List[str]) -> int:
+    """Query a SymbolIndex database for pins."""
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="kicube32 lib-query", description="Search indexed KiCad symbols for pins.")
+    parser.add_argument("database_file_name", metavar="INDEX.db", help="Index database file")
+    parser.add_argument("--symbol", default="", help="Symbol name pattern")
+    parser.add_argument("--pin", default="", help="Pin name pattern (e.g. 'PA5')")
+    parser.add_argument("--number", default="", help="Pin number pattern")
+    parser.add_argument("--type", default="", help="Pin electrical type (e.g. 'input')")
+    parser.add_argument("--signal", default="", help="Pin signal pattern (e.g. 'SPI1_*')")
+    parsed_arguments: argparse.Namespace = parser.parse_args(arguments)
+    if not os.path.isfile(parsed_arguments.database_file_name):
+        print(f"Index '{parsed_arguments.database_file_name}' does not exist")
+        return 1
+
+    try:
+        symbol_index: SymbolIndex = SymbolIndex(parsed_arguments.database_file_name,
+                                                create=False)
+    except ValueError as error:
+        print(error)
+        return 1
+    rows: List[Tuple[Any, ...]] = symbol_index.pins_query(
+        parsed_arguments.symbol, parsed_arguments.pin, parsed_arguments.number,
+        parsed_arguments.type, parsed_arguments.signal)
+    symbol_index.close()
+    row: Tuple[Any, ...]
+    for row in rows:
+        file_name, symbol_name, number, name, electrical_type, unit = row
+        print(f"{os.path.basename(file_name)}:{symbol_name} {number:>5} {name:30} "
+              f"{electrical_type:15} unit {unit}")
+    return 0 if len(rows) > 0 else 1
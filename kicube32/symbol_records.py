@@ -0,0 +1,299 @@
+# This file is licensed using the "MIT License" below:
+#
+# ##################################################################################################
+#
+# MIT License
+#
+# Copyright 2019-2020 Home Brew Robotics Club
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies
+# or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+#
+# ##################################################################################################
+# <======================================= 100 characters =======================================> #
+
+
+"""symbol_records: Typed records for the lines of a legacy KiCad `.lib` schematic symbol.
+
+Each line of a symbol body (from `DEF` through `ENDDEF`) becomes one compact record:
+
+* `DEF name reference unused text_offset draw_numbers draw_names unit_count units_locked flag`
+  is a *DefRecord*.
+* `F0`..`F3` (and further `Fn` user fields) `"text" x y size orientation visibility
+  h_justify style ["name"]` are *FieldRecord*'s.
+* `S x1 y1 x2 y2 unit convert thickness fill` is a *RectangleRecord*.
+* `X name number x y length orientation number_size name_size unit convert type [shape]` is
+  a *PinRecord*.
+* Everything else (`DRAW`, `ENDDRAW`, `ENDDEF`, `ALIAS`, `$FPLIST`, polylines, arcs, text,
+  and any line that does not parse) is a *RawRecord* that keeps the line as is.
+
+A *SymbolBody* keeps the original lines next to the records and only reformats the line of a
+record that is replaced, so an unchanged symbol (or record) is written back byte for byte,
+whatever its spacing.  The pins are indexed by number, name and unit.
+"""
+
+from typing import Dict, List, NamedTuple, Optional, Set, Union
+
+import re
+
+FIELD_PATTERN: "re.Pattern[str]" = re.compile(
+    r'F(\d+)\s+"((?:[^"\\]|\\.)*)"\s+(-?\d+)\s+(-?\d+)\s+(\d+)\s+([HV])\s+([VI])\s+'
+    r'([LRC])\s+(\S+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*$')
+
+
+# DefRecord:
+class DefRecord(NamedTuple):
+    """Represents the `DEF` line of a symbol."""
+
+    name: str
+    reference: str
+    unused: str
+    text_offset: int
+    draw_numbers: str
+    draw_names: str
+    unit_count: int
+    units_locked: str
+    option_flag: str
+
+    # DefRecord.format():
+    def format(self) -> str:
+        """Return the `DEF` line for a DefRecord."""
+        return (f"DEF {self.name} {self.reference} {self.unused} {self.text_offset} "
+                f"{self.draw_numbers} {self.draw_names} {self.unit_count} "
+                f"{self.units_locked} {self.option_flag}")
+
+
+# FieldRecord:
+class FieldRecord(NamedTuple):
+    """Represents an `Fn` field line of a symbol."""
+
+    number: int
+    text: str
+    x: int
+    y: int
+    size: int
+    orientation: str
+    visibility: str
+    h_justify: str
+    style: str
+    name: str = ""
+
+    # FieldRecord.format():
+    def format(self) -> str:
+        """Return the `Fn` line for a FieldRecord."""
+        name: str = f' "{self.name}"' if self.name else ""
+        return (f'F{self.number} "{self.text}" {self.x} {self.y} {self.size} '
+                f"{self.orientation} {self.visibility} {self.h_justify} {self.style}{name}")
+
+
+# RectangleRecord:
+class RectangleRecord(NamedTuple):
+    """Represents an `S` rectangle line of a symbol."""
+
+    x1: int
+    y1: int
+    x2: int
+    y2: int
+    unit: int
+    convert: int
+    thickness: int
+    fill: str
+
+    # RectangleRecord.format():
+    def format(self) -> str:
+        """Return the `S` line for a RectangleRecord."""
+        return (f"S {self.x1} {self.y1} {self.x2} {self.y2} {self.unit} {self.convert} "
+                f"{self.thickness} {self.fill}")
+
+
+# PinRecord:
+class PinRecord(NamedTuple):
+    """Represents an `X` pin line of a symbol."""
+
+    name: str
+    number: str
+    x: int
+    y: int
+    length: int
+    orientation: str
+    number_size: int
+    name_size: int
+    unit: int
+    convert: int
+    electrical_type: str
+    shape: str = ""
+
+    # PinRecord.format():
+    def format(self) -> str:
+        """Return the `X` line for a PinRecord."""
+        shape: str = f" {self.shape}" if self.shape else ""
+        return (f"X {self.name} {self.number} {self.x} {self.y} {self.length} "
+                f"{self.orientation} {self.number_size} {self.name_size} {self.unit} "
+                f"{self.convert} {self.electrical_type}{shape}")
+
+
+# RawRecord:
+class RawRecord(NamedTuple):
+    """Represents any other line of a symbol, kept as is."""
+
+    kind: str
+    line: str
+
+    # RawRecord.format():
+    def format(self) -> str:
+        """Return the line of a RawRecord."""
+        return self.line
+
+
+Record = Union[DefRecord, FieldRecord, RectangleRecord, PinRecord, RawRecord]
+
+
+# record_parse():
+def record_parse(line: str) -> Record:
+    """Return the record for one symbol line.
+
+    A line that does not match its record format is returned as a RawRecord.
+    """
+    record: Optional[Record] = None
+    tokens: List[str] = line.split()
+    kind: str = tokens[0] if len(tokens) > 0 else ""
+    try:
+        if kind == "X" and len(tokens) in (12, 13):
+            record = PinRecord(tokens[1], tokens[2], int(tokens[3]), int(tokens[4]),
+                               int(tokens[5]), tokens[6], int(tokens[7]), int(tokens[8]),
+                               int(tokens[9]), int(tokens[10]), tokens[11],
+                               tokens[12] if len(tokens) == 13 else "")
+        elif kind == "S" and len(tokens) == 9:
+            record = RectangleRecord(int(tokens[1]), int(tokens[2]), int(tokens[3]),
+                                     int(tokens[4]), int(tokens[5]), int(tokens[6]),
+                                     int(tokens[7]), tokens[8])
+        elif kind == "DEF" and len(tokens) == 10:
+            record = DefRecord(tokens[1], tokens[2], tokens[3], int(tokens[4]), tokens[5],
+                               tokens[6], int(tokens[7]), tokens[8], tokens[9])
+        elif kind.startswith("F") and kind[1:].isdigit():
+            match: Optional["re.Match[str]"] = FIELD_PATTERN.match(line)
+            if match is not None:
+                record = FieldRecord(int(match.group(1)), match.group(2), int(match.group(3)),
+                                     int(match.group(4)), int(match.group(5)), match.group(6),
+                                     match.group(7), match.group(8), match.group(9),
+                                     match.group(10) or "")
+    except ValueError:
+        record = None
+    return RawRecord(kind, line) if record is None else record
+
+
+# SymbolBody:
+class SymbolBody:
+    """Represents the records of a schematic symbol along with indexes of its pins."""
+
+    # SymbolBody.__init__():
+    def __init__(self, lines: List[str]) -> None:
+        """Initialize a SymbolBody from the lines of a symbol.
+
+        *lines* is shared, not copied: replacing or inserting records updates it, so the
+        owner of *lines* (e.g. a *SchematicSymbol*) always sees the current text.
+        """
+        # symbol_body: SymbolBody = self
+        self.lines: List[str] = lines
+        self.records: List[Record] = [record_parse(line) for line in lines]
+        self.names_table: Dict[str, List[int]] = {}
+        self.numbers_table: Dict[str, List[int]] = {}
+        self.units_table: Dict[int, List[int]] = {}
+        self.pins_index()
+
+    # SymbolBody.pins_index():
+    def pins_index(self) -> None:
+        """Rebuild the pin number, name and unit indexes."""
+        symbol_body: SymbolBody = self
+        names_table: Dict[str, List[int]] = {}
+        numbers_table: Dict[str, List[int]] = {}
+        units_table: Dict[int, List[int]] = {}
+        index: int
+        record: Record
+        for index, record in enumerate(symbol_body.records):
+            if isinstance(record, PinRecord):
+                names_table.setdefault(record.name, []).append(index)
+                numbers_table.setdefault(record.number, []).append(index)
+                units_table.setdefault(record.unit, []).append(index)
+        symbol_body.names_table = names_table
+        symbol_body.numbers_table = numbers_table
+        symbol_body.units_table = units_table
+
+    # SymbolBody.definition():
+    def definition(self) -> Optional[DefRecord]:
+        """Return the DefRecord of the symbol, or None if the `DEF` line did not parse."""
+        record: Record = self.records[0]
+        return record if isinstance(record, DefRecord) else None
+
+    # SymbolBody.field_index():
+    def field_index(self, number: int) -> int:
+        """Return the record index of field *number*, or -1 if there is none."""
+        index: int
+        record: Record
+        for index, record in enumerate(self.records):
+            if isinstance(record, FieldRecord) and record.number == number:
+                return index
+        return -1
+
+    # SymbolBody.pins():
+    def pins(self) -> List[PinRecord]:
+        """Return the PinRecord's of the symbol in file order."""
+        return [record for record in self.records if isinstance(record, PinRecord)]
+
+    # SymbolBody.pins_find():
+    def pins_find(self, number: str = "", name: str = "", unit: int = -1) -> List[int]:
+        """Return the record indices of the pins that match all of the given criteria.
+
+        The arguments are:
+        * *number* (str): The pin number (empty matches any number.)
+        * *name* (str): The full pin name (empty matches any name.)
+        * *unit* (int): The unit (-1 matches any unit; 0 is the common unit.)
+        The indices are returned in file order; with no criteria, every pin is returned.
+        """
+        symbol_body: SymbolBody = self
+        candidates: List[List[int]] = []
+        if number:
+            candidates.append(symbol_body.numbers_table.get(number, []))
+        if name:
+            candidates.append(symbol_body.names_table.get(name, []))
+        if unit >= 0:
+            candidates.append(symbol_body.units_table.get(unit, []))
+        if len(candidates) == 0:
+            return sorted([index for indices in symbol_body.numbers_table.values()
+                           for index in indices])
+        candidates.sort(key=len)
+        others: List[Set[int]] = [set(other) for other in candidates[1:]]
+        return sorted([index for index in candidates[0]
+                       if all(index in other for other in others)])
+
+    # SymbolBody.record_replace():
+    def record_replace(self, index: int, record: Record) -> None:
+        """Replace the record (and line) at *index*."""
+        symbol_body: SymbolBody = self
+        old_record: Record = symbol_body.records[index]
+        symbol_body.records[index] = record
+        symbol_body.lines[index] = record.format()
+        if isinstance(old_record, PinRecord) or isinstance(record, PinRecord):
+            symbol_body.pins_index()
+
+    # SymbolBody.record_insert():
+    def record_insert(self, index: int, record: Record) -> None:
+        """Insert a record (and line) in front of *index*."""
+        symbol_body: SymbolBody = self
+        symbol_body.records.insert(index, record)
+        symbol_body.lines.insert(index, record.format())
+        symbol_body.pins_index()
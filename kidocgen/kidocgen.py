@@ -28,7 +28,7 @@
 
 """kidocgen generates a KiCAD .dcm file from a directory .csv files.
 
-Usage: kidocgen CSVS_DIR FILE.dcm  # Input Output
+Usage: kidocgen CSVS_DIR FILE.dcm [--metrics FILE.prom|FILE.json]  # Input Output
 
 `kidocgen` scans CSVS_DIR for a bunch of `.csv` files with the suffix of `.kipart.csv`.
 
@@ -37,12 +37,29 @@ This is:
 
 Part_Name,Reference_Prefix,Footprint_Name,Data_Sheet_URL,Short_Description;Long_Description
 Note that this is 4 commas and 1 semicolon.
+
+`kicube32 ... --dcm FILE.dcm` updates the `.dcm` entry of each generated part directly,
+which avoids rescanning the whole directory; both use `kicube32.doc_library` for the entries.
+
+`--metrics FILE.prom|FILE.json` writes the run metrics (see `kicube32.metrics`) at exit.
 """
 
 from pathlib import Path
 from typing import List
 import sys
 
+from kicube32.doc_library import DOC_LIBRARY_HEADER, component_lines
+from kicube32.metrics import Metrics
+
+# The maximum number of `.kipart.csv` files read concurrently:
+READS_IN_FLIGHT: int = 16
+
+
+def header_line_read(kipart_csv: Path) -> str:
+    """Return the first line of a `.kipart.csv` file."""
+    with open(kipart_csv) as kipart_csv_file:
+        return kipart_csv_file.readline().rstrip('\n')
+
 
 def strip_quotes(text: str) -> str:
     """Remove the double quotes surrounding a string."""
@@ -53,56 +70,70 @@ def strip_quotes(text: str) -> str:
 def main():
     """Generate a KiCAD `.dcm` file from a directory of `.csv` files.
 
-    Usage: kidocgen CSVS_DIR OUTPUT.dcm
+    Usage: kidocgen CSVS_DIR OUTPUT.dcm [--metrics FILE.prom|FILE.json]
     """
     error_code: int = 0
     arguments: List[str] = sys.argv
-    if len(arguments) <= 2:
-        print("Usage: kidocgen CSVS_DIR OUTPUT.dcm")
-        error_code = 1
-    else:
-        # Grab the two file names:
-        csvs_directory: Path = Path(arguments[1])
-        dcm_path: Path = Path(arguments[2])
-
-        # Collect the result a bunch of *lines*:
-        lines: List[str] = ["EESchema-DOCLIB  Version 2.0"]
-
-        # Sweep through all of the `*.kipart.csv` files in *csv_directory*:
-        kipart_csv: Path
-        for kipart_csv in csvs_directory.glob("*.kipart.csv"):
-            # print(f"file:{kipart_csv}")
-            with open(kipart_csv) as kipart_csv_file:
+
+    # Pull out the optional `--metrics FILE` option:
+    metrics_file_name: str = ""
+    if "--metrics" in arguments[:-1]:
+        metrics_index: int = arguments.index("--metrics")
+        metrics_file_name = arguments[metrics_index + 1]
+        arguments = arguments[:metrics_index] + arguments[metrics_index + 2:]
+    metrics: Metrics = Metrics(metrics_file_name)
+
+    try:
+        if len(arguments) <= 2:
+            print("Usage: kidocgen CSVS_DIR OUTPUT.dcm")
+            error_code = 1
+        else:
+            # Grab the two file names:
+            csvs_directory: Path = Path(arguments[1])
+            dcm_path: Path = Path(arguments[2])
+
+            # Collect the result a bunch of *lines*:
+            lines: List[str] = [DOC_LIBRARY_HEADER]
+
+            # Read the header lines of all of the `*.kipart.csv` files in *csv_directory*
+            # concurrently, since the directory may be on a high latency network file system:
+            kipart_csvs: List[Path] = list(csvs_directory.glob("*.kipart.csv"))
+            import concurrent.futures  # Only imported here to keep start up fast.
+            with metrics.stage("kipart-scan"):
+                with concurrent.futures.ThreadPoolExecutor(max_workers=READS_IN_FLIGHT) as executor:
+                    header_lines: List[str] = list(executor.map(header_line_read, kipart_csvs))
+            metrics.count("kicube32_read_bytes_total",
+                          sum([len(header_line.encode()) + 1 for header_line in header_lines]))
+
+            # Sweep through all of the *header_lines*:
+            header_line: str
+            for header_line in header_lines:
                 # Parse the header line:
-                kipart_csv_text: str = kipart_csv_file.read()
-                kipart_csv_lines: List[str] = kipart_csv_text.split('\n')
-                header: str = strip_quotes(kipart_csv_lines[0]) if len(kipart_csv_lines) > 0 else ""
+                header: str = strip_quotes(header_line)
                 fields: List[str] = header.split(',')
                 name: str = strip_quotes(fields[0]) if len(fields) > 0 else "~"
                 data_sheet: str = strip_quotes(fields[3]) if len(fields) > 3 else ""
                 descriptions_text: str = strip_quotes(fields[5]) if len(fields) > 5 else ""
-                descriptions: List[str] = descriptions_text.split(';')
-                long_description: str = descriptions[0].strip() if len(descriptions) > 0 else "~"
-                short_description: str = descriptions[1].strip() if len(descriptions) > 1 else "~"
 
                 # Output the data:
                 if name != "~":
-                    lines.append("#")
-                    lines.append(f"$CMP {name}")
-                    lines.append(f"D {long_description}")
-                    lines.append(f"K {short_description}")
-                    lines.append(f"F {data_sheet}")
-                    lines.append("$ENDCMP")
-
-    # Put the trailing lines in place:
-    lines.append("#")
-    lines.append("#End Doc Library")
-    lines.append("")
-
-    # Write *lines* out to *dcm_path*:
-    master_board_dcm_text: str = '\n'.join(lines)
-    with open(dcm_path, "w") as master_board_dcm_file:
-        master_board_dcm_file.write(master_board_dcm_text)
+                    lines.extend(component_lines(name, data_sheet, descriptions_text))
+                    metrics.count("kicube32_projects_total", result="ok")
+
+        # Put the trailing lines in place:
+        lines.append("#")
+        lines.append("#End Doc Library")
+        lines.append("")
+
+        # Write *lines* out to *dcm_path*:
+        master_board_dcm_text: str = '\n'.join(lines)
+        with metrics.stage("dcm-write"):
+            with open(dcm_path, "w") as master_board_dcm_file:
+                master_board_dcm_file.write(master_board_dcm_text)
+        metrics.file_written(str(dcm_path))
+    finally:
+        # Export the metrics even when the run fails:
+        metrics.write()
 
     # Return with an error code (0 => OK, 1 => Not OK):
     return error_code
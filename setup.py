@@ -52,6 +52,10 @@ setuptools.setup(
             "kidocgen=kidocgen.kidocgen:main",
         ],
     },
+    extras_require={
+        # Linters and type checker run by the Makefile:
+        "dev": ["flake8", "mypy", "pydocstyle"],
+    },
     include_package_data=True,
     install_requires=([]),
     license="MIT",
@@ -62,7 +66,7 @@ setuptools.setup(
         "kicube32",
         "kidocgen",
     ],
-    python_requires=">=3.6",
+    python_requires=">=3.7",
     url="https://github.com/waynegramlich/kicube32",
     version="0.0.1",
 )